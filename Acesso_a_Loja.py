@@ -1,8 +1,10 @@
 import streamlit as st
 from utils import select_store
+from instrumentacao import medir_pagina
 
 st.set_page_config(page_title="Acesso à Loja", layout="wide")
 
+@medir_pagina("Acesso à Loja")
 def main():
     st.title("Acesso à Loja")
     select_store()
@@ -0,0 +1,88 @@
+"""
+Compara a leitura de itens de NF-e feita antes na página de Entrada XML
+(xmltodict.parse + json.loads(json.dumps(...))) com o leitor incremental
+de nfe.py, em tempo e pico de memória.
+
+Uso:
+    python benchmarks/bench_nfe.py --itens 100 1000 10000
+
+As notas são sintéticas, geradas em memória com o namespace do Portal Fiscal.
+Não precisa de banco de dados.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import xmltodict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nfe import iterar_itens_nfe  # noqa: E402
+
+DET = """<det nItem="{n}"><prod><cProd>{cod}</cProd><cEAN>SEM GTIN</cEAN>
+<xProd>PRODUTO {n}</xProd><NCM>21069090</NCM><CFOP>5102</CFOP><uCom>UN</uCom>
+<qCom>{qtd}.0000</qCom><vUnCom>10.0000000000</vUnCom><vProd>{total}.00</vProd></prod>
+<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>{total}.00</vBC></ICMS00></ICMS>
+<PIS><PISAliq><CST>01</CST><vPIS>0.00</vPIS></PISAliq></PIS></imposto></det>"""
+
+
+def gerar_nfe(itens):
+    dets = "".join(DET.format(n=n, cod=1000 + n % 500, qtd=n % 20 + 1, total=(n % 20 + 1) * 10)
+                   for n in range(1, itens + 1))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        '<NFe><infNFe Id="NFe35240100000000000000550010000000011000000010" versao="4.00">'
+        f'<ide><nNF>1</nNF></ide>{dets}<total/></infNFe></NFe>'
+        '<protNFe><infProt><chNFe>35240100000000000000550010000000011000000010</chNFe></infProt></protNFe>'
+        '</nfeProc>'
+    ).encode("utf-8")
+
+
+def via_xmltodict(conteudo):
+    json_data = json.loads(json.dumps(xmltodict.parse(conteudo)))
+    items = json_data.get("nfeProc", {}).get("NFe", {}).get("infNFe", {}).get("det")
+    if not isinstance(items, list):
+        items = [items]
+    return [(i.get("prod", {}).get("cProd"), i.get("prod", {}).get("qCom")) for i in items]
+
+
+def via_iterparse(conteudo):
+    return [(i.get("cProd"), i.get("qCom")) for i in iterar_itens_nfe(conteudo)]
+
+
+def medir(funcao, conteudo, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao(conteudo)
+        tempos.append(time.perf_counter() - inicio)
+    tracemalloc.start()
+    funcao(conteudo)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(tempos), pico, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--itens", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'itens':>7} {'KiB xml':>8}  {'leitor':<11} {'ms':>9} {'pico MiB':>9}")
+    for itens in args.itens:
+        conteudo = gerar_nfe(itens)
+        resultados = []
+        for nome, funcao in (("xmltodict", via_xmltodict), ("iterparse", via_iterparse)):
+            segundos, pico, resultado = medir(funcao, conteudo, args.repeticoes)
+            resultados.append(resultado)
+            print(f"{itens:>7} {len(conteudo) / 1024:>8.0f}  {nome:<11} "
+                  f"{segundos * 1000:>9.1f} {pico / 2**20:>9.1f}")
+        assert resultados[0] == resultados[1], "os dois leitores devem extrair os mesmos itens"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Benchmark da camada de acesso a dados (utils.py) em um PostgreSQL descartável.
+
+Sobe um cluster temporário com initdb/pg_ctl (ou usa --dsn), cria o schema
+do app, gera lojas, catálogo, estoque e histórico sintéticos e mede, para cada
+tamanho de carga, a latência e o número de idas ao banco (comandos + commits)
+de cada função. O resultado vai para um JSON, para acompanhar regressões.
+
+Uso:
+    python benchmarks/bench_utils.py                          # 10, 1.000 e 100.000 itens
+    python benchmarks/bench_utils.py --tamanhos 10 1000 --historico 20000
+    python benchmarks/bench_utils.py --dsn postgresql://usuario@localhost/bench_estoque
+
+O initdb não roda como root; nesse caso use --dsn com um banco vazio de testes.
+Precisa de streamlit instalado (utils.py usa os caches do Streamlit), mas não
+de secrets.toml: o pool do app é trocado por um apontado para o banco de teste.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils  # noqa: E402
+import manutencao  # noqa: E402
+
+SCHEMA_BASE = """
+    CREATE TABLE lojas (
+        id   serial PRIMARY KEY,
+        nome text NOT NULL
+    );
+    CREATE TABLE produtos (
+        id             integer PRIMARY KEY,
+        nome           text NOT NULL,
+        categoria      text,
+        unidade_medida text,
+        valor          numeric
+    );
+    CREATE TABLE estoque (
+        loja_id          integer NOT NULL REFERENCES lojas (id),
+        produto_id       integer NOT NULL REFERENCES produtos (id),
+        quantidade       integer NOT NULL DEFAULT 0,
+        data_atualizacao timestamp,
+        data_contagem    date,
+        PRIMARY KEY (loja_id, produto_id)
+    );
+    CREATE TABLE movimentacoes_estoque (
+        id         serial PRIMARY KEY,
+        tipo       text    NOT NULL,
+        produto_id integer NOT NULL REFERENCES produtos (id),
+        loja_id    integer NOT NULL REFERENCES lojas (id),
+        quantidade integer NOT NULL,
+        motivo     text,
+        data       timestamp NOT NULL
+    );
+    CREATE TABLE lote_validade (
+        id         serial PRIMARY KEY,
+        produto_id integer NOT NULL REFERENCES produtos (id),
+        loja_id    integer NOT NULL REFERENCES lojas (id),
+        data       timestamp NOT NULL,
+        vencimento date NOT NULL,
+        quantidade integer NOT NULL,
+        lote       text
+    );
+"""
+
+# Contadores de idas ao banco, somados por todas as conexões do benchmark
+IDAS = {"comandos": 0, "commits": 0}
+
+
+class CursorContador(psycopg2.extensions.cursor):
+    def execute(self, sql, args=None):
+        IDAS["comandos"] += 1
+        return super().execute(sql, args)
+
+    def executemany(self, sql, args_seq):
+        args_seq = list(args_seq)
+        IDAS["comandos"] += len(args_seq)
+        return super().executemany(sql, args_seq)
+
+    def copy_expert(self, sql, arquivo, size=8192):
+        IDAS["comandos"] += 1
+        return super().copy_expert(sql, arquivo, size)
+
+
+class ConexaoContadora(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CursorContador
+
+    def commit(self):
+        IDAS["commits"] += 1
+        return super().commit()
+
+    def rollback(self):
+        IDAS["commits"] += 1
+        return super().rollback()
+
+
+class PostgresDescartavel:
+    """Cluster PostgreSQL temporário (initdb + pg_ctl), apagado ao sair."""
+
+    def __init__(self, bin_dir=None):
+        self._bin = lambda nome: os.path.join(bin_dir, nome) if bin_dir else (shutil.which(nome) or nome)
+
+    def __enter__(self):
+        self._dir = tempfile.mkdtemp(prefix="bench_estoque_")
+        dados = os.path.join(self._dir, "dados")
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            porta = s.getsockname()[1]
+        subprocess.run([self._bin("initdb"), "-D", dados, "-U", "bench", "--auth=trust",
+                        "-E", "UTF8", "--no-sync"], check=True, capture_output=True)
+        # Durabilidade desligada: o cluster é descartável e medimos o app, não o disco
+        opcoes = (f"-p {porta} -k {self._dir} -c listen_addresses='' "
+                  "-c fsync=off -c synchronous_commit=off -c full_page_writes=off")
+        subprocess.run([self._bin("pg_ctl"), "-D", dados, "-o", opcoes, "-w",
+                        "-l", os.path.join(self._dir, "postgres.log"), "start"],
+                       check=True, capture_output=True)
+        self._dados = dados
+        self.dsn = f"host={self._dir} port={porta} user=bench dbname=postgres"
+        return self
+
+    def __exit__(self, *exc):
+        subprocess.run([self._bin("pg_ctl"), "-D", self._dados, "-m", "immediate", "stop"],
+                       capture_output=True)
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+def preparar_banco(dsn, tamanhos, historico):
+    """Cria o schema e gera uma loja por tamanho, catálogo e histórico sintéticos."""
+    produtos = max(max(tamanhos), 1000)
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(SCHEMA_BASE)
+        cursor.execute("""
+            INSERT INTO lojas (nome) SELECT 'Loja ' || g FROM generate_series(1, %s) g
+        """, (len(tamanhos),))
+        cursor.execute("""
+            INSERT INTO produtos (id, nome, categoria, unidade_medida, valor)
+            SELECT g, 'Produto ' || lpad(g::text, 6, '0'), 'Categoria ' || (g %% 20), 'UN', (g %% 100) + 0.99
+            FROM generate_series(1, %s) g
+        """, (produtos,))
+        for loja_id, n in enumerate(tamanhos, start=1):
+            cursor.execute("""
+                INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao)
+                SELECT %s, g, (random() * 100)::int, now() FROM generate_series(1, %s) g
+            """, (loja_id, n))
+            cursor.execute("""
+                INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
+                SELECT CASE WHEN random() < 0.3 THEN 'entrada' ELSE 'saida' END,
+                       1 + (random() * (%s - 1))::int, %s, 1 + (random() * 20)::int, 'Histórico',
+                       now() - random() * interval '365 days'
+                FROM generate_series(1, %s)
+            """, (n, loja_id, historico))
+        cursor.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def medir(nome, n, funcao, repeticoes):
+    tempos, idas = [], []
+    for _ in range(repeticoes):
+        IDAS["comandos"] = IDAS["commits"] = 0
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+        idas.append(IDAS["comandos"] + IDAS["commits"])
+    resultado = {
+        "funcao": nome,
+        "itens": n,
+        "segundos_min": min(tempos),
+        "segundos_med": sorted(tempos)[len(tempos) // 2],
+        "idas_ao_banco": max(idas),
+        "itens_por_s": n / min(tempos) if min(tempos) else None,
+    }
+    print(f"{nome:<28} {n:>8} {resultado['segundos_min']:>10.4f} {resultado['idas_ao_banco']:>6}")
+    return resultado
+
+
+def rodar(dsn, tamanhos, repeticoes):
+    # O app passa a usar um pool apontado para o banco de teste, com contagem de idas
+    pool = utils.PoolConexoes({"dsn": dsn, "connection_factory": ConexaoContadora}, tamanho_max=4)
+    utils.get_pool = lambda: pool
+    manutencao.criar_estruturas()
+    manutencao.backfill_historico_mensal()
+    mes_passado = (dt.date.today().replace(day=1) - dt.timedelta(days=1)).replace(day=1)
+
+    print(f"{'função':<28} {'itens':>8} {'segundos':>10} {'idas':>6}")
+    resultados = []
+    for loja_id, n in enumerate(tamanhos, start=1):
+        produtos = list(range(1, n + 1))
+        agora = dt.datetime.now()
+
+        def estoque_sem_cache():
+            utils.invalidar_estoque(loja_id)
+            utils.get_estoque_loja(loja_id)
+
+        casos = [
+            ("registrar_entrada", lambda: utils.registrar_entrada(
+                loja_id, [{"id": p, "quantidade": 5, "motivo": ""} for p in produtos])),
+            ("registrar_saida_planilha", lambda: utils.registrar_saida_planilha(
+                loja_id, [{"produto_id": p, "quantidade": 2} for p in produtos], agora)),
+            ("registrar_entrada_xml", lambda: utils.registrar_entrada_xml(
+                loja_id, [{"id": str(p), "quantidade": "3.0000", "motivo": "", "data": agora.isoformat()}
+                          for p in produtos])),
+            ("atualizar_estoque", lambda: utils.atualizar_estoque(
+                loja_id, {p: random.randint(0, 100) for p in produtos}, dt.date.today())),
+            ("get_estoque_loja", estoque_sem_cache),
+            ("get_estoque_loja (cache)", lambda: utils.get_estoque_loja(loja_id)),
+            ("get_historico_mensal", lambda: utils.get_historico_mensal(loja_id, mes_passado)),
+        ]
+        for nome, funcao in casos:
+            resultados.append(medir(nome, n, funcao, repeticoes))
+    pool.fechar()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dsn", help="banco vazio já existente (em vez do cluster temporário)")
+    parser.add_argument("--pg-bin", help="pasta com initdb e pg_ctl, se não estiverem no PATH")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--historico", type=int, default=100000,
+                        help="movimentações sintéticas por loja antes das medições")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--saida", default="bench_utils.json")
+    args = parser.parse_args()
+
+    def executar(dsn):
+        preparar_banco(dsn, args.tamanhos, args.historico)
+        return rodar(dsn, args.tamanhos, args.repeticoes)
+
+    if args.dsn:
+        resultados = executar(args.dsn)
+    else:
+        with PostgresDescartavel(args.pg_bin) as pg:
+            resultados = executar(pg.dsn)
+
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump({
+            "executado_em": dt.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "maquina": platform.platform(),
+            "tamanhos": args.tamanhos,
+            "historico_por_loja": args.historico,
+            "repeticoes": args.repeticoes,
+            "resultados": resultados,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Cache em memória, por processo, com invalidação explícita.
+
+Cada chave tem um contador de versão: quem grava no banco chama `invalidar`,
+a versão sobe e a próxima leitura vai ao banco. Além disso, as entradas
+expiram após `ttl` segundos e o cache guarda no máximo `max_entradas`
+chaves, descartando as menos usadas recentemente.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheVersionado:
+
+    def __init__(self, ttl=300.0, max_entradas=256):
+        self._ttl = ttl
+        self._max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._dados = OrderedDict()  # chave -> (versão, criado_em, valor)
+        self._versoes = {}
+        self._geracao = 0
+        self._stats = {"hits": 0, "misses": 0, "expiradas": 0, "invalidacoes": 0, "descartadas": 0}
+
+    def _versao(self, chave):
+        return (self._geracao, self._versoes.get(chave, 0))
+
+    def obter(self, chave, carregar):
+        """Devolve o valor em cache para `chave` ou chama `carregar()` e guarda o resultado."""
+        with self._lock:
+            versao = self._versao(chave)
+            item = self._dados.get(chave)
+            if item is not None and item[0] == versao:
+                if time.monotonic() - item[1] < self._ttl:
+                    self._dados.move_to_end(chave)
+                    self._stats["hits"] += 1
+                    return item[2]
+                self._stats["expiradas"] += 1
+            self._stats["misses"] += 1
+
+        valor = carregar()
+
+        with self._lock:
+            # Se houve gravação durante a carga, o valor já nasceu velho: não guarda
+            if self._versao(chave) == versao:
+                self._dados[chave] = (versao, time.monotonic(), valor)
+                self._dados.move_to_end(chave)
+                while len(self._dados) > self._max_entradas:
+                    self._dados.popitem(last=False)
+                    self._stats["descartadas"] += 1
+        return valor
+
+    def invalidar(self, chave=None):
+        """Invalida uma chave, ou todas quando `chave` é None."""
+        with self._lock:
+            if chave is None:
+                self._geracao += 1
+                self._dados.clear()
+            else:
+                self._versoes[chave] = self._versoes.get(chave, 0) + 1
+                self._dados.pop(chave, None)
+            self._stats["invalidacoes"] += 1
+
+    def versao(self, chave=None):
+        """Versão atual da chave; útil para compor chaves de outros caches."""
+        with self._lock:
+            return self._versao(chave)
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entradas"] = len(self._dados)
+        consultas = stats["hits"] + stats["misses"]
+        stats["taxa_acerto"] = stats["hits"] / consultas if consultas else 0.0
+        return stats
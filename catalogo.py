@@ -0,0 +1,93 @@
+"""
+Catálogo de produtos em memória, com índices para busca e validação.
+
+Guarda id, nome e categoria em listas paralelas e monta, uma vez por carga:
+- id -> posição, para consultas O(1) na validação de planilhas;
+- nomes normalizados (minúsculos, sem acento) ordenados, para busca por prefixo;
+- um texto único com todos os nomes normalizados, para busca por trecho.
+"""
+import bisect
+import unicodedata
+
+import numpy as np
+
+
+# "Pão de Queijo " -> "pao de queijo"
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.lower().split())
+
+
+class Catalogo:
+
+    def __init__(self, linhas):
+        """`linhas` são tuplas (id, nome, categoria), na ordem de exibição."""
+        self._linhas = [tuple(linha) for linha in linhas]
+        self.ids = np.fromiter((linha[0] for linha in self._linhas), dtype=np.int64, count=len(self._linhas))
+        self._posicao = {linha[0]: i for i, linha in enumerate(self._linhas)}
+
+        normalizados = [normalizar(linha[1]) for linha in self._linhas]
+        ordem = sorted(range(len(normalizados)), key=normalizados.__getitem__)
+        self._prefixos = [normalizados[i] for i in ordem]
+        self._prefixos_pos = ordem
+
+        self._texto = "\n".join(normalizados)
+        self._inicios = []
+        inicio = 0
+        for nome in normalizados:
+            self._inicios.append(inicio)
+            inicio += len(nome) + 1
+
+    def __len__(self):
+        return len(self._linhas)
+
+    def linhas(self):
+        return list(self._linhas)
+
+    def get(self, produto_id):
+        """Tupla (id, nome, categoria) do produto, ou None."""
+        pos = self._posicao.get(produto_id)
+        return self._linhas[pos] if pos is not None else None
+
+    def contem(self, produto_id):
+        return produto_id in self._posicao
+
+    def nome(self, produto_id, padrao=None):
+        linha = self.get(produto_id)
+        return linha[1] if linha else padrao
+
+    def desconhecidos(self, ids):
+        """Máscara booleana (vetorizada) dos ids que não existem no catálogo."""
+        return ~np.isin(np.asarray(ids), self.ids)
+
+    def buscar(self, termo, limite=50):
+        """
+        Produtos cujo nome começa com `termo` e, em seguida, os que contêm
+        `termo`, ignorando caixa e acentos. Um termo numérico também casa com o id.
+        """
+        termo = normalizar(termo)
+        if not termo:
+            return self._linhas[:limite]
+        posicoes = []
+        vistos = set()
+
+        def adicionar(pos):
+            if pos not in vistos:
+                vistos.add(pos)
+                posicoes.append(pos)
+
+        if termo.isdigit() and int(termo) in self._posicao:
+            adicionar(self._posicao[int(termo)])
+
+        i = bisect.bisect_left(self._prefixos, termo)
+        while i < len(self._prefixos) and len(posicoes) < limite and self._prefixos[i].startswith(termo):
+            adicionar(self._prefixos_pos[i])
+            i += 1
+
+        inicio = self._texto.find(termo)
+        while inicio != -1 and len(posicoes) < limite:
+            adicionar(bisect.bisect_right(self._inicios, inicio) - 1)
+            inicio = self._texto.find(termo, inicio + 1)
+
+        return [self._linhas[pos] for pos in posicoes[:limite]]
@@ -0,0 +1,273 @@
+"""
+Conferência do estoque contra o livro de movimentações, loja por loja.
+
+Para cada loja, `consistencia_saldos` guarda o saldo de cada produto somado
+a partir de movimentacoes_estoque até uma marca (o maior id já somado, em
+`consistencia_marcas`). Cada execução soma só as movimentações novas desde a
+marca e compara, em um único snapshot, `estoque.quantidade` com o saldo
+somado mais as movimentações ainda não dobradas na marca. As divergências
+da última execução de cada loja ficam em `consistencia_divergencias`.
+
+Ids de movimentação são reservados antes do commit, então uma transação com
+id menor pode terminar depois de outra com id maior, e esperar uma execução
+não basta: uma carga longa pode continuar aberta. Cada execução anota, junto
+com o maior id visto (`proximo_limite`), o xmax do seu snapshot
+(`limite_xmax`); a marca só avança até esse limite quando o xmin do snapshot
+de uma execução seguinte já passou de `limite_xmax`, isto é, quando toda
+transação que estava aberta ao anotar o limite já terminou. As gravações
+atualizam `estoque` antes de inserir as movimentações, então a transação já
+tem xid quando reserva o id. Enquanto isso, o que não foi somado entra na
+comparação pela "cauda" (id > marca), lida no mesmo snapshot do estoque.
+
+Uma reconstrução (`--reconstruir`) soma o histórico de novo a partir do que
+está em movimentacoes_estoque. Os meses arquivados com `arquivar-mes` (em
+meses_arquivados) não estão mais lá; para eles o saldo parte do resumo
+movimentacoes_mensais, menos as movimentações desses meses que ainda estão no
+livro (retroativas gravadas na partição padrão depois do arquivamento), que
+entram de novo pela soma normal. Sem o resumo completo desses meses, as
+divergências de uma reconstrução não valem.
+
+As lojas são conferidas em paralelo em processos separados, cada um com
+sua própria conexão.
+
+Uso:
+    python consistencia.py [--loja ID ...] [--workers N] [--reconstruir]
+"""
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from tarefas import dividir_em_lotes
+from utils import get_db_connection, get_executor_tarefas
+
+WORKERS_PADRAO = 4
+
+COLUNAS_SITUACAO = ["loja_id", "loja", "verificado_em", "divergencias", "duracao_s", "ultimo_id"]
+COLUNAS_DIVERGENCIA = ["loja_id", "loja", "produto_id", "produto", "saldo_estoque",
+                       "saldo_movimentacoes", "diferenca", "verificado_em"]
+
+
+def listar_lojas():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM lojas ORDER BY id")
+            return [loja_id for (loja_id,) in cursor.fetchall()]
+
+
+def verificar_loja(loja_id, reconstruir=False):
+    """
+    Dobra as movimentações novas da loja na marca, compara com o estoque e
+    regrava as divergências da loja. Devolve um resumo da execução.
+    """
+    inicio = time.perf_counter()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Estoque, saldos e cauda precisam ser lidos no mesmo snapshot
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            if reconstruir:
+                cursor.execute("DELETE FROM consistencia_saldos WHERE loja_id = %s", (loja_id,))
+                cursor.execute("DELETE FROM consistencia_marcas WHERE loja_id = %s", (loja_id,))
+                # Meses arquivados: saldo do resumo mensal menos o que ainda está no livro
+                cursor.execute("""
+                    INSERT INTO consistencia_saldos (loja_id, produto_id, saldo)
+                    SELECT %(loja)s, produto_id, SUM(saldo)
+                    FROM (
+                        SELECT produto_id, total_entradas - total_saidas AS saldo
+                        FROM movimentacoes_mensais
+                        WHERE loja_id = %(loja)s AND mes IN (SELECT mes FROM meses_arquivados)
+                        UNION ALL
+                        SELECT produto_id, CASE WHEN tipo = 'entrada' THEN -quantidade ELSE quantidade END
+                        FROM movimentacoes_estoque
+                        WHERE loja_id = %(loja)s
+                          AND date_trunc('month', data)::date IN (SELECT mes FROM meses_arquivados)
+                    ) arquivados
+                    GROUP BY produto_id
+                    ORDER BY produto_id
+                """, {"loja": loja_id})
+            cursor.execute("""
+                INSERT INTO consistencia_marcas (loja_id) VALUES (%s)
+                ON CONFLICT (loja_id) DO NOTHING
+            """, (loja_id,))
+            cursor.execute("""
+                SELECT ultimo_id, proximo_limite, limite_xmax FROM consistencia_marcas
+                WHERE loja_id = %s FOR UPDATE
+            """, (loja_id,))
+            ultimo_id, limite, limite_xmax = cursor.fetchone()
+            cursor.execute("""
+                SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint,
+                       pg_snapshot_xmax(pg_current_snapshot())::text::bigint
+            """)
+            xmin, xmax = cursor.fetchone()
+
+            # 1) Dobra (ultimo_id, limite] nos saldos, se nenhuma transação que
+            # estava aberta quando o limite foi anotado ainda está aberta
+            pronto = limite <= ultimo_id or (limite_xmax is not None and xmin >= limite_xmax)
+            ate = limite if pronto else ultimo_id
+            cursor.execute("""
+                INSERT INTO consistencia_saldos (loja_id, produto_id, saldo)
+                SELECT loja_id, produto_id,
+                       SUM(CASE WHEN tipo = 'entrada' THEN quantidade ELSE -quantidade END)
+                FROM movimentacoes_estoque
+                WHERE loja_id = %s AND id > %s AND id <= %s
+                GROUP BY loja_id, produto_id
+                ORDER BY produto_id
+                ON CONFLICT (loja_id, produto_id)
+                DO UPDATE SET saldo = consistencia_saldos.saldo + EXCLUDED.saldo
+            """, (loja_id, ultimo_id, ate))
+            dobradas = cursor.rowcount
+            novo_ultimo = max(ultimo_id, ate)
+
+            # 2) Estoque x (saldo dobrado + cauda id > marca), no mesmo snapshot
+            marca = {"loja": loja_id, "marca": novo_ultimo}
+            cursor.execute("""
+                SELECT MAX(id), COUNT(*) FROM movimentacoes_estoque
+                WHERE loja_id = %(loja)s AND id > %(marca)s
+            """, marca)
+            maior_id, cauda = cursor.fetchone()
+            cursor.execute("DELETE FROM consistencia_divergencias WHERE loja_id = %s", (loja_id,))
+            cursor.execute("""
+                WITH cauda AS (
+                    SELECT produto_id,
+                           SUM(CASE WHEN tipo = 'entrada' THEN quantidade ELSE -quantidade END) AS variacao
+                    FROM movimentacoes_estoque
+                    WHERE loja_id = %(loja)s AND id > %(marca)s
+                    GROUP BY produto_id
+                ), livro AS (
+                    SELECT COALESCE(s.produto_id, c.produto_id) AS produto_id,
+                           COALESCE(s.saldo, 0) + COALESCE(c.variacao, 0) AS saldo
+                    FROM (SELECT produto_id, saldo FROM consistencia_saldos WHERE loja_id = %(loja)s) s
+                    FULL JOIN cauda c ON c.produto_id = s.produto_id
+                ), comparacao AS (
+                    SELECT COALESCE(e.produto_id, l.produto_id) AS produto_id,
+                           COALESCE(e.quantidade, 0) AS saldo_estoque,
+                           COALESCE(l.saldo, 0) AS saldo_movimentacoes
+                    FROM (SELECT produto_id, quantidade FROM estoque WHERE loja_id = %(loja)s) e
+                    FULL JOIN livro l ON l.produto_id = e.produto_id
+                )
+                INSERT INTO consistencia_divergencias
+                    (loja_id, produto_id, saldo_estoque, saldo_movimentacoes, diferenca)
+                SELECT %(loja)s, produto_id, saldo_estoque, saldo_movimentacoes,
+                       saldo_estoque - saldo_movimentacoes
+                FROM comparacao
+                WHERE saldo_estoque <> saldo_movimentacoes
+                ORDER BY produto_id
+            """, marca)
+            divergencias = cursor.rowcount
+
+            # 3) Avança a marca e anota o novo limite (o maior id visto agora) com o
+            # xmax deste snapshot; um limite ainda não dobrado fica como estava
+            # (sem xmax anotado, vale o deste snapshot, que é posterior)
+            duracao = time.perf_counter() - inicio
+            if pronto:
+                limite, limite_xmax = max(novo_ultimo, maior_id or 0), xmax
+            elif limite_xmax is None:
+                limite_xmax = xmax
+            cursor.execute("""
+                UPDATE consistencia_marcas
+                SET ultimo_id = %s, proximo_limite = %s, limite_xmax = %s, divergencias = %s,
+                    verificado_em = CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo',
+                    duracao_s = %s
+                WHERE loja_id = %s
+            """, (novo_ultimo, limite, limite_xmax, divergencias, duracao, loja_id))
+        conn.commit()
+    return {
+        "loja_id": loja_id,
+        "divergencias": divergencias,
+        "produtos_dobrados": dobradas,
+        "movimentos_na_cauda": cauda,
+        "duracao_s": duracao,
+        "erro": None,
+    }
+
+
+# Executada em um processo do pool; erros voltam no resumo em vez de derrubar as outras lojas
+def _verificar_em_processo(argumentos):
+    loja_id, reconstruir = argumentos
+    try:
+        return verificar_loja(loja_id, reconstruir)
+    except Exception as e:
+        return {"loja_id": loja_id, "divergencias": None, "produtos_dobrados": 0,
+                "movimentos_na_cauda": 0, "duracao_s": 0.0, "erro": f"{type(e).__name__}: {e}"}
+
+
+def verificar_lojas(lojas=None, workers=WORKERS_PADRAO, reconstruir=False):
+    """
+    Confere as lojas (todas, por padrão) em até `workers` processos e devolve
+    um resumo por loja. O pool usa "spawn" para não herdar as threads do
+    servidor Streamlit.
+    """
+    lojas = list(lojas) if lojas is not None else listar_lojas()
+    argumentos = [(loja_id, reconstruir) for loja_id in lojas]
+    if workers <= 1 or len(lojas) <= 1:
+        return [_verificar_em_processo(a) for a in argumentos]
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(lojas)), mp_context=contexto) as pool:
+        return list(pool.map(_verificar_em_processo, argumentos))
+
+
+# Pela página: as lojas vão em lotes de `workers`, cada lote conferido em
+# paralelo, para o progresso da tarefa andar loja a loja
+def enviar_verificacao(lojas=None, workers=WORKERS_PADRAO):
+    lojas = list(lojas) if lojas is not None else listar_lojas()
+    return get_executor_tarefas().enviar(
+        "consistencia", f"Conferência de estoque ({len(lojas)} lojas)",
+        dividir_em_lotes(lojas, max(workers, 1)),
+        lambda lote: verificar_lojas(lote, workers),
+        combinar=lambda parciais: [r for parcial in parciais for r in parcial],
+    )
+
+
+# Última conferência de cada loja (lojas nunca conferidas aparecem sem data)
+def situacao_lojas():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT l.id, l.nome, m.verificado_em, m.divergencias, m.duracao_s, m.ultimo_id
+                FROM lojas l
+                LEFT JOIN consistencia_marcas m ON m.loja_id = l.id
+                ORDER BY l.nome
+            """)
+            return pd.DataFrame(cursor.fetchall(), columns=COLUNAS_SITUACAO)
+
+
+def listar_divergencias(loja_id=None):
+    filtro = "WHERE d.loja_id = %s" if loja_id is not None else ""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT d.loja_id, l.nome, d.produto_id, p.nome, d.saldo_estoque,
+                       d.saldo_movimentacoes, d.diferenca, d.verificado_em
+                FROM consistencia_divergencias d
+                JOIN lojas l ON l.id = d.loja_id
+                LEFT JOIN produtos p ON p.id = d.produto_id
+                {filtro}
+                ORDER BY l.nome, ABS(d.diferenca) DESC
+            """, (loja_id,) if loja_id is not None else ())
+            return pd.DataFrame(cursor.fetchall(), columns=COLUNAS_DIVERGENCIA)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confere o estoque contra o livro de movimentações")
+    parser.add_argument("--loja", type=int, action="append", help="confere só esta loja (pode repetir)")
+    parser.add_argument("--workers", type=int, default=WORKERS_PADRAO, help="processos em paralelo")
+    parser.add_argument("--reconstruir", action="store_true",
+                        help="descarta os saldos dobrados e soma o histórico inteiro de novo")
+    args = parser.parse_args()
+
+    falhas = 0
+    for r in verificar_lojas(args.loja, args.workers, args.reconstruir):
+        if r["erro"]:
+            falhas += 1
+            print(f"loja {r['loja_id']}: ERRO {r['erro']}")
+        else:
+            print(f"loja {r['loja_id']}: {r['divergencias']} divergência(s), "
+                  f"{r['produtos_dobrados']} produto(s) dobrados, {r['movimentos_na_cauda']} movimento(s) na cauda, "
+                  f"{r['duracao_s']:.2f} s")
+    raise SystemExit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Exportação de extratos grandes em XLSX ou CSV: estoque atual, histórico
+mensal (movimentacoes_mensais) e movimentações de um período.
+
+As linhas vêm de um cursor do lado do servidor (named cursor), em blocos de
+LINHAS_POR_BLOCO, e vão direto para o arquivo: o XLSX é escrito com o modo
+`constant_memory` do xlsxwriter (uma linha por vez, sem guardar a planilha
+inteira) e o CSV com csv.writer. A memória usada não depende do tamanho do
+extrato.
+
+Uso pela linha de comando (mesmas credenciais do app):
+    python exportacao.py estoque [--loja ID] -o estoque.xlsx
+    python exportacao.py historico --loja ID --de AAAA-MM --ate AAAA-MM -o historico.xlsx
+    python exportacao.py movimentacoes --loja ID --de AAAA-MM-DD --ate AAAA-MM-DD -o extrato.csv
+"""
+import argparse
+import csv
+import datetime as dt
+import os
+import tempfile
+
+import xlsxwriter
+
+from utils import get_db_connection
+
+LINHAS_POR_BLOCO = 10000
+# Limite de linhas de uma aba do Excel (cabeçalho incluso); passando disso, abre outra aba
+LIMITE_LINHAS_XLSX = 1048576
+
+FORMATOS = {"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "csv": "text/csv"}
+
+
+class Consulta:
+    """SQL de um extrato, seus parâmetros e os nomes das colunas do arquivo."""
+
+    def __init__(self, nome, sql, params, colunas):
+        self.nome = nome
+        self.sql = sql
+        self.params = params
+        self.colunas = colunas
+
+
+def consulta_estoque(loja_id=None):
+    filtro = "WHERE e.loja_id = %s" if loja_id is not None else ""
+    return Consulta(
+        "estoque",
+        f"""
+        SELECT l.nome, e.produto_id, p.nome, p.categoria, p.unidade_medida, e.quantidade
+        FROM estoque e
+        JOIN lojas l ON l.id = e.loja_id
+        JOIN produtos p ON p.id = e.produto_id
+        {filtro}
+        ORDER BY l.nome, p.nome
+        """,
+        (loja_id,) if loja_id is not None else (),
+        ["loja", "produto_id", "produto", "categoria", "unidade_medida", "quantidade"],
+    )
+
+
+# Totais mensais de entradas e saídas por produto, de `mes_inicio` a `mes_fim` (inclusive)
+def consulta_historico_mensal(loja_id, mes_inicio, mes_fim):
+    return Consulta(
+        "historico_mensal",
+        """
+        SELECT m.mes, m.produto_id, p.nome, p.categoria, m.total_entradas, m.total_saidas
+        FROM movimentacoes_mensais m
+        JOIN produtos p ON p.id = m.produto_id
+        WHERE m.loja_id = %s AND m.mes BETWEEN %s AND %s
+        ORDER BY m.mes, p.nome
+        """,
+        (loja_id, mes_inicio.replace(day=1), mes_fim.replace(day=1)),
+        ["mes", "produto_id", "produto", "categoria", "entradas", "saidas"],
+    )
+
+
+# Movimentações de `inicio` a `fim` (dias inclusos), pelo índice (loja_id, data)
+def consulta_movimentacoes(loja_id, inicio, fim):
+    return Consulta(
+        "movimentacoes",
+        """
+        SELECT m.data, m.tipo, m.produto_id, p.nome, m.quantidade, m.motivo
+        FROM movimentacoes_estoque m
+        JOIN produtos p ON p.id = m.produto_id
+        WHERE m.loja_id = %s AND m.data >= %s AND m.data < %s::date + 1
+        ORDER BY m.data, m.id
+        """,
+        (loja_id, inicio, fim),
+        ["data", "tipo", "produto_id", "produto", "quantidade", "motivo"],
+    )
+
+
+# Percorre o resultado com um cursor do lado do servidor, LINHAS_POR_BLOCO por ida ao banco
+def linhas_do_banco(consulta):
+    with get_db_connection() as conn:
+        with conn.cursor(name=f"exportacao_{consulta.nome}") as cursor:
+            cursor.itersize = LINHAS_POR_BLOCO
+            cursor.execute(consulta.sql, consulta.params)
+            yield from cursor
+
+
+def escrever_xlsx(destino, colunas, linhas, aba="Dados"):
+    """Escreve as linhas em modo constant_memory; devolve quantas foram escritas."""
+    workbook = xlsxwriter.Workbook(destino, {
+        "constant_memory": True,
+        "default_date_format": "dd/mm/yyyy",
+        "remove_timezone": True,
+    })
+    negrito = workbook.add_format({"bold": True})
+    data_hora = workbook.add_format({"num_format": "dd/mm/yyyy hh:mm"})
+    total, planilha, linha_atual, abas = 0, None, LIMITE_LINHAS_XLSX, 0
+    try:
+        for linha in linhas:
+            if linha_atual >= LIMITE_LINHAS_XLSX:
+                abas += 1
+                planilha = workbook.add_worksheet(aba if abas == 1 else f"{aba} {abas}")
+                planilha.write_row(0, 0, colunas, negrito)
+                linha_atual = 1
+            for coluna, valor in enumerate(linha):
+                if isinstance(valor, dt.datetime):
+                    planilha.write_datetime(linha_atual, coluna, valor, data_hora)
+                else:
+                    planilha.write(linha_atual, coluna, valor)
+            linha_atual += 1
+            total += 1
+        if planilha is None:
+            workbook.add_worksheet(aba).write_row(0, 0, colunas, negrito)
+    finally:
+        workbook.close()
+    return total
+
+
+def escrever_csv(destino, colunas, linhas):
+    """CSV em UTF-8 com BOM (abre acentuado no Excel); devolve quantas linhas foram escritas."""
+    total = 0
+    with open(destino, "w", newline="", encoding="utf-8-sig") as arquivo:
+        escritor = csv.writer(arquivo)
+        escritor.writerow(colunas)
+        for linha in linhas:
+            escritor.writerow(linha)
+            total += 1
+    return total
+
+
+def escrever(destino, formato, colunas, linhas):
+    if formato == "xlsx":
+        return escrever_xlsx(destino, colunas, linhas)
+    if formato == "csv":
+        return escrever_csv(destino, colunas, linhas)
+    raise ValueError(f"Formato de exportação desconhecido: {formato}")
+
+
+def exportar(consulta, destino, formato="xlsx"):
+    """Grava o extrato de `consulta` em `destino`; devolve o número de linhas."""
+    return escrever(destino, formato, consulta.colunas, linhas_do_banco(consulta))
+
+
+def exportar_para_temporario(consulta, formato="xlsx"):
+    """Grava o extrato em um arquivo temporário e devolve (caminho, linhas); quem chama apaga o arquivo."""
+    descritor, caminho = tempfile.mkstemp(prefix=f"{consulta.nome}_", suffix=f".{formato}")
+    os.close(descritor)
+    try:
+        return caminho, exportar(consulta, caminho, formato)
+    except Exception:
+        os.remove(caminho)
+        raise
+
+
+def _mes(texto):
+    return dt.datetime.strptime(texto, "%Y-%m").date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta extratos do estoque em XLSX ou CSV")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    estoque = comandos.add_parser("estoque", help="estoque atual")
+    estoque.add_argument("--loja", type=int, help="só esta loja (padrão: todas)")
+
+    historico = comandos.add_parser("historico", help="totais mensais por produto")
+    historico.add_argument("--loja", type=int, required=True)
+    historico.add_argument("--de", type=_mes, required=True, help="primeiro mês (AAAA-MM)")
+    historico.add_argument("--ate", type=_mes, required=True, help="último mês (AAAA-MM)")
+
+    movimentacoes = comandos.add_parser("movimentacoes", help="movimentações de um período")
+    movimentacoes.add_argument("--loja", type=int, required=True)
+    movimentacoes.add_argument("--de", type=dt.date.fromisoformat, required=True)
+    movimentacoes.add_argument("--ate", type=dt.date.fromisoformat, required=True)
+
+    for sub in (estoque, historico, movimentacoes):
+        sub.add_argument("-o", "--saida", required=True, help="arquivo .xlsx ou .csv")
+
+    args = parser.parse_args()
+    if args.comando == "estoque":
+        consulta = consulta_estoque(args.loja)
+    elif args.comando == "historico":
+        consulta = consulta_historico_mensal(args.loja, args.de, args.ate)
+    else:
+        consulta = consulta_movimentacoes(args.loja, args.de, args.ate)
+    formato = "csv" if args.saida.lower().endswith(".csv") else "xlsx"
+    linhas = exportar(consulta, args.saida, formato)
+    print(f"{linhas} linhas exportadas para {args.saida}.")
+
+
+if __name__ == "__main__":
+    main()
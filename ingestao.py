@@ -0,0 +1,120 @@
+"""
+Leitura e validação das planilhas enviadas nas páginas de upload.
+
+`normalizar_planilha` faz, com operações vetorizadas do pandas/NumPy:
+conversão de tipos, descarte de quantidades zero, checagem de produtos contra
+o catálogo, checagem de datas fora do intervalo e soma de códigos repetidos.
+Devolve a planilha limpa e um relatório com uma linha por problema
+encontrado, para que nada inválido chegue ao banco.
+"""
+import numpy as np
+import pandas as pd
+
+COLUNAS_ERRO = ["linha", "coluna", "valor", "motivo"]
+
+
+# Lê um upload CSV ou Excel (pela extensão do nome do arquivo)
+def ler_planilha(arquivo):
+    if arquivo.name.lower().endswith(".csv"):
+        return pd.read_csv(arquivo)
+    return pd.read_excel(arquivo)
+
+
+def normalizar_planilha(df, obrigatorias, renomear=None, catalogo=None,
+                        coluna_id="produto_id", coluna_qtd="quantidade",
+                        descartar_zeros=True, agregar_por=None, agregacao="soma",
+                        coluna_data=None, data_min=None, data_max=None,
+                        colunas_texto=()):
+    """
+    Valida e normaliza uma planilha de upload.
+
+    - `renomear` é aplicado antes de tudo (ex.: {"cod": "produto_id"});
+    - `coluna_id` vira int64 e, com `catalogo`, ids fora do cadastro são erro;
+    - `coluna_qtd` vira int64; vazia, fracionária ou negativa é erro, e zero é
+      descartado quando `descartar_zeros`;
+    - `coluna_data` vira datetime; inválida ou fora de [data_min, data_max] é erro;
+    - `colunas_texto` não podem ficar vazias;
+    - com `agregar_por`, linhas repetidas nessas colunas viram uma só, com a
+      quantidade somada (`agregacao="soma"`) ou a última informada ("ultima").
+
+    Retorna (df_limpo, erros); `linha` nos erros é a posição (a partir de 1)
+    na planilha recebida.
+    """
+    if renomear:
+        df = df.rename(columns=renomear)
+    faltantes = [c for c in obrigatorias if c not in df.columns]
+    if faltantes:
+        erros = pd.DataFrame([{"linha": None, "coluna": c, "valor": None,
+                               "motivo": "coluna obrigatória não encontrada"} for c in faltantes],
+                             columns=COLUNAS_ERRO)
+        return df.iloc[0:0], erros
+
+    df = df.reset_index(drop=True)
+    bruto = df
+    df = df.copy()
+    invalida = np.zeros(len(df), dtype=bool)
+    relatorio = []
+
+    def marcar(mascara, coluna, motivo):
+        nonlocal invalida
+        mascara = np.asarray(mascara, dtype=bool) & ~invalida
+        if mascara.any():
+            relatorio.append(pd.DataFrame({
+                "linha": np.flatnonzero(mascara) + 1,
+                "coluna": coluna,
+                "valor": bruto[coluna].to_numpy()[mascara].astype(str),
+                "motivo": motivo,
+            }))
+            invalida |= mascara
+
+    if coluna_id in df.columns:
+        ids = pd.to_numeric(df[coluna_id], errors="coerce")
+        marcar(ids.isna(), coluna_id, "código vazio ou não numérico")
+        marcar(ids.notna() & (ids % 1 != 0), coluna_id, "código não inteiro")
+        if catalogo is not None:
+            validos = ~invalida
+            desconhecidos = np.zeros(len(df), dtype=bool)
+            desconhecidos[validos] = catalogo.desconhecidos(ids[validos].astype("int64").to_numpy())
+            marcar(desconhecidos, coluna_id, "produto não cadastrado")
+        df[coluna_id] = ids
+
+    if coluna_qtd in df.columns:
+        qtd = pd.to_numeric(df[coluna_qtd], errors="coerce")
+        marcar(qtd.isna(), coluna_qtd, "quantidade vazia ou não numérica")
+        marcar(qtd.notna() & (qtd % 1 != 0), coluna_qtd, "quantidade não inteira")
+        marcar(qtd < 0, coluna_qtd, "quantidade negativa")
+        df[coluna_qtd] = qtd
+
+    for coluna in colunas_texto:
+        texto = df[coluna].astype("string").str.strip()
+        marcar(texto.isna() | (texto == ""), coluna, "campo obrigatório vazio")
+        df[coluna] = texto
+
+    if coluna_data is not None:
+        datas = pd.to_datetime(df[coluna_data], errors="coerce")
+        marcar(datas.isna(), coluna_data, "data inválida")
+        fora = np.zeros(len(df), dtype=bool)
+        if data_min is not None:
+            fora |= (datas < pd.Timestamp(data_min)).to_numpy()
+        if data_max is not None:
+            fora |= (datas > pd.Timestamp(data_max)).to_numpy()
+        marcar(fora, coluna_data, "data fora do intervalo")
+        df[coluna_data] = datas
+
+    df = df[~invalida].copy()
+    if coluna_id in df.columns:
+        df[coluna_id] = df[coluna_id].astype("int64")
+    if coluna_qtd in df.columns:
+        df[coluna_qtd] = df[coluna_qtd].astype("int64")
+        if descartar_zeros:
+            df = df[df[coluna_qtd] != 0]
+
+    if agregar_por:
+        funcao = "sum" if agregacao == "soma" else "last"
+        outras = {c: "first" for c in df.columns if c not in agregar_por and c != coluna_qtd}
+        df = df.groupby(list(agregar_por), sort=False, as_index=False).agg({coluna_qtd: funcao, **outras})
+        df = df[[c for c in bruto.columns if c in df.columns]]
+
+    erros = (pd.concat(relatorio, ignore_index=True).sort_values("linha", kind="stable")
+             if relatorio else pd.DataFrame(columns=COLUNAS_ERRO))
+    return df.reset_index(drop=True), erros.reset_index(drop=True)
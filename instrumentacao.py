@@ -0,0 +1,240 @@
+"""
+Medições de desempenho do app: tempo para obter conexão, duração e linhas de
+cada comando SQL, duração e idas ao banco de cada função de utils.py e de
+cada execução (rerun) das páginas.
+
+As medições ficam em memória, por processo, e podem ser lidas pela página de
+Desempenho (`resumo()`) ou exportadas no formato texto do Prometheus
+(`gravar_prometheus()`), para um coletor local ler do disco. Comandos mais
+lentos que o limite configurado vão para um log de consultas lentas, com o
+SQL e os parâmetros (desligado por padrão).
+"""
+import contextvars
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import psycopg2.extensions
+
+CONFIG = {
+    "arquivo_prometheus": None,   # caminho do arquivo .prom; None desliga a exportação
+    "intervalo_prometheus": 15.0,  # segundos mínimos entre duas gravações do arquivo
+    "consulta_lenta_ms": None,     # limite do log de consultas lentas; None desliga
+    "arquivo_consultas_lentas": "consultas_lentas.log",
+}
+
+_lock = threading.Lock()
+_resumos = {}     # (métrica, rótulos) -> [contagem, soma, máximo]
+_coletores = []   # funções que devolvem {(métrica, rótulos): valor} na hora da exportação
+_ultima_gravacao = [0.0]
+
+# Função de utils.py e ação (página) em execução na thread atual
+_funcao = contextvars.ContextVar("funcao", default=None)
+_acao = contextvars.ContextVar("acao", default=None)
+
+log_consultas_lentas = logging.getLogger("estoque.consultas_lentas")
+
+
+def configurar(**opcoes):
+    CONFIG.update({k: v for k, v in opcoes.items() if v is not None})
+    if CONFIG["consulta_lenta_ms"] is not None and not log_consultas_lentas.handlers:
+        handler = logging.FileHandler(CONFIG["arquivo_consultas_lentas"], encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        log_consultas_lentas.addHandler(handler)
+        log_consultas_lentas.setLevel(logging.INFO)
+
+
+def observar(metrica, valor, **rotulos):
+    chave = (metrica, tuple(sorted(rotulos.items())))
+    with _lock:
+        atual = _resumos.get(chave)
+        if atual is None:
+            _resumos[chave] = [1, valor, valor]
+        else:
+            atual[0] += 1
+            atual[1] += valor
+            atual[2] = max(atual[2], valor)
+
+
+def registrar_coletor(coletor):
+    """`coletor()` devolve {nome_da_métrica: valor} lido na hora de exportar (ex.: pool)."""
+    _coletores.append(coletor)
+
+
+def _contar_ida():
+    acao = _acao.get()
+    if acao is not None:
+        acao["idas"] += 1
+    funcao = _funcao.get()
+    if funcao is not None:
+        funcao["idas"] += 1
+
+
+def _texto_sql(sql):
+    return sql.decode("utf-8", "replace") if isinstance(sql, bytes) else str(sql)
+
+
+def _comando(sql):
+    palavras = _texto_sql(sql).split(None, 1)
+    return palavras[0].upper() if palavras else "?"
+
+
+def _medir_comando(cursor, sql, params, executar):
+    inicio = time.perf_counter()
+    try:
+        return executar()
+    finally:
+        duracao = time.perf_counter() - inicio
+        _contar_ida()
+        funcao = _funcao.get()
+        rotulos = {"funcao": funcao["nome"] if funcao else "-", "comando": _comando(sql)}
+        observar("estoque_sql_segundos", duracao, **rotulos)
+        observar("estoque_sql_linhas", max(cursor.rowcount, 0), **rotulos)
+        limite = CONFIG["consulta_lenta_ms"]
+        if limite is not None and duracao * 1000 >= limite:
+            log_consultas_lentas.info(
+                "%.1f ms funcao=%s sql=%s params=%.2000r",
+                duracao * 1000, rotulos["funcao"], " ".join(_texto_sql(sql).split())[:4000], params,
+            )
+
+
+class CursorInstrumentado(psycopg2.extensions.cursor):
+    """Cursor que mede cada comando enviado ao banco."""
+
+    def execute(self, sql, args=None):
+        return _medir_comando(self, sql, args, lambda: super(CursorInstrumentado, self).execute(sql, args))
+
+    def executemany(self, sql, args_seq):
+        args_seq = list(args_seq)
+        return _medir_comando(self, sql, f"<{len(args_seq)} conjuntos>",
+                              lambda: super(CursorInstrumentado, self).executemany(sql, args_seq))
+
+    def copy_expert(self, sql, arquivo, size=8192):
+        return _medir_comando(self, sql, "<COPY>",
+                              lambda: super(CursorInstrumentado, self).copy_expert(sql, arquivo, size))
+
+
+class ConexaoInstrumentada(psycopg2.extensions.connection):
+    """Conexão cujos cursores são instrumentados e cujos commits contam como ida ao banco."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CursorInstrumentado
+
+    def commit(self):
+        _contar_ida()
+        return super().commit()
+
+    def rollback(self):
+        _contar_ida()
+        return super().rollback()
+
+
+def registrar_espera_conexao(segundos):
+    observar("estoque_conexao_espera_segundos", segundos)
+
+
+def instrumentar(func):
+    """Mede duração e idas ao banco de uma função de acesso a dados."""
+    @functools.wraps(func)
+    def envolvida(*args, **kwargs):
+        contexto = {"nome": func.__name__, "idas": 0}
+        token = _funcao.set(contexto)
+        inicio = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _funcao.reset(token)
+            observar("estoque_funcao_segundos", time.perf_counter() - inicio, funcao=func.__name__)
+            observar("estoque_funcao_idas", contexto["idas"], funcao=func.__name__)
+            externa = _funcao.get()
+            if externa is not None:
+                externa["idas"] += contexto["idas"]
+    return envolvida
+
+
+def medir_pagina(pagina):
+    """Mede o tempo total e as idas ao banco de cada execução (rerun) de uma página."""
+    def decorador(func):
+        @functools.wraps(func)
+        def envolvida(*args, **kwargs):
+            acao = {"idas": 0}
+            token = _acao.set(acao)
+            inicio = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _acao.reset(token)
+                observar("estoque_pagina_segundos", time.perf_counter() - inicio, pagina=pagina)
+                observar("estoque_pagina_idas", acao["idas"], pagina=pagina)
+                gravar_prometheus_periodicamente()
+        return envolvida
+    return decorador
+
+
+def resumo():
+    """Lista de dicts {metrica, rotulos..., contagem, soma, media, maximo}."""
+    with _lock:
+        itens = [(k, list(v)) for k, v in _resumos.items()]
+    linhas = []
+    for (metrica, rotulos), (contagem, soma, maximo) in sorted(itens):
+        linhas.append({"metrica": metrica, **dict(rotulos), "contagem": contagem,
+                       "soma": soma, "media": soma / contagem if contagem else 0.0, "maximo": maximo})
+    return linhas
+
+
+def _rotulos_prometheus(rotulos):
+    if not rotulos:
+        return ""
+    pares = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in rotulos)
+    return "{" + pares + "}"
+
+
+def texto_prometheus():
+    """Todas as medições no formato de exposição em texto do Prometheus."""
+    with _lock:
+        itens = sorted((k, list(v)) for k, v in _resumos.items())
+    linhas = []
+    tipos_escritos = set()
+    for (metrica, rotulos), (contagem, soma, maximo) in itens:
+        if metrica not in tipos_escritos:
+            linhas.append(f"# TYPE {metrica} summary")
+            linhas.append(f"# TYPE {metrica}_max gauge")
+            tipos_escritos.add(metrica)
+        r = _rotulos_prometheus(rotulos)
+        linhas.append(f"{metrica}_count{r} {contagem}")
+        linhas.append(f"{metrica}_sum{r} {soma:.6f}")
+        linhas.append(f"{metrica}_max{r} {maximo:.6f}")
+    for coletor in list(_coletores):
+        try:
+            valores = coletor()
+        except Exception:
+            continue
+        for nome, valor in sorted(valores.items()):
+            linhas.append(f"# TYPE {nome} gauge")
+            linhas.append(f"{nome} {float(valor):.6f}")
+    return "\n".join(linhas) + "\n"
+
+
+def gravar_prometheus(caminho=None):
+    """Grava o arquivo .prom de forma atômica (o coletor nunca lê um arquivo pela metade)."""
+    caminho = caminho or CONFIG["arquivo_prometheus"]
+    if not caminho:
+        return None
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    with tempfile.NamedTemporaryFile("w", dir=pasta, delete=False, suffix=".tmp", encoding="utf-8") as f:
+        f.write(texto_prometheus())
+    os.replace(f.name, caminho)
+    _ultima_gravacao[0] = time.monotonic()
+    return caminho
+
+
+def gravar_prometheus_periodicamente():
+    if CONFIG["arquivo_prometheus"] and time.monotonic() - _ultima_gravacao[0] >= CONFIG["intervalo_prometheus"]:
+        try:
+            gravar_prometheus()
+        except OSError:
+            pass
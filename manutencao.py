@@ -0,0 +1,546 @@
+"""
+Tarefas de manutenção do banco do estoque.
+
+Uso:
+    python manutencao.py criar-estruturas
+    python manutencao.py backfill-historico [--loja ID]
+    python manutencao.py snapshot [--data AAAA-MM-DD] [--loja ID]
+    python manutencao.py importacoes (--chave CHAVE | --hash HASH | --loja ID [--desde AAAA-MM-DD])
+    python manutencao.py particionar-movimentacoes [--meses-futuros N]
+    python manutencao.py criar-particoes [--meses-futuros N]
+    python manutencao.py arquivar-mes --mes AAAA-MM [--pasta DIR] [--manter-tabela]
+    python manutencao.py restaurar-mes --arquivo ARQUIVO.csv.gz
+
+Usa as mesmas credenciais do app (.streamlit/secrets.toml).
+"""
+import argparse
+import datetime as dt
+import gzip
+import os
+import re
+
+from utils import get_db_connection
+
+# Estruturas auxiliares usadas pelo app; todos os comandos podem ser repetidos
+ESTRUTURAS = [
+    # Resumo mensal de entradas/saídas por produto, mantido por utils.py
+    """
+    CREATE TABLE IF NOT EXISTS movimentacoes_mensais (
+        loja_id        integer NOT NULL,
+        produto_id     integer NOT NULL,
+        mes            date    NOT NULL,
+        total_entradas numeric NOT NULL DEFAULT 0,
+        total_saidas   numeric NOT NULL DEFAULT 0,
+        PRIMARY KEY (loja_id, mes, produto_id)
+    )
+    """,
+    # Meses exportados e desanexados por `arquivar-mes`: o resumo mensal é o
+    # único registro completo deles, então os recálculos não os refazem
+    """
+    CREATE TABLE IF NOT EXISTS meses_arquivados (
+        mes          date      PRIMARY KEY,
+        arquivo      text      NOT NULL,
+        arquivado_em timestamp NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo')
+    )
+    """,
+    # Fotos diárias do estoque (posição ao final do dia), gravadas pelo comando snapshot
+    """
+    CREATE TABLE IF NOT EXISTS estoque_snapshot (
+        data       date    NOT NULL,
+        loja_id    integer NOT NULL,
+        produto_id integer NOT NULL,
+        quantidade numeric NOT NULL,
+        ultimo_id  bigint,
+        PRIMARY KEY (loja_id, data, produto_id)
+    )
+    """,
+    # Maior id de movimentação já refletido na foto: movimentações gravadas
+    # depois dela com data retroativa entram pela diferença de id
+    "ALTER TABLE estoque_snapshot ADD COLUMN IF NOT EXISTS ultimo_id bigint",
+    # Sequência dos ids de produtos, alinhada ao maior id já cadastrado
+    "CREATE SEQUENCE IF NOT EXISTS produtos_id_seq OWNED BY produtos.id",
+    """
+    SELECT setval('produtos_id_seq', GREATEST(
+        (SELECT COALESCE(MAX(id), 0) FROM produtos),
+        (SELECT last_value FROM produtos_id_seq),
+        1
+    ))
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS movimentacoes_estoque_loja_data_idx
+        ON movimentacoes_estoque (loja_id, data)
+    """,
+    # Registro de importações: hash do arquivo (único por loja e tipo) e chave
+    # de acesso da NF-e (única), gravado na mesma transação dos dados
+    """
+    CREATE TABLE IF NOT EXISTS importacoes (
+        id              bigserial PRIMARY KEY,
+        tipo            text      NOT NULL,
+        loja_id         integer   NOT NULL,
+        hash            text      NOT NULL,
+        chave_nfe       text,
+        arquivo         text,
+        linhas          integer   NOT NULL DEFAULT 0,
+        linhas_gravadas integer   NOT NULL DEFAULT 0,
+        estado          text      NOT NULL DEFAULT 'em andamento',
+        importado_em    timestamp NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo'),
+        atualizado_em   timestamp,
+        hash_envio      text,
+        tentativa       integer   NOT NULL DEFAULT 1,
+        concluido_em    timestamp
+    )
+    """,
+    # Último lote gravado (ou retomada) de uma importação em lotes: uma reserva
+    # em andamento sem avanço há muito tempo pode ser retomada
+    "ALTER TABLE importacoes ADD COLUMN IF NOT EXISTS atualizado_em timestamp",
+    # Hash do conteúdo gravado (linhas e data) de uma importação em lotes, e a
+    # tentativa dona da reserva, trocada a cada retomada
+    "ALTER TABLE importacoes ADD COLUMN IF NOT EXISTS hash_envio text",
+    "ALTER TABLE importacoes ADD COLUMN IF NOT EXISTS tentativa integer NOT NULL DEFAULT 1",
+    "CREATE UNIQUE INDEX IF NOT EXISTS importacoes_loja_tipo_hash_idx ON importacoes (loja_id, tipo, hash)",
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS importacoes_chave_nfe_idx
+        ON importacoes (chave_nfe) WHERE chave_nfe IS NOT NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS importacoes_loja_data_idx ON importacoes (loja_id, importado_em)",
+    # Lotes de validade por loja e vencimento, lidos pelo painel de validade
+    """
+    CREATE INDEX IF NOT EXISTS lote_validade_loja_vencimento_idx
+        ON lote_validade (loja_id, vencimento)
+    """,
+    # Faixas de vencimento (vencido, 7, 15, 30 dias) e restante estimado de
+    # cada lote: o estoque atual é distribuído dos lotes que vencem por último
+    # para os primeiros. É uma view comum, e não materializada, porque as
+    # faixas mudam com current_date e o restante muda a cada gravação de
+    # estoque; o filtro por loja desce até o índice (loja_id, vencimento) e
+    # lotes vencidos há mais de 30 dias nunca são lidos.
+    """
+    CREATE OR REPLACE VIEW lotes_a_vencer AS
+    WITH lotes AS (
+        SELECT id, loja_id, produto_id, lote, vencimento, quantidade,
+               SUM(quantidade) OVER (PARTITION BY loja_id, produto_id
+                                     ORDER BY vencimento DESC, id DESC) AS acumulado
+        FROM lote_validade
+        WHERE vencimento >= current_date - 30
+    )
+    SELECT l.id, l.loja_id, l.produto_id, l.lote, l.vencimento, l.quantidade,
+           LEAST(l.quantidade, GREATEST(COALESCE(e.quantidade, 0) - (l.acumulado - l.quantidade), 0))
+               AS restante,
+           l.vencimento - current_date AS dias,
+           CASE WHEN l.vencimento < current_date      THEN 'vencido'
+                WHEN l.vencimento <= current_date + 7  THEN '7 dias'
+                WHEN l.vencimento <= current_date + 15 THEN '15 dias'
+                WHEN l.vencimento <= current_date + 30 THEN '30 dias'
+                ELSE 'mais de 30 dias' END AS faixa
+    FROM lotes l
+    LEFT JOIN estoque e ON e.loja_id = l.loja_id AND e.produto_id = l.produto_id
+    """,
+    # Conferência do estoque contra as movimentações (consistencia.py): saldo
+    # já somado por produto, marca (último id somado) por loja e divergências
+    # encontradas na última execução de cada loja
+    """
+    CREATE INDEX IF NOT EXISTS movimentacoes_estoque_loja_id_idx
+        ON movimentacoes_estoque (loja_id, id)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS consistencia_saldos (
+        loja_id    integer NOT NULL,
+        produto_id integer NOT NULL,
+        saldo      numeric NOT NULL DEFAULT 0,
+        PRIMARY KEY (loja_id, produto_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS consistencia_marcas (
+        loja_id        integer PRIMARY KEY,
+        ultimo_id      bigint  NOT NULL DEFAULT 0,
+        proximo_limite bigint  NOT NULL DEFAULT 0,
+        limite_xmax    bigint,
+        divergencias   integer,
+        duracao_s      double precision,
+        verificado_em  timestamp
+    )
+    """,
+    # xmax do snapshot em que proximo_limite foi anotado (ver consistencia.py)
+    "ALTER TABLE consistencia_marcas ADD COLUMN IF NOT EXISTS limite_xmax bigint",
+    """
+    CREATE TABLE IF NOT EXISTS consistencia_divergencias (
+        loja_id             integer   NOT NULL,
+        produto_id          integer   NOT NULL,
+        saldo_estoque       numeric   NOT NULL,
+        saldo_movimentacoes numeric   NOT NULL,
+        diferenca           numeric   NOT NULL,
+        verificado_em       timestamp NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo'),
+        PRIMARY KEY (loja_id, produto_id)
+    )
+    """,
+]
+
+
+def criar_estruturas():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for ddl in ESTRUTURAS:
+                cursor.execute(ddl)
+        conn.commit()
+
+
+# Recalcula movimentacoes_mensais a partir do histórico completo (de uma loja
+# ou de todas). A tabela fica bloqueada para escrita durante o recálculo, então
+# gravações concorrentes esperam e são somadas depois, sem se perder. Só os
+# meses que ainda têm movimentações são refeitos, e nunca os arquivados com
+# `arquivar-mes` (em meses_arquivados): o resumo é o único registro completo
+# deles, e uma movimentação retroativa gravada depois na partição padrão já
+# foi somada a ele pela própria gravação.
+def backfill_historico_mensal(loja_id=None):
+    filtro = "AND loja_id = %s" if loja_id is not None else ""
+    params = (loja_id,) if loja_id is not None else ()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("LOCK TABLE movimentacoes_mensais IN EXCLUSIVE MODE")
+            cursor.execute(f"""
+                CREATE TEMP TABLE novo_mensal ON COMMIT DROP AS
+                SELECT loja_id, produto_id, date_trunc('month', data)::date AS mes,
+                       SUM(CASE WHEN tipo = 'entrada' THEN quantidade ELSE 0 END) AS total_entradas,
+                       SUM(CASE WHEN tipo = 'saida'   THEN quantidade ELSE 0 END) AS total_saidas
+                FROM movimentacoes_estoque
+                WHERE date_trunc('month', data)::date NOT IN (SELECT mes FROM meses_arquivados)
+                {filtro}
+                GROUP BY 1, 2, 3
+            """, params)
+            cursor.execute(f"""
+                DELETE FROM movimentacoes_mensais
+                WHERE mes IN (SELECT DISTINCT mes FROM novo_mensal)
+                {filtro}
+            """, params)
+            cursor.execute("""
+                INSERT INTO movimentacoes_mensais (loja_id, produto_id, mes, total_entradas, total_saidas)
+                SELECT loja_id, produto_id, mes, total_entradas, total_saidas
+                FROM novo_mensal
+            """)
+            linhas = cursor.rowcount
+        conn.commit()
+    return linhas
+
+
+# Grava a foto do estoque ao final de `dia` (padrão: hoje): estoque atual menos
+# as movimentações com data posterior ao dia. Refazer a foto de um dia a substitui.
+# A foto guarda o maior id de movimentação que ela reflete; para esse id valer
+# como marca, a tabela fica bloqueada para escrita enquanto a foto é tirada
+# (gravações abertas terminam antes, e as seguintes recebem ids maiores).
+def gerar_snapshot_estoque(dia=None, loja_id=None):
+    dia = dia or dt.date.today()
+    filtro = "AND e.loja_id = %(loja)s" if loja_id is not None else ""
+    params = {"dia": dia, "loja": loja_id}
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("LOCK TABLE movimentacoes_estoque IN SHARE MODE")
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM movimentacoes_estoque")
+            params["ultimo_id"] = cursor.fetchone()[0]
+            cursor.execute(
+                "DELETE FROM estoque_snapshot WHERE data = %(dia)s"
+                + (" AND loja_id = %(loja)s" if loja_id is not None else ""),
+                params,
+            )
+            cursor.execute(f"""
+                INSERT INTO estoque_snapshot (data, loja_id, produto_id, quantidade, ultimo_id)
+                SELECT %(dia)s, e.loja_id, e.produto_id, e.quantidade - COALESCE(d.variacao, 0), %(ultimo_id)s
+                FROM estoque e
+                LEFT JOIN (
+                    SELECT loja_id, produto_id,
+                           SUM(CASE WHEN tipo = 'entrada' THEN quantidade ELSE -quantidade END) AS variacao
+                    FROM movimentacoes_estoque
+                    WHERE data >= %(dia)s::date + 1
+                    GROUP BY loja_id, produto_id
+                ) d ON d.loja_id = e.loja_id AND d.produto_id = e.produto_id
+                WHERE TRUE {filtro}
+            """, params)
+            linhas = cursor.rowcount
+        conn.commit()
+    return linhas
+
+
+# Consulta o registro de importações por chave de acesso, hash do arquivo ou loja
+def consultar_importacoes(chave=None, hash_arquivo=None, loja_id=None, desde=None, limite=50):
+    filtros, params = [], []
+    for coluna, valor in (("chave_nfe", chave), ("hash", hash_arquivo), ("loja_id", loja_id)):
+        if valor is not None:
+            filtros.append(f"{coluna} = %s")
+            params.append(valor)
+    if desde is not None:
+        filtros.append("importado_em >= %s")
+        params.append(desde)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT importado_em, loja_id, tipo, estado, linhas_gravadas, linhas, arquivo, chave_nfe, hash
+                FROM importacoes
+                {"WHERE " + " AND ".join(filtros) if filtros else ""}
+                ORDER BY importado_em DESC
+                LIMIT %s
+            """, params + [limite])
+            return cursor.fetchall()
+
+
+# --- Partições mensais de movimentacoes_estoque ---
+#
+# Depois de `particionar-movimentacoes`, a tabela é particionada por mês de
+# `data` (movimentacoes_estoque_AAAA_MM), com uma partição padrão que recebe
+# datas sem partição própria, para nenhuma gravação falhar. `criar-particoes`
+# (agendado, por exemplo, todo dia 1º) cria os meses seguintes e move para
+# eles o que tiver caído na partição padrão. Meses antigos podem ser
+# exportados para CSV compactado e desanexados com `arquivar-mes`; o resumo
+# mensal e as fotos de estoque continuam cobrindo esses meses.
+
+PARTICOES_FUTURAS = 3
+PASTA_ARQUIVO = "arquivo_movimentacoes"
+PARTICAO_PADRAO = "movimentacoes_estoque_padrao"
+
+
+def _inicio_mes(dia):
+    return dia.replace(day=1)
+
+
+def _somar_meses(mes, n):
+    indice = mes.year * 12 + mes.month - 1 + n
+    return dt.date(indice // 12, indice % 12 + 1, 1)
+
+
+def _nome_particao(mes):
+    return f"movimentacoes_estoque_{mes:%Y_%m}"
+
+
+def _particionada(cursor):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = 'movimentacoes_estoque'::regclass")
+    return cursor.fetchone()[0]
+
+
+# Cria a partição de um mês (se ainda não existe), trazendo da partição padrão
+# as linhas do mês que tenham caído lá. Devolve True se criou.
+def _criar_particao(cursor, mes):
+    nome = _nome_particao(mes)
+    cursor.execute("SELECT to_regclass(%s)", (nome,))
+    if cursor.fetchone()[0] is not None:
+        return False
+    inicio, fim = mes.isoformat(), _somar_meses(mes, 1).isoformat()
+    cursor.execute(f"CREATE TABLE {nome} (LIKE movimentacoes_estoque INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute("SELECT to_regclass(%s)", (PARTICAO_PADRAO,))
+    if cursor.fetchone()[0] is not None:
+        cursor.execute(f"""
+            WITH movidas AS (
+                DELETE FROM {PARTICAO_PADRAO} WHERE data >= %s AND data < %s RETURNING *
+            )
+            INSERT INTO {nome} SELECT * FROM movidas
+        """, (inicio, fim))
+    cursor.execute(f"ALTER TABLE movimentacoes_estoque ATTACH PARTITION {nome} FOR VALUES FROM (%s) TO (%s)",
+                   (inicio, fim))
+    return True
+
+
+# Garante as partições do mês atual e dos `meses_futuros` seguintes.
+# Devolve os nomes das partições criadas.
+def criar_particoes(meses_futuros=PARTICOES_FUTURAS):
+    atual = _inicio_mes(dt.date.today())
+    criadas = []
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if not _particionada(cursor):
+                raise RuntimeError("movimentacoes_estoque ainda não é particionada; rode particionar-movimentacoes.")
+            for n in range(meses_futuros + 1):
+                mes = _somar_meses(atual, n)
+                if _criar_particao(cursor, mes):
+                    criadas.append(_nome_particao(mes))
+        conn.commit()
+    return criadas
+
+
+# Migra movimentacoes_estoque para particionamento mensal por `data`. A tabela
+# original fica como movimentacoes_estoque_legado (com índices renomeados) até
+# ser conferida e removida à mão. Roda em uma transação, com a tabela
+# bloqueada: agende para uma janela sem uso do app. Devolve o nº de linhas copiadas.
+def particionar_movimentacoes(meses_futuros=PARTICOES_FUTURAS):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if _particionada(cursor):
+                return 0
+            cursor.execute("LOCK TABLE movimentacoes_estoque IN ACCESS EXCLUSIVE MODE")
+            cursor.execute("SELECT pg_get_serial_sequence('movimentacoes_estoque', 'id')")
+            sequencia = cursor.fetchone()[0]
+            cursor.execute("ALTER TABLE movimentacoes_estoque RENAME TO movimentacoes_estoque_legado")
+            # Nomes de índice são únicos no schema: libera os nomes para a tabela nova
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'movimentacoes_estoque_legado'")
+            for (indice,) in cursor.fetchall():
+                cursor.execute(f'ALTER INDEX "{indice}" RENAME TO "{indice[:48]}_legado"')
+
+            cursor.execute("""
+                CREATE TABLE movimentacoes_estoque (
+                    LIKE movimentacoes_estoque_legado
+                    INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY INCLUDING STORAGE
+                ) PARTITION BY RANGE (data)
+            """)
+            # A chave primária de uma tabela particionada precisa conter a coluna de partição
+            cursor.execute("ALTER TABLE movimentacoes_estoque ADD PRIMARY KEY (id, data)")
+            cursor.execute("""
+                SELECT conname, pg_get_constraintdef(oid)
+                FROM pg_constraint
+                WHERE conrelid = 'movimentacoes_estoque_legado'::regclass AND contype = 'f'
+            """)
+            for nome, definicao in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE movimentacoes_estoque ADD CONSTRAINT "{nome}" {definicao}')
+            if sequencia:
+                cursor.execute(f"ALTER SEQUENCE {sequencia} OWNED BY movimentacoes_estoque.id")
+
+            cursor.execute(f"CREATE TABLE {PARTICAO_PADRAO} PARTITION OF movimentacoes_estoque DEFAULT")
+            cursor.execute("SELECT MIN(data)::date FROM movimentacoes_estoque_legado")
+            primeiro = cursor.fetchone()[0] or dt.date.today()
+            mes, ultimo = _inicio_mes(primeiro), _somar_meses(_inicio_mes(dt.date.today()), meses_futuros)
+            while mes <= ultimo:
+                _criar_particao(cursor, mes)
+                mes = _somar_meses(mes, 1)
+
+            cursor.execute("INSERT INTO movimentacoes_estoque OVERRIDING SYSTEM VALUE "
+                           "SELECT * FROM movimentacoes_estoque_legado")
+            copiadas = cursor.rowcount
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS movimentacoes_estoque_loja_data_idx
+                    ON movimentacoes_estoque (loja_id, data)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS movimentacoes_estoque_loja_id_idx
+                    ON movimentacoes_estoque (loja_id, id)
+            """)
+            # Coluna identity ganha sequência nova: continua de onde a antiga parou
+            cursor.execute("SELECT pg_get_serial_sequence('movimentacoes_estoque', 'id')")
+            nova = cursor.fetchone()[0]
+            if nova and nova != sequencia:
+                cursor.execute(f"SELECT setval('{nova}', GREATEST((SELECT MAX(id) FROM movimentacoes_estoque), 1))")
+        conn.commit()
+    return copiadas
+
+
+# Exporta um mês para PASTA/movimentacoes_estoque_AAAA_MM.csv.gz (COPY em
+# CSV com cabeçalho, gravado em streaming) e desanexa a partição; sem
+# `manter_tabela`, a tabela desanexada é apagada. Tudo na mesma transação:
+# se a gravação do arquivo falhar, nada é desanexado. Devolve o caminho do arquivo.
+def arquivar_mes(mes, pasta=PASTA_ARQUIVO, manter_tabela=False):
+    mes = _inicio_mes(mes)
+    if mes >= _inicio_mes(dt.date.today()):
+        raise ValueError("Só meses anteriores ao atual podem ser arquivados.")
+    nome = _nome_particao(mes)
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f"{nome}.csv.gz")
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (nome,))
+            if cursor.fetchone()[0] is None:
+                raise ValueError(f"Partição {nome} não encontrada (mês já arquivado ou tabela não particionada).")
+            cursor.execute(f"LOCK TABLE {nome} IN EXCLUSIVE MODE")
+            temporario = caminho + ".parcial"
+            with gzip.open(temporario, "wb") as arquivo:
+                cursor.copy_expert(f"COPY {nome} TO STDOUT WITH (FORMAT csv, HEADER)", arquivo)
+            with open(temporario, "rb") as arquivo:
+                os.fsync(arquivo.fileno())
+            os.replace(temporario, caminho)
+            cursor.execute(f"ALTER TABLE movimentacoes_estoque DETACH PARTITION {nome}")
+            cursor.execute("""
+                INSERT INTO meses_arquivados (mes, arquivo) VALUES (%s, %s)
+                ON CONFLICT (mes) DO UPDATE SET arquivo = EXCLUDED.arquivo, arquivado_em = EXCLUDED.arquivado_em
+            """, (mes, caminho))
+            if manter_tabela:
+                cursor.execute(f"ALTER TABLE {nome} RENAME TO {nome}_arquivada")
+            else:
+                cursor.execute(f"DROP TABLE {nome}")
+        conn.commit()
+    return caminho
+
+
+# Recoloca um mês arquivado: recria a partição e carrega o CSV compactado
+def restaurar_mes(caminho):
+    achado = re.search(r"movimentacoes_estoque_(\d{4})_(\d{2})\.csv\.gz$", caminho)
+    if not achado:
+        raise ValueError("Nome de arquivo esperado: movimentacoes_estoque_AAAA_MM.csv.gz")
+    mes = dt.date(int(achado.group(1)), int(achado.group(2)), 1)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if not _criar_particao(cursor, mes):
+                raise ValueError(f"A partição {_nome_particao(mes)} já existe.")
+            with gzip.open(caminho, "rb") as arquivo:
+                cursor.copy_expert(f"COPY {_nome_particao(mes)} FROM STDIN WITH (FORMAT csv, HEADER)", arquivo)
+            linhas = cursor.rowcount
+            cursor.execute("DELETE FROM meses_arquivados WHERE mes = %s", (mes,))
+        conn.commit()
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tarefas de manutenção do banco do estoque")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comandos.add_parser("criar-estruturas", help="cria tabelas e índices auxiliares")
+
+    backfill = comandos.add_parser("backfill-historico", help="recalcula o resumo mensal de movimentações")
+    backfill.add_argument("--loja", type=int, help="recalcula só esta loja")
+
+    snapshot = comandos.add_parser("snapshot", help="grava a foto do estoque ao final de um dia")
+    snapshot.add_argument("--data", type=dt.date.fromisoformat, help="dia da foto (padrão: hoje)")
+    snapshot.add_argument("--loja", type=int, help="só esta loja")
+
+    importacoes = comandos.add_parser("importacoes", help="consulta o registro de importações")
+    importacoes.add_argument("--chave", help="chave de acesso da NF-e (44 dígitos)")
+    importacoes.add_argument("--hash", help="SHA-256 do arquivo importado")
+    importacoes.add_argument("--loja", type=int, help="só esta loja")
+    importacoes.add_argument("--desde", type=dt.date.fromisoformat, help="importadas a partir deste dia")
+    importacoes.add_argument("--limite", type=int, default=50)
+
+    particionar = comandos.add_parser("particionar-movimentacoes",
+                                      help="migra movimentacoes_estoque para partições mensais")
+    particionar.add_argument("--meses-futuros", type=int, default=PARTICOES_FUTURAS)
+
+    particoes = comandos.add_parser("criar-particoes", help="cria as partições dos próximos meses")
+    particoes.add_argument("--meses-futuros", type=int, default=PARTICOES_FUTURAS)
+
+    arquivar = comandos.add_parser(
+        "arquivar-mes",
+        help="exporta um mês para .csv.gz e desanexa a partição; backfill-historico e "
+             "consistencia.py --reconstruir passam a usar o resumo mensal para o mês arquivado")
+    arquivar.add_argument("--mes", type=lambda t: dt.datetime.strptime(t, "%Y-%m").date(), required=True,
+                          help="mês a arquivar (AAAA-MM)")
+    arquivar.add_argument("--pasta", default=PASTA_ARQUIVO)
+    arquivar.add_argument("--manter-tabela", action="store_true",
+                          help="mantém a partição desanexada no banco em vez de apagá-la")
+
+    restaurar = comandos.add_parser("restaurar-mes", help="recarrega um mês arquivado")
+    restaurar.add_argument("--arquivo", required=True)
+
+    args = parser.parse_args()
+    if args.comando == "criar-estruturas":
+        criar_estruturas()
+        print("Estruturas criadas/atualizadas.")
+    elif args.comando == "backfill-historico":
+        linhas = backfill_historico_mensal(args.loja)
+        print(f"{linhas} linhas gravadas em movimentacoes_mensais.")
+    elif args.comando == "snapshot":
+        linhas = gerar_snapshot_estoque(args.data, args.loja)
+        print(f"{linhas} linhas gravadas em estoque_snapshot.")
+    elif args.comando == "importacoes":
+        registros = consultar_importacoes(args.chave, args.hash, args.loja, args.desde, args.limite)
+        for importado_em, loja, tipo, estado, gravadas, linhas, arquivo, chave, hash_arquivo in registros:
+            print(f"{importado_em:%Y-%m-%d %H:%M}  loja {loja}  {tipo:<9} {estado:<12} "
+                  f"{gravadas}/{linhas} linhas  {arquivo or '-'}  {chave or hash_arquivo[:16]}")
+        if not registros:
+            print("Nenhuma importação encontrada.")
+    elif args.comando == "particionar-movimentacoes":
+        linhas = particionar_movimentacoes(args.meses_futuros)
+        print(f"{linhas} linhas copiadas para a tabela particionada. Depois de conferir, "
+              "remova a original com DROP TABLE movimentacoes_estoque_legado.")
+    elif args.comando == "criar-particoes":
+        criadas = criar_particoes(args.meses_futuros)
+        print(f"Partições criadas: {', '.join(criadas)}" if criadas else "Nenhuma partição nova.")
+    elif args.comando == "arquivar-mes":
+        print(f"Mês arquivado em {arquivar_mes(args.mes, args.pasta, args.manter_tabela)}.")
+    elif args.comando == "restaurar-mes":
+        print(f"{restaurar_mes(args.arquivo)} linhas restauradas.")
+
+
+if __name__ == "__main__":
+    main()
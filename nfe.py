@@ -0,0 +1,130 @@
+"""
+Leitura incremental de NF-e (XML de nota fiscal eletrônica).
+
+O arquivo é percorrido com `iterparse`, sem montar a árvore inteira: cada
+<det> é convertido em um dict com os campos de <prod> assim que termina e
+depois descartado. Funciona com o XML autorizado (raiz <nfeProc>) e com a
+nota sem protocolo (raiz <NFe>), com ou sem o namespace do Portal Fiscal.
+"""
+import io
+import multiprocessing
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Remove o namespace de uma tag: "{http://www.portalfiscal.inf.br/nfe}det" -> "det"
+def _nome_local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _percorrer(fonte, cabecalho):
+    if isinstance(fonte, (bytes, bytearray)):
+        fonte = io.BytesIO(fonte)
+    caminho = []
+    for evento, elem in ET.iterparse(fonte, events=("start", "end")):
+        nome = _nome_local(elem.tag)
+        if evento == "start":
+            if nome == "infNFe":
+                chave = elem.get("Id") or ""
+                cabecalho["chave"] = chave[3:] if chave.startswith("NFe") else chave
+            caminho.append(nome)
+            continue
+
+        caminho.pop()
+        pai = caminho[-1] if caminho else None
+        if nome == "nNF" and pai == "ide":
+            cabecalho["numero"] = elem.text
+        elif nome == "chNFe" and not cabecalho.get("chave"):
+            cabecalho["chave"] = elem.text
+        elif nome == "det" and pai == "infNFe":
+            item = {"nItem": elem.get("nItem")}
+            for filho in elem:
+                if _nome_local(filho.tag) == "prod":
+                    for campo in filho:
+                        item[_nome_local(campo.tag)] = campo.text
+                    break
+            yield item
+            elem.clear()
+        elif pai == "infNFe":
+            elem.clear()
+
+
+def iterar_itens_nfe(fonte):
+    """
+    Gera um dict por item (<det>) da nota, com `nItem` e os campos de <prod>
+    (cProd, xProd, qCom, uCom, vUnCom, ...), na ordem em que aparecem.
+    `fonte` pode ser bytes, um caminho ou um arquivo aberto em modo binário.
+    """
+    return _percorrer(fonte, {})
+
+
+def ler_nfe(fonte):
+    """
+    Lê a nota inteira e devolve {"chave", "numero", "itens"}, onde `chave` é a
+    chave de acesso (44 dígitos, sem o prefixo "NFe") e `itens` é a lista
+    gerada por `iterar_itens_nfe`.
+    """
+    cabecalho = {"chave": None, "numero": None}
+    itens = list(_percorrer(fonte, cabecalho))
+    return {"chave": cabecalho["chave"], "numero": cabecalho["numero"], "itens": itens}
+
+
+_CHAVE_NO_ID = re.compile(rb'<(?:\w+:)?infNFe\b[^>]*?\bId=["\']NFe(\d{44})["\']')
+_CHAVE_NO_PROTOCOLO = re.compile(rb'<(?:\w+:)?chNFe>\s*(\d{44})\s*<')
+
+
+def chave_acesso(conteudo):
+    """
+    Chave de acesso da nota (44 dígitos) encontrada por busca direta nos
+    bytes, sem ler o XML; serve para recusar notas já lançadas antes do
+    parse. Devolve None se a chave não aparecer.
+    """
+    achado = _CHAVE_NO_ID.search(conteudo) or _CHAVE_NO_PROTOCOLO.search(conteudo)
+    return achado.group(1).decode("ascii") if achado else None
+
+
+def extrair_xmls(arquivos):
+    """
+    Gera (nome, conteúdo) para cada XML enviado. Arquivos .zip são abertos e
+    cada .xml contido vira uma entrada "lote.zip/nota.xml".
+    """
+    for arquivo in arquivos:
+        nome = arquivo.name
+        conteudo = arquivo.getvalue()
+        if nome.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(conteudo)) as pacote:
+                for info in pacote.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(".xml"):
+                        yield f"{nome}/{info.filename}", pacote.read(info)
+        else:
+            yield nome, conteudo
+
+
+# Lê um arquivo já extraído; erros de XML voltam no resultado em vez de
+# derrubar o lote inteiro
+def _ler_arquivo(entrada):
+    nome, conteudo = entrada
+    try:
+        nota = ler_nfe(conteudo)
+        nota["erro"] = None
+    except ET.ParseError as e:
+        nota = {"chave": None, "numero": None, "itens": [], "erro": f"XML inválido: {e}"}
+    nota["arquivo"] = nome
+    return nota
+
+
+def ler_nfes(arquivos, max_workers=None):
+    """
+    Lê vários XMLs (lista de (nome, conteúdo), como gerada por `extrair_xmls`)
+    em paralelo em um pool de processos e devolve as notas na mesma ordem,
+    cada uma com "arquivo" e "erro" além dos campos de `ler_nfe`.
+    O pool usa "spawn" para não herdar as threads do servidor Streamlit.
+    """
+    arquivos = list(arquivos)
+    if len(arquivos) <= 1:
+        return [_ler_arquivo(entrada) for entrada in arquivos]
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=contexto) as pool:
+        return list(pool.map(_ler_arquivo, arquivos, chunksize=max(1, len(arquivos) // 32)))
@@ -0,0 +1,40 @@
+import streamlit as st
+from utils import get_catalogo, matriz_estoque_lojas
+from instrumentacao import medir_pagina
+
+st.set_page_config(page_title="Estoque por Loja", layout="wide")
+
+@medir_pagina("Estoque por Loja")
+def page_estoque_por_loja():
+    st.title("Estoque por Loja")
+    st.caption("Estoque atual de todas as lojas lado a lado (uma consulta ao banco, atualizada a cada gravação).")
+
+    # 1) Filtros
+    categorias = sorted({c for _, _, c in get_catalogo().linhas() if c})
+    selecionadas = st.multiselect("Categorias", categorias)
+    tabela = matriz_estoque_lojas(selecionadas)
+    lojas = [c for c in tabela.columns if c not in ("nome", "categoria")]
+    lojas_visiveis = st.multiselect("Lojas", lojas, default=lojas)
+    termo = st.text_input("Buscar produto (nome ou código)")
+    so_em_falta = st.checkbox("Só produtos zerados em alguma das lojas selecionadas")
+
+    tabela = tabela[["nome", "categoria"] + lojas_visiveis]
+    if termo:
+        tabela = tabela[tabela["nome"].str.contains(termo, case=False, regex=False)
+                        | (tabela.index.astype(str) == termo.strip())]
+    quantidades = tabela[lojas_visiveis]
+    if so_em_falta and lojas_visiveis:
+        tabela = tabela[(quantidades <= 0).any(axis=1)]
+        quantidades = tabela[lojas_visiveis]
+    tabela = tabela.assign(total=quantidades.sum(axis=1))
+
+    # 2) Matriz produto × loja
+    st.write(f"{len(tabela)} produto(s), {len(lojas_visiveis)} loja(s).")
+    st.dataframe(tabela, use_container_width=True)
+    st.download_button(
+        "📥 Baixar matriz (CSV)", tabela.to_csv().encode("utf-8"),
+        file_name="estoque_por_loja.csv", mime="text/csv"
+    )
+
+if __name__ == "__main__":
+    page_estoque_por_loja()
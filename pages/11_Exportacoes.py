@@ -0,0 +1,73 @@
+import os
+import streamlit as st
+import datetime as dt
+from utils import select_store
+from instrumentacao import medir_pagina
+from exportacao import (consulta_estoque, consulta_historico_mensal, consulta_movimentacoes,
+                        exportar_para_temporario, FORMATOS)
+
+st.set_page_config(page_title="Exportações", layout="wide")
+
+# Apaga o arquivo da exportação anterior desta sessão
+def descartar_exportacao():
+    anterior = st.session_state.pop("exportacao", None)
+    if anterior and os.path.exists(anterior["caminho"]):
+        os.remove(anterior["caminho"])
+
+@medir_pagina("Exportações")
+def page_exportacoes():
+    st.title("Exportações")
+    st.caption(
+        "Os extratos são lidos do banco em blocos e gravados direto no arquivo, sem montar a "
+        "planilha em memória. Para extratos muito grandes, prefira o comando `python exportacao.py`."
+    )
+
+    # 1) Seleção da loja
+    loja_info = select_store()
+    if loja_info is None:
+        st.warning("Por favor, selecione uma loja.")
+        return
+    loja_id, loja_nome = loja_info
+
+    # 2) Tipo de extrato e período
+    tipo = st.radio("Extrato", ["Estoque atual", "Histórico mensal", "Movimentações"], horizontal=True)
+    hoje = dt.date.today()
+    if tipo == "Estoque atual":
+        todas = st.checkbox("Todas as lojas")
+        consulta = consulta_estoque(None if todas else loja_id)
+        sufixo = "todas_lojas" if todas else f"loja_{loja_id}"
+    elif tipo == "Histórico mensal":
+        col1, col2 = st.columns(2)
+        inicio = col1.date_input("De (mês)", value=hoje.replace(month=1, day=1))
+        fim = col2.date_input("Até (mês)", value=hoje)
+        consulta = consulta_historico_mensal(loja_id, inicio, fim)
+        sufixo = f"loja_{loja_id}_{inicio:%Y%m}_{fim:%Y%m}"
+    else:
+        col1, col2 = st.columns(2)
+        inicio = col1.date_input("De", value=hoje.replace(day=1))
+        fim = col2.date_input("Até", value=hoje)
+        consulta = consulta_movimentacoes(loja_id, inicio, fim)
+        sufixo = f"loja_{loja_id}_{inicio:%Y%m%d}_{fim:%Y%m%d}"
+    formato = st.radio("Formato", list(FORMATOS), horizontal=True)
+
+    # 3) Geração do arquivo e download
+    if st.button("Gerar arquivo"):
+        descartar_exportacao()
+        with st.spinner("Gerando arquivo..."):
+            caminho, linhas = exportar_para_temporario(consulta, formato)
+        st.session_state.exportacao = {
+            "caminho": caminho, "linhas": linhas, "formato": formato,
+            "nome": f"{consulta.nome}_{sufixo}.{formato}",
+        }
+
+    exportacao = st.session_state.get("exportacao")
+    if exportacao and os.path.exists(exportacao["caminho"]):
+        st.success(f"{exportacao['linhas']} linha(s) exportadas.")
+        with open(exportacao["caminho"], "rb") as arquivo:
+            st.download_button(
+                f"📥 Baixar {exportacao['nome']}", arquivo,
+                file_name=exportacao["nome"], mime=FORMATOS[exportacao["formato"]]
+            )
+
+if __name__ == "__main__":
+    page_exportacoes()
@@ -0,0 +1,54 @@
+import streamlit as st
+import pandas as pd
+from utils import acompanhar_tarefa, acompanhar_tarefas
+from consistencia import enviar_verificacao, situacao_lojas, listar_divergencias, WORKERS_PADRAO
+from instrumentacao import medir_pagina
+
+st.set_page_config(page_title="Consistência do Estoque", layout="wide")
+
+def exibir_resultado_verificacao(resultados):
+    df = pd.DataFrame(resultados)
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    falhas = df[df["erro"].notna()]
+    if not falhas.empty:
+        st.error(f"{len(falhas)} loja(s) não puderam ser conferidas.")
+
+@medir_pagina("Consistência do Estoque")
+def page_consistencia():
+    st.title("Consistência do Estoque")
+    st.caption(
+        "Compara o estoque de cada loja com a soma das movimentações. Cada conferência lê só as "
+        "movimentações gravadas desde a anterior."
+    )
+
+    # 1) Última conferência por loja
+    situacao = situacao_lojas()
+    st.dataframe(situacao.drop(columns=["ultimo_id"]), use_container_width=True, hide_index=True)
+
+    # 2) Nova conferência em segundo plano
+    nomes = dict(zip(situacao["loja"], situacao["loja_id"]))
+    selecionadas = st.multiselect("Lojas a conferir (vazio: todas)", list(nomes))
+    workers = st.number_input("Processos em paralelo", min_value=1, max_value=16, value=WORKERS_PADRAO)
+    if st.button("Conferir agora"):
+        lojas = [nomes[n] for n in selecionadas] if selecionadas else list(nomes.values())
+        acompanhar_tarefa(enviar_verificacao(lojas, int(workers)))
+        st.rerun()
+    acompanhar_tarefas("consistencia", exibir_resultado_verificacao)
+
+    # 3) Divergências da última conferência
+    st.subheader("Divergências")
+    divergencias = listar_divergencias()
+    if divergencias.empty:
+        st.success("Nenhuma divergência na última conferência.")
+        return
+    lojas = st.multiselect("Filtrar lojas", sorted(divergencias["loja"].unique()))
+    if lojas:
+        divergencias = divergencias[divergencias["loja"].isin(lojas)]
+    st.dataframe(divergencias.drop(columns=["loja_id"]), use_container_width=True, hide_index=True)
+    st.download_button(
+        "📥 Baixar divergências (CSV)", divergencias.to_csv(index=False).encode("utf-8"),
+        file_name="divergencias_estoque.csv", mime="text/csv"
+    )
+
+if __name__ == "__main__":
+    page_consistencia()
@@ -0,0 +1,82 @@
+import io
+import streamlit as st
+from utils import select_store, get_reposicao
+import reposicao
+from instrumentacao import medir_pagina
+
+st.set_page_config(page_title="Reposição", layout="wide")
+
+@medir_pagina("Reposição")
+def page_reposicao():
+    st.title("Reposição")
+    st.caption(
+        f"Demanda pela média das saídas diárias dos últimos {reposicao.JANELA_DEMANDA} dias "
+        f"(dias sem venda contam como zero) e variabilidade dos últimos {reposicao.JANELA_VARIABILIDADE} dias."
+    )
+
+    # 1) Loja (ou todas) e parâmetros de compra
+    todas = st.checkbox("Todas as lojas", value=False)
+    loja_id, nome_arquivo = None, "todas"
+    if not todas:
+        loja_info = select_store()
+        if loja_info is None:
+            st.warning("Por favor, selecione uma loja ou marque Todas as lojas.")
+            return
+        loja_id, _ = loja_info
+        nome_arquivo = f"loja_{loja_id}"
+    col1, col2, col3 = st.columns(3)
+    prazo = col1.number_input("Prazo de entrega (dias)", min_value=1, max_value=90, value=reposicao.PRAZO_PADRAO)
+    ciclo = col2.number_input("Dias entre pedidos", min_value=1, max_value=90, value=reposicao.CICLO_PADRAO)
+    nivel = col3.slider("Nível de serviço", min_value=0.50, max_value=0.99,
+                        value=reposicao.NIVEL_SERVICO_PADRAO, step=0.01)
+
+    tabela = get_reposicao(loja_id, prazo, ciclo, nivel)
+    if tabela.empty:
+        st.info("Nenhuma saída diária registrada no período.")
+        return
+
+    # 2) Filtros
+    categorias = sorted(c for c in tabela["categoria"].dropna().unique() if c)
+    selecionadas = st.multiselect("Categorias", categorias)
+    if selecionadas:
+        tabela = tabela[tabela["categoria"].isin(selecionadas)]
+    so_pedir = st.checkbox("Só produtos com sugestão de compra", value=True)
+    if so_pedir:
+        tabela = tabela[tabela["sugestao"] > 0]
+
+    # 3) Indicadores e tabela
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Produtos a pedir", int((tabela["sugestao"] > 0).sum()))
+    col2.metric("Unidades sugeridas", f"{tabela['sugestao'].sum():,.0f}")
+    col3.metric("Cobertura abaixo do prazo", int((tabela["dias_cobertura"] < prazo).sum()))
+    exibicao = tabela.drop(columns=["loja_id"] + (["loja"] if loja_id is not None else []))
+    st.dataframe(
+        exibicao, use_container_width=True, hide_index=True,
+        column_config={
+            "demanda_diaria": st.column_config.NumberColumn(format="%.2f"),
+            "demanda_7d": st.column_config.NumberColumn(format="%.2f"),
+            "desvio": st.column_config.NumberColumn(format="%.2f"),
+            "dias_cobertura": st.column_config.NumberColumn(format="%.1f"),
+            "estoque_seguranca": st.column_config.NumberColumn(format="%.1f"),
+            "ponto_pedido": st.column_config.NumberColumn(format="%.1f"),
+        },
+    )
+
+    # 4) Sugestão de compra para download
+    pedido = tabela.loc[tabela["sugestao"] > 0, ["loja", "produto_id", "nome", "categoria", "estoque",
+                                                 "dias_cobertura", "sugestao"]]
+    buffer = io.BytesIO()
+    pedido.to_excel(buffer, index=False, engine="xlsxwriter")
+    col1, col2 = st.columns(2)
+    col1.download_button(
+        "📥 Baixar sugestão de compra (XLSX)", buffer.getvalue(),
+        file_name=f"sugestao_compra_{nome_arquivo}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+    col2.download_button(
+        "📥 Baixar sugestão de compra (CSV)", pedido.to_csv(index=False).encode("utf-8"),
+        file_name=f"sugestao_compra_{nome_arquivo}.csv", mime="text/csv"
+    )
+
+if __name__ == "__main__":
+    page_reposicao()
@@ -1,5 +1,10 @@
 import streamlit as st
-from utils import select_store, get_produtos, get_estoque_loja, atualizar_estoque
+from utils import (select_store, select_produto, get_catalogo, get_estoque_loja, atualizar_estoque,
+                   enviar_atualizacao_estoque, acompanhar_tarefa, acompanhar_tarefas, get_cache_stats,
+                   exibir_erros_planilha, hash_conteudo, verificar_importacao, ImportacaoDuplicada,
+                   guardar_quadro, obter_quadro, tem_quadro, remover_quadro)
+from instrumentacao import medir_pagina
+from ingestao import ler_planilha, normalizar_planilha
 import pandas as pd
 from datetime import date
 
@@ -8,6 +13,18 @@ st.set_page_config(page_title="Estoque Atual", layout="wide")
 # Path to the Excel template; atualize caso mova o arquivo
 TEMPLATE_PATH = "estoque.xlsx"
 
+# Mostra o que mudou após uma contagem (ajustes de entrada/saída por produto)
+def exibir_resumo_contagem(resumo):
+    st.write(
+        f"{resumo['produtos']} produtos contados: "
+        f"{resumo['ajustes_entrada']} ajustes de entrada, "
+        f"{resumo['ajustes_saida']} ajustes de saída, "
+        f"{resumo['sem_alteracao']} sem alteração."
+    )
+    if resumo['itens']:
+        st.dataframe(pd.DataFrame(resumo['itens']), use_container_width=True)
+
+@medir_pagina("Estoque Atual")
 def main():
     st.title("Estoque Atual")
     
@@ -37,39 +54,33 @@ def main():
     if 'estoque_updates' not in st.session_state:
         st.session_state.estoque_updates = []
     
-    produtos = get_produtos()
-    estoque_atual = get_estoque_loja(loja_id)
-    
-    estoque_dict = {p_id: {'nome': nome, 'quantidade': qtd} for p_id, nome, qtd in estoque_atual}
-    for p in produtos:
-        pid = p[0]
-        if pid not in estoque_dict:
-            estoque_dict[pid] = {'nome': p[1], 'quantidade': 0}
+    quantidades = {p_id: qtd for p_id, _, qtd in get_estoque_loja(loja_id)}
     
     st.markdown("#### Selecionar produto para atualizar estoque")
     
-    selected_produto = st.selectbox("Selecione o produto", produtos, format_func=lambda p: f"{p[0]} - {p[1]}")
-    selected_produto_id = selected_produto[0]
-    
-    current_qtd = estoque_dict[selected_produto_id]['quantidade']
-    st.info(f"Quantidade em estoque: {current_qtd}")
-    
-    novo_valor = st.number_input("Quantidade atual", min_value=0, step=1, value=current_qtd, key=f"novo_qtd_{selected_produto_id}")
-    
-    if st.button("Adicionar atualização"):
-        found = False
-        for item in st.session_state.estoque_updates:
-            if item['produto_id'] == selected_produto_id:
-                item['novo_valor'] = novo_valor
-                found = True
-                break
-        if not found:
-            st.session_state.estoque_updates.append({
-                'produto_id': selected_produto_id,
-                'nome': estoque_dict[selected_produto_id]['nome'],
-                'novo_valor': novo_valor
-            })
-        st.success(f"Atualização para {estoque_dict[selected_produto_id]['nome']} adicionada!")
+    selected_produto = select_produto("Selecione o produto", key="estoque_produto")
+    if selected_produto is not None:
+        selected_produto_id, selected_nome = selected_produto[0], selected_produto[1]
+        
+        current_qtd = quantidades.get(selected_produto_id, 0)
+        st.info(f"Quantidade em estoque: {current_qtd}")
+        
+        novo_valor = st.number_input("Quantidade atual", min_value=0, step=1, value=current_qtd, key=f"novo_qtd_{selected_produto_id}")
+        
+        if st.button("Adicionar atualização"):
+            found = False
+            for item in st.session_state.estoque_updates:
+                if item['produto_id'] == selected_produto_id:
+                    item['novo_valor'] = novo_valor
+                    found = True
+                    break
+            if not found:
+                st.session_state.estoque_updates.append({
+                    'produto_id': selected_produto_id,
+                    'nome': selected_nome,
+                    'novo_valor': novo_valor
+                })
+            st.success(f"Atualização para {selected_nome} adicionada!")
     
     if st.session_state.estoque_updates:
         st.markdown("#### Atualizações selecionadas")
@@ -89,8 +100,9 @@ def main():
     
     if st.button("Confirmar ajustes"):
         updates_dict = {item['produto_id']: item['novo_valor'] for item in st.session_state.estoque_updates}
-        atualizar_estoque(loja_id, updates_dict, data_contagem_manual)
+        resumo = atualizar_estoque(loja_id, updates_dict, data_contagem_manual)
         st.success("Estoque atualizado e movimentações registradas com sucesso!")
+        exibir_resumo_contagem(resumo)
         st.session_state.estoque_updates = []
     
     # --- Seção 2: Atualização via Upload de Planilha ---
@@ -100,14 +112,40 @@ def main():
     uploaded_file = st.file_uploader("Escolha a planilha", type=["csv", "xlsx"])
     
     if uploaded_file is not None:
-        # Ler o arquivo
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
-        
-        # Renomear colunas para corresponder ao esperado
-        df = df.rename(columns={'cod': 'produto_id', 'quantidade': 'novo_valor'})
+        # Só um arquivo novo é conferido e lido; os reruns da edição usam o
+        # quadro guardado (lido de novo se o armazém o descartou por inatividade)
+        hash_arquivo = hash_conteudo(uploaded_file.getvalue())
+        if (st.session_state.get('arquivo_contagem') != (uploaded_file.name, hash_arquivo)
+                or not (st.session_state.get('aviso_contagem') or tem_quadro('df_contagem'))):
+            st.session_state['arquivo_contagem'] = (uploaded_file.name, hash_arquivo)
+            st.session_state['aviso_contagem'] = None
+            remover_quadro('df_contagem')
+            remover_quadro('erros_contagem')
+            # Recusa, antes de ler, uma planilha que já foi registrada nesta loja
+            try:
+                verificar_importacao("contagem", loja_id, hash_arquivo)
+            except ImportacaoDuplicada as e:
+                st.session_state['aviso_contagem'] = str(e)
+            else:
+                # Ler e validar o arquivo; zero é uma contagem válida e, se o código
+                # se repetir, vale a última linha
+                df, erros = normalizar_planilha(
+                    ler_planilha(uploaded_file), ["produto_id", "novo_valor"],
+                    renomear={'cod': 'produto_id', 'quantidade': 'novo_valor'},
+                    catalogo=get_catalogo(), coluna_qtd="novo_valor", descartar_zeros=False,
+                    agregar_por=["produto_id"], agregacao="ultima"
+                )
+                guardar_quadro('df_contagem', df)
+                guardar_quadro('erros_contagem', erros)
+        if st.session_state.get('aviso_contagem'):
+            st.warning(st.session_state['aviso_contagem'])
+            uploaded_file = None
+
+    if uploaded_file is not None:
+        df = obter_quadro('df_contagem')
+        erros = obter_quadro('erros_contagem')
+        if erros is not None:
+            exibir_erros_planilha(erros)
         
         # Exibir e permitir edição
         st.write("Edite os dados abaixo, se necessário:")
@@ -119,8 +157,27 @@ def main():
         # Botão para atualizar o banco de dados
         if st.button("Confirmar Atualização via Planilha"):
             updates_dict = dict(zip(edited_df['produto_id'], edited_df['novo_valor']))
-            atualizar_estoque(loja_id, updates_dict, data_contagem_planilha)
-            st.success("Estoque atualizado via planilha com sucesso!")
+            # Grava em segundo plano, em lotes; o resumo aparece quando terminar.
+            # A planilha entra no registro de importações, então um segundo
+            # clique é recusado em vez de refazer a contagem
+            try:
+                acompanhar_tarefa(enviar_atualizacao_estoque(
+                    loja_id, updates_dict, data_contagem_planilha, hash_arquivo, uploaded_file.name
+                ))
+                st.info("Atualização iniciada. Você pode sair desta página enquanto ela termina.")
+                # no próximo rerun o arquivo é conferido de novo (e recusado, já registrado)
+                st.session_state.pop('arquivo_contagem', None)
+            except ImportacaoDuplicada as e:
+                st.warning(str(e))
+
+    acompanhar_tarefas("contagem", exibir_resumo_contagem)
+
+    # Acertos/erros do cache de estoque por loja
+    stats = get_cache_stats()["estoque"]
+    st.sidebar.caption(
+        f"Cache de estoque: {stats['hits']} acertos, {stats['misses']} consultas ao banco "
+        f"({stats['taxa_acerto']:.0%} de acerto)"
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,13 +1,20 @@
 import streamlit as st
-import pandas as pd
 import datetime as dt
-from utils import select_store, registrar_alerta_validade
+from utils import (select_store, registrar_alertas_validade_lote, get_catalogo, COLUNAS_VALIDADE, exibir_erros_planilha,
+                   hash_conteudo, verificar_importacao, ImportacaoDuplicada, guardar_quadro, obter_quadro,
+                   tem_quadro, remover_quadro)
+from instrumentacao import medir_pagina
+from ingestao import ler_planilha, normalizar_planilha
 
 st.set_page_config(page_title="Alerta de Validade", layout="wide")
 
 # Path to the Excel template; atualize caso mova o arquivo
 TEMPLATE_PATH = "validade.xlsx"
 
+# Vencimentos mais distantes que isso são tratados como erro de digitação
+VALIDADE_MAX_ANOS = 5
+
+@medir_pagina("Alerta de Validade")
 def page_alerta_validade():
     st.title("Alerta de Validade em Lote")
     
@@ -41,25 +48,51 @@ def page_alerta_validade():
         type=["xlsx", "xls", "csv"]
     )
     if uploaded:
-        df = (
-            pd.read_excel(uploaded)
-            if uploaded.name.endswith((".xls", ".xlsx"))
-            else pd.read_csv(uploaded)
-        )
-        expected = {"produto_id", "lote", "data_vencimento", "quantidade"}
-        faltantes = expected - set(df.columns)
-        if faltantes:
-            st.error(f"Colunas obrigatórias não encontradas: {faltantes}")
+        # só um arquivo novo é conferido e lido; os reruns da edição usam o quadro
+        # guardado (lido de novo se o armazém o descartou por inatividade)
+        hash_arquivo = hash_conteudo(uploaded.getvalue())
+        if (st.session_state.get("arquivo_validade") != (uploaded.name, hash_arquivo)
+                or not (st.session_state.get("aviso_validade") or tem_quadro("df_validade"))):
+            st.session_state["arquivo_validade"] = (uploaded.name, hash_arquivo)
+            st.session_state["aviso_validade"] = None
+            remover_quadro("df_validade")
+            remover_quadro("erros_validade")
+            # recusa, antes de ler, uma planilha que já foi registrada nesta loja
+            try:
+                verificar_importacao("validade", loja_id, hash_arquivo)
+            except ImportacaoDuplicada as e:
+                st.session_state["aviso_validade"] = ("warning", str(e))
+            else:
+                # valida: descarta zeros, confere produtos no catálogo e vencimentos
+                # entre hoje e VALIDADE_MAX_ANOS anos; lotes repetidos são somados
+                hoje = dt.date.today()
+                df, erros = normalizar_planilha(
+                    ler_planilha(uploaded), COLUNAS_VALIDADE, catalogo=get_catalogo(),
+                    coluna_data="data_vencimento", data_min=hoje,
+                    data_max=hoje + dt.timedelta(days=365 * VALIDADE_MAX_ANOS),
+                    colunas_texto=("lote",), agregar_por=["produto_id", "lote", "data_vencimento"]
+                )
+                if not erros.empty and erros["linha"].isna().all():
+                    st.session_state["aviso_validade"] = (
+                        "error", f"Colunas obrigatórias não encontradas: {set(erros['coluna'])}"
+                    )
+                else:
+                    df["data_vencimento"] = df["data_vencimento"].dt.date
+                    guardar_quadro("df_validade", df, categorias=("lote",))
+                    guardar_quadro("erros_validade", erros)
+        if st.session_state.get("aviso_validade"):
+            nivel, texto = st.session_state["aviso_validade"]
+            getattr(st, nivel)(texto)
             return
-
-        # descarta zeros e reseta índice
-        df = df[df["quantidade"] != 0].reset_index(drop=True)
-        st.session_state["df_validade"] = df
+        erros = obter_quadro("erros_validade")
+        if erros is not None:
+            exibir_erros_planilha(erros)
 
     # 4) Edição interativa
-    if "df_validade" in st.session_state and not st.session_state["df_validade"].empty:
+    df_validade = obter_quadro("df_validade")
+    if df_validade is not None and not df_validade.empty:
         df_edit = st.data_editor(
-            st.session_state["df_validade"],
+            df_validade,
             num_rows="dynamic",
             column_config={
                 "produto_id":      st.column_config.NumberColumn("produto_id", required=True),
@@ -68,22 +101,22 @@ def page_alerta_validade():
                 "quantidade":      st.column_config.NumberColumn("quantidade", required=True, min_value=1),
             }
         )
-        st.session_state["df_validade"] = df_edit
+        guardar_quadro("df_validade", df_edit, categorias=("lote",))
 
-        # 5) Registro automático com timestamp atual
+        # 5) Registro automático com timestamp atual, tudo em uma transação
         if st.button("Registrar Alertas em Lote"):
-            timestamp = dt.datetime.now()
-            for _, row in st.session_state["df_validade"].iterrows():
-                registrar_alerta_validade(
-                    loja_id=loja_id,
-                    produto_id=int(row["produto_id"]),
-                    quantidade=int(row["quantidade"]),
-                    data_vencimento=row["data_vencimento"],
-                    lote=row["lote"],
-                    data=timestamp
+            arquivo, hash_arquivo = st.session_state.get("arquivo_validade", (None, None))
+            try:
+                total = registrar_alertas_validade_lote(
+                    loja_id, df_edit, data=dt.datetime.now(),
+                    hash_arquivo=hash_arquivo, arquivo=arquivo
                 )
-            st.success("Alertas de validade registrados com sucesso!")
-            del st.session_state["df_validade"]
+            except ValueError as e:  # inclui ImportacaoDuplicada
+                st.error(str(e))
+                return
+            st.success(f"{total} alertas de validade registrados com sucesso!")
+            remover_quadro("df_validade")
+            remover_quadro("erros_validade")
 
 if __name__ == "__main__":
     page_alerta_validade()
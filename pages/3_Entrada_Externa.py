@@ -1,8 +1,10 @@
 import streamlit as st
-from utils import select_store, get_produtos, registrar_entrada
+from utils import select_store, select_produto, registrar_entrada
+from instrumentacao import medir_pagina
 
 st.set_page_config(page_title="Entrada de Estoque", layout="wide")
 
+@medir_pagina("Entrada de Estoque")
 def main():
     st.title("Entrada de Estoque")
     
@@ -14,9 +16,7 @@ def main():
     loja_id, loja_nome = loja_info
     st.write(f"Registrando entrada para a loja: **{loja_nome}**")
     
-    produtos = get_produtos()
-    produto_selecionado = st.selectbox("Selecione o produto", produtos,
-                                       format_func=lambda p: f"{p[0]} - {p[1]}")
+    produto_selecionado = select_produto("Selecione o produto", key="entrada_produto")
     
     quantidade = st.number_input("Quantidade", min_value=1, step=1, value=1)
     motivo = st.text_input("Motivo da entrada (opcional)")
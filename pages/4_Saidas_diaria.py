@@ -1,14 +1,28 @@
 #Saidas Diárias
 
 import streamlit as st
-import pandas as pd
 import datetime as dt
-from utils import select_store, registrar_saida_planilha
+from utils import (select_store, enviar_saida_planilha, acompanhar_tarefa, acompanhar_tarefas, get_catalogo,
+                   exibir_erros_planilha, hash_conteudo, verificar_importacao, ImportacaoDuplicada,
+                   guardar_quadro, obter_quadro, tem_quadro, remover_quadro)
+from instrumentacao import medir_pagina
+from ingestao import ler_planilha, normalizar_planilha
 
 st.set_page_config(page_title="Saída Diária", layout="wide")
 
 TEMPLATE_PATH = "estoque.xlsx"
 
+# Valida a planilha de saídas: `cod` vira `produto_id` para a gravação e
+# volta a ser `cod` só na tabela exibida para edição
+def validar_saidas(df):
+    df, erros = normalizar_planilha(
+        df, ["produto_id", "quantidade"], renomear={"cod": "produto_id"},
+        catalogo=get_catalogo(), agregar_por=["produto_id"]
+    )
+    erros["coluna"] = erros["coluna"].replace({"produto_id": "cod"})
+    return df.rename(columns={"produto_id": "cod"}), erros
+
+@medir_pagina("Saída Diária")
 def page_saida_diaria():
     st.title("Saída Diária de Estoque")
 
@@ -20,6 +34,8 @@ def page_saida_diaria():
     loja_id, loja_nome = loja_info
 
     st.write(f"Ajuste de estoque para a loja: **{loja_nome}**")
+    # Progresso das saídas enviadas por esta sessão (pode-se sair da página enquanto gravam)
+    acompanhar_tarefas("saida")
     # 2) Download do template 
     try:
         with open(TEMPLATE_PATH, "rb") as f:
@@ -35,22 +51,42 @@ def page_saida_diaria():
 
     # 2) Upload da planilha
     st.markdown("Faça upload de uma planilha CSV ou Excel com colunas: `cod`, `produto`, `quantidade`.")
-    uploaded = st.file_uploader("Arquivo de Saída", type=["csv", "xlsx"])
+    # a chave muda a cada envio para esvaziar o campo de upload
+    uploaded = st.file_uploader("Arquivo de Saída", type=["csv", "xlsx"],
+                                key=f"upload_saida_{st.session_state.get('envios_saida', 0)}")
     if uploaded:
-        # lê o arquivo
-        if uploaded.name.endswith(".csv"):
-            df = pd.read_csv(uploaded)
-        else:
-            df = pd.read_excel(uploaded)
-        # remove linhas com quantidade zero
-        df = df[df["quantidade"] != 0].reset_index(drop=True)
-        # armazena para edição
-        st.session_state['df_saida'] = df
+        # só um arquivo novo é conferido e lido; os reruns da edição usam o quadro
+        # guardado (lido de novo se o armazém o descartou por inatividade)
+        hash_arquivo = hash_conteudo(uploaded.getvalue())
+        if (st.session_state.get('arquivo_saida') != (uploaded.name, hash_arquivo)
+                or not (st.session_state.get('aviso_saida') or tem_quadro('df_saida'))):
+            st.session_state['arquivo_saida'] = (uploaded.name, hash_arquivo)
+            st.session_state['aviso_saida'] = None
+            remover_quadro('df_saida')
+            remover_quadro('erros_saida')
+            # recusa, antes de ler, uma planilha que já foi registrada nesta loja
+            try:
+                verificar_importacao("saida", loja_id, hash_arquivo)
+            except ImportacaoDuplicada as e:
+                st.session_state['aviso_saida'] = str(e)
+            else:
+                # lê e valida o arquivo (zeros descartados, códigos conferidos no catálogo)
+                df, erros = validar_saidas(ler_planilha(uploaded))
+                # armazena para edição (compacto, fora do session_state)
+                guardar_quadro('df_saida', df, categorias=('produto',))
+                guardar_quadro('erros_saida', erros)
+        if st.session_state.get('aviso_saida'):
+            st.warning(st.session_state['aviso_saida'])
+            return
+        erros = obter_quadro('erros_saida')
+        if erros is not None:
+            exibir_erros_planilha(erros)
 
     # 3) Edição e data
-    if 'df_saida' in st.session_state and not st.session_state['df_saida'].empty:
+    df_saida = obter_quadro('df_saida')
+    if df_saida is not None and not df_saida.empty:
         df_edit = st.data_editor(
-            st.session_state['df_saida'],
+            df_saida,
             num_rows="dynamic",
             column_config={
                 "cod": st.column_config.NumberColumn("cod", required=True),
@@ -58,27 +94,37 @@ def page_saida_diaria():
                 "quantidade": st.column_config.NumberColumn("quantidade", required=True, min_value=1)
             }
         )
-        st.session_state['df_saida'] = df_edit
+        guardar_quadro('df_saida', df_edit, categorias=('produto',))
 
         data_saida = st.date_input("Data da Saída", value=dt.date.today())
 
         if st.button("Registrar Saídas"):
-            # garante que zero não entra
-            df_final = st.session_state['df_saida']
-            df_final = df_final[df_final["quantidade"] != 0]
+            # revalida após a edição; códigos repetidos viram uma linha só
+            df_final, erros = validar_saidas(df_edit)
+            if not erros.empty:
+                exibir_erros_planilha(erros)
+                return
             if df_final.empty:
                 st.warning("Nenhum item com quantidade > 0 para registrar.")
             else:
-                itens = [
-                    {"produto_id": int(row["cod"]), "quantidade": int(row["quantidade"])}
-                    for _, row in df_final.iterrows()
-                ]
+                itens = (df_final[["cod", "quantidade"]]
+                         .rename(columns={"cod": "produto_id"})
+                         .to_dict(orient="records"))
                 timestamp = dt.datetime.combine(data_saida, dt.datetime.now().time())
-                registrar_saida_planilha(loja_id, itens, timestamp)
-
-                st.success("Saídas registradas com sucesso!")
+                # grava em segundo plano, em lotes; o progresso aparece no topo da página
+                arquivo, hash_arquivo = st.session_state.get('arquivo_saida', (None, None))
+                try:
+                    acompanhar_tarefa(enviar_saida_planilha(loja_id, itens, timestamp, hash_arquivo, arquivo))
+                except ImportacaoDuplicada as e:
+                    st.warning(str(e))
+                    return
+                st.session_state['envios_saida'] = st.session_state.get('envios_saida', 0) + 1
             # limpa para novo uso
-            del st.session_state['df_saida']
+            remover_quadro('df_saida')
+            remover_quadro('erros_saida')
+            st.session_state.pop('arquivo_saida', None)
+            if not df_final.empty:
+                st.rerun()
 
 def main():
     page_saida_diaria()
@@ -1,15 +1,86 @@
 import streamlit as st
-from utils import get_lojas, registrar_entrada_xml
+from utils import (get_lojas, enviar_entrada_xml, acompanhar_tarefa, acompanhar_tarefas, buscar_importacoes, hash_conteudo,
+                   guardar_quadro, obter_quadro, tem_quadro, remover_quadro)
+from instrumentacao import medir_pagina
+from nfe import extrair_xmls, ler_nfes, chave_acesso
 import pandas as pd
-import xmltodict
-import json
 import datetime as dt
 
 st.set_page_config(page_title="Lançamento via XML", layout="wide")
 
+# Colunas que se repetem em todos os itens de uma nota, guardadas como category
+COLUNAS_REPETIDAS = ("nota", "motivo", "data", "hash")
+
+# Descarta, antes de ler os XMLs, as notas que já constam no registro de
+# importações (mesmo conteúdo nesta loja ou mesma chave de acesso)
+def filtrar_notas_lancadas(loja_id, entradas):
+    hashes = [hash_conteudo(conteudo) for _, conteudo in entradas]
+    chaves = [chave_acesso(conteudo) for _, conteudo in entradas]
+    registros = buscar_importacoes("nfe", loja_id, hashes, chaves)
+    hashes_lancados = {r["hash"] for r in registros if r["loja_id"] == loja_id}
+    chaves_lancadas = {r["chave_nfe"]: r for r in registros if r["chave_nfe"]}
+    novas = []
+    for (nome, conteudo), h, chave in zip(entradas, hashes, chaves):
+        registro = chaves_lancadas.get(chave)
+        if registro is not None:
+            st.warning(f"{nome}: nota {chave} já lançada em {registro['importado_em']:%d/%m/%Y %H:%M} "
+                       f"(loja {registro['loja_id']}), ignorada.")
+        elif h in hashes_lancados:
+            st.warning(f"{nome}: arquivo já lançado nesta loja, ignorado.")
+        else:
+            novas.append((nome, conteudo, h))
+    return novas
+
+# Lê todas as notas enviadas (XMLs soltos ou dentro de ZIPs) e junta os itens
+# em um único DataFrame, marcando cada linha com a nota de origem e o hash do
+# XML (usado no registro de importações)
+def carregar_notas(loja_id, uploaded_files):
+    entradas = filtrar_notas_lancadas(loja_id, list(extrair_xmls(uploaded_files)))
+    notas = ler_nfes([(nome, conteudo) for nome, conteudo, _ in entradas])
+    agora = dt.datetime.now().isoformat()
+    product_list = []
+    chaves_vistas = set()
+    registro = {}
+    for nota, (_, _, h) in zip(notas, entradas):
+        if nota["erro"]:
+            st.error(f"{nota['arquivo']}: {nota['erro']}")
+            continue
+        if not nota["itens"]:
+            st.warning(f"{nota['arquivo']}: não foram encontrados itens no XML.")
+            continue
+        if nota["chave"] and nota["chave"] in chaves_vistas:
+            st.warning(f"{nota['arquivo']}: nota {nota['chave']} repetida no envio, ignorada.")
+            continue
+        chaves_vistas.add(nota["chave"])
+        registro[h] = {"chave": nota["chave"], "arquivo": nota["arquivo"]}
+        product_list.extend(
+            {
+                "nota": nota["numero"] or nota["arquivo"],
+                "id": item.get("cProd", ""),
+                "quantidade": item.get("qCom", ""),
+                "motivo": "Entrada via XML",
+                "data": agora,
+                "hash": h
+            }
+            for item in nota["itens"]
+        )
+    df = pd.DataFrame(product_list, columns=["nota", "id", "quantidade", "motivo", "data", "hash"])
+    return df, registro
+
+# Resultado do lançamento: notas que outra gravação lançou primeiro
+def exibir_notas_ignoradas(ignoradas):
+    if ignoradas:
+        st.warning(f"{len(ignoradas)} nota(s) já estavam lançadas e foram ignoradas.")
+
+@medir_pagina("Lançamento via XML")
 def page_xml_lancamento():
     st.title("Lançamento de Produtos via XML")
-    st.markdown("Faça o upload do arquivo XML com os lançamentos de produtos.")
+    st.markdown(
+        "Faça o upload de um ou mais arquivos XML de NF-e, ou de um ZIP com as notas do dia. "
+        "Todos os itens são revisados juntos e lançados em segundo plano."
+    )
+    # Progresso dos lançamentos enviados por esta sessão (pode-se sair da página enquanto gravam)
+    acompanhar_tarefas("entrada_xml", exibir_notas_ignoradas)
 
     # Seleção da loja
     lojas = get_lojas()
@@ -19,36 +90,32 @@ def page_xml_lancamento():
     lojas_dict = {f"{loja[0]} - {loja[1]}": loja[0] for loja in lojas}
     loja_id = lojas_dict[st.selectbox("Selecione a loja", list(lojas_dict.keys()))]
 
-    # Upload do XML
-    uploaded_file = st.file_uploader("Selecione o arquivo XML", type=["xml"])
-    if uploaded_file:
-        # Verificar se o arquivo mudou ou se é o primeiro upload
-        if ("uploaded_file_name" not in st.session_state or 
-            st.session_state.uploaded_file_name != uploaded_file.name):
-            st.session_state.uploaded_file_name = uploaded_file.name
+    # Upload dos XMLs / ZIPs
+    uploaded_files = st.file_uploader(
+        "Selecione os arquivos XML ou ZIP", type=["xml", "zip"], accept_multiple_files=True,
+        key=f"upload_xml_{st.session_state.get('envios_xml', 0)}"  # muda a cada envio para esvaziar o campo
+    )
+    if uploaded_files:
+        # Verificar se a loja ou o conjunto de arquivos mudou, se é o primeiro upload
+        # ou se os itens da sessão foram descartados por inatividade
+        nomes = (loja_id, tuple(sorted(f.name for f in uploaded_files)))
+        if ("uploaded_file_name" not in st.session_state or
+            st.session_state.uploaded_file_name != nomes or not tem_quadro("df_products")):
+            st.session_state.uploaded_file_name = nomes
             try:
-                xml_content = uploaded_file.read()
-                xml_dict = xmltodict.parse(xml_content)
-                json_data = json.loads(json.dumps(xml_dict))
-                items = json_data.get("nfeProc", {}).get("NFe", {}).get("infNFe", {}).get("det")
-                if items is None:
-                    st.error("Não foram encontrados itens no XML.")
-                    return
-                if not isinstance(items, list):
-                    items = [items]
-                product_list = [
-                    {
-                        "id": item.get("prod", {}).get("cProd", ""),
-                        "quantidade": item.get("prod", {}).get("qCom", ""),
-                        "motivo": "Entrada via XML",
-                        "data": dt.datetime.now().isoformat()
-                    }
-                    for item in items
-                ]
-                st.session_state.df_products = pd.DataFrame(product_list)
+                df_products, st.session_state.notas_xml = carregar_notas(loja_id, uploaded_files)
             except Exception as e:
-                st.error(f"Erro ao processar o arquivo XML: {e}")
+                st.error(f"Erro ao processar os arquivos XML: {e}")
                 return
+            guardar_quadro("df_products", df_products, categorias=COLUNAS_REPETIDAS)
+
+        df_products = obter_quadro("df_products")
+        if df_products is None or df_products.empty:
+            return
+        st.write(
+            f"{df_products['nota'].nunique()} nota(s), "
+            f"{len(df_products)} item(ns)."
+        )
 
         # Seção para ajustar a data em massa
         st.subheader("Ajustar Data para Todos os Produtos")
@@ -56,27 +123,33 @@ def page_xml_lancamento():
         if st.button("Aplicar Data a Todos"):
             current_time = dt.datetime.now().time()
             selected_datetime = dt.datetime.combine(selected_date, current_time)
-            st.session_state.df_products["data"] = selected_datetime.isoformat()
+            df_products["data"] = selected_datetime.isoformat()
+            guardar_quadro("df_products", df_products, categorias=COLUNAS_REPETIDAS)
             st.success("Data aplicada a todos os produtos com sucesso!")
 
         # Exibir e permitir edição do DataFrame
         st.markdown("### Visualize e Edite os Lançamentos")
         edited_df = st.data_editor(
-            st.session_state.df_products,
+            df_products,
             num_rows="dynamic",
-            key="data_editor"
+            key="data_editor",
+            column_config={"nota": st.column_config.TextColumn("nota", disabled=True), "hash": None}
         )
-        # Atualizar o session_state com as edições feitas
-        st.session_state.df_products = edited_df
+        # Guardar as edições feitas
+        guardar_quadro("df_products", edited_df, categorias=COLUNAS_REPETIDAS)
 
-        # Botão para confirmar o lançamento
+        # Botão para confirmar o lançamento: gravado em segundo plano, em lotes
+        # que nunca dividem uma nota entre duas transações
         if st.button("Confirmar Lançamento"):
-            registrar_entrada_xml(loja_id, st.session_state.df_products.to_dict(orient="records"))
-            st.success("Produtos lançados com sucesso!")
-            # Limpar o session_state após o lançamento
-            del st.session_state.df_products
+            acompanhar_tarefa(enviar_entrada_xml(
+                loja_id, edited_df.to_dict(orient="records"), st.session_state.notas_xml
+            ))
+            st.session_state.envios_xml = st.session_state.get("envios_xml", 0) + 1
+            # Limpar os itens da sessão após o lançamento
+            remover_quadro("df_products")
             if "uploaded_file_name" in st.session_state:
                 del st.session_state.uploaded_file_name
+            st.rerun()
 
 def main():
     page_xml_lancamento()
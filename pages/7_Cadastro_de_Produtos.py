@@ -0,0 +1,58 @@
+import streamlit as st
+import pandas as pd
+from utils import cadastrar_novo_produto, cadastrar_produtos_lote, COLUNAS_PRODUTO
+from instrumentacao import medir_pagina
+
+st.set_page_config(page_title="Cadastro de Produtos", layout="wide")
+
+@medir_pagina("Cadastro de Produtos")
+def page_cadastro_produtos():
+    st.title("Cadastro de Produtos")
+
+    # 1) Cadastro individual
+    st.subheader("Cadastrar um produto")
+    with st.form("form_produto", clear_on_submit=True):
+        nome = st.text_input("Nome")
+        categoria = st.text_input("Categoria")
+        unidade_medida = st.text_input("Unidade de medida", value="UN")
+        valor = st.number_input("Valor", min_value=0.0, step=0.01, format="%.2f")
+        if st.form_submit_button("Cadastrar"):
+            if not nome.strip():
+                st.error("Informe o nome do produto.")
+            else:
+                novo_id = cadastrar_novo_produto(nome.strip(), categoria, unidade_medida, valor)
+                st.success(f"Produto **{nome}** cadastrado com o código {novo_id}.")
+
+    # 2) Cadastro em lote via planilha
+    st.subheader("Cadastrar produtos via planilha")
+    st.markdown(
+        "Faça upload de uma planilha CSV ou Excel com as colunas: "
+        + ", ".join(f"`{c}`" for c in COLUNAS_PRODUTO) + ". Os códigos são gerados automaticamente."
+    )
+    uploaded = st.file_uploader("Planilha de produtos", type=["csv", "xlsx"])
+    if uploaded:
+        if uploaded.name.endswith(".csv"):
+            df = pd.read_csv(uploaded)
+        else:
+            df = pd.read_excel(uploaded)
+        st.session_state["df_produtos_novos"] = df
+
+    if "df_produtos_novos" in st.session_state and not st.session_state["df_produtos_novos"].empty:
+        df_edit = st.data_editor(st.session_state["df_produtos_novos"], num_rows="dynamic")
+        st.session_state["df_produtos_novos"] = df_edit
+
+        if st.button("Cadastrar Produtos em Lote"):
+            try:
+                resultado = cadastrar_produtos_lote(st.session_state["df_produtos_novos"])
+            except ValueError as e:
+                st.error(str(e))
+                return
+            st.success(f"{len(resultado['inseridos'])} produtos cadastrados.")
+            st.dataframe(resultado["inseridos"], use_container_width=True)
+            if not resultado["conflitos"].empty:
+                st.warning(f"{len(resultado['conflitos'])} produtos não foram cadastrados:")
+                st.dataframe(resultado["conflitos"], use_container_width=True)
+            del st.session_state["df_produtos_novos"]
+
+if __name__ == "__main__":
+    page_cadastro_produtos()
@@ -0,0 +1,104 @@
+import os
+import streamlit as st
+import pandas as pd
+from utils import get_pool_stats, get_cache_stats, get_executor_tarefas, get_armazem_sessoes, memoria_sessoes
+import instrumentacao
+from instrumentacao import medir_pagina
+
+st.set_page_config(page_title="Desempenho", layout="wide")
+
+# Tabela de uma métrica do resumo, com tempos em milissegundos
+def tabela_metrica(df, metrica, rotulos, em_ms=True):
+    parte = df[df["metrica"] == metrica]
+    if parte.empty:
+        st.info("Ainda não há medições.")
+        return
+    parte = parte[rotulos + ["contagem", "media", "maximo", "soma"]].copy()
+    if em_ms:
+        parte[["media", "maximo", "soma"]] *= 1000
+        parte = parte.rename(columns={"media": "media_ms", "maximo": "maximo_ms", "soma": "total_ms"})
+    st.dataframe(parte.sort_values(parte.columns[-1], ascending=False), use_container_width=True)
+
+@medir_pagina("Desempenho")
+def page_desempenho():
+    st.title("Desempenho do App")
+    st.caption("Medições deste processo desde a última reinicialização.")
+
+    # 1) Pool de conexões e caches
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.subheader("Pool de conexões")
+        st.json(get_pool_stats())
+    with col2:
+        st.subheader("Caches")
+        st.json(get_cache_stats())
+    with col3:
+        st.subheader("Gravações em segundo plano")
+        st.json(get_executor_tarefas().estatisticas())
+        tarefas = get_executor_tarefas().listar()
+        if tarefas:
+            st.dataframe(pd.DataFrame(tarefas).drop(columns=["resultado"]), use_container_width=True)
+
+    # Planilhas em revisão guardadas por sessão (memória e arquivos Parquet)
+    with st.expander("Planilhas em revisão por sessão"):
+        st.json(get_armazem_sessoes().estatisticas())
+        sessoes = memoria_sessoes()
+        if sessoes:
+            tabela = pd.DataFrame(sessoes)
+            tabela[["memoria_mb", "disco_mb"]] = tabela[["memoria_bytes", "disco_bytes"]] / (1024 * 1024)
+            st.dataframe(tabela.drop(columns=["memoria_bytes", "disco_bytes"]), use_container_width=True)
+        else:
+            st.info("Nenhuma planilha em revisão.")
+
+    df = pd.DataFrame(instrumentacao.resumo())
+    if df.empty:
+        st.info("Ainda não há medições.")
+        return
+
+    # 2) Onde o tempo foi gasto
+    aba_paginas, aba_funcoes, aba_sql, aba_conexao, aba_conflitos = st.tabs(
+        ["Páginas (por rerun)", "Funções de dados", "Comandos SQL", "Espera por conexão", "Conflitos de lock"]
+    )
+    with aba_paginas:
+        tabela_metrica(df, "estoque_pagina_segundos", ["pagina"])
+        st.markdown("Idas ao banco por rerun")
+        tabela_metrica(df, "estoque_pagina_idas", ["pagina"], em_ms=False)
+    with aba_funcoes:
+        tabela_metrica(df, "estoque_funcao_segundos", ["funcao"])
+        st.markdown("Idas ao banco por chamada")
+        tabela_metrica(df, "estoque_funcao_idas", ["funcao"], em_ms=False)
+    with aba_sql:
+        tabela_metrica(df, "estoque_sql_segundos", ["funcao", "comando"])
+        st.markdown("Linhas por comando")
+        tabela_metrica(df, "estoque_sql_linhas", ["funcao", "comando"], em_ms=False)
+    with aba_conexao:
+        tabela_metrica(df, "estoque_conexao_espera_segundos", [])
+    with aba_conflitos:
+        st.markdown("Gravações repetidas após deadlock, falha de serialização ou lock_timeout")
+        tabela_metrica(df, "estoque_transacao_retentativas", ["funcao", "motivo"], em_ms=False)
+        st.markdown("Gravações que falharam mesmo após todas as tentativas")
+        tabela_metrica(df, "estoque_transacao_desistencias", ["funcao", "motivo"], em_ms=False)
+
+    # 3) Exportação para o Prometheus
+    st.subheader("Exportação")
+    st.download_button("📥 Baixar métricas (formato Prometheus)", instrumentacao.texto_prometheus(),
+                       file_name="estoque.prom", mime="text/plain")
+    arquivo = instrumentacao.CONFIG["arquivo_prometheus"]
+    if arquivo:
+        st.write(f"Arquivo lido pelo coletor: `{arquivo}`")
+        if st.button("Gravar arquivo agora"):
+            instrumentacao.gravar_prometheus()
+            st.success("Arquivo de métricas atualizado.")
+
+    # 4) Consultas lentas
+    if instrumentacao.CONFIG["consulta_lenta_ms"] is not None:
+        st.subheader(f"Consultas lentas (≥ {instrumentacao.CONFIG['consulta_lenta_ms']} ms)")
+        caminho = instrumentacao.CONFIG["arquivo_consultas_lentas"]
+        if os.path.exists(caminho):
+            with open(caminho, encoding="utf-8") as f:
+                st.code("".join(f.readlines()[-50:]) or "(vazio)")
+        else:
+            st.info("Nenhuma consulta lenta registrada.")
+
+if __name__ == "__main__":
+    page_desempenho()
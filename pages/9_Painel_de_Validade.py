@@ -0,0 +1,76 @@
+import streamlit as st
+from utils import select_store, get_lotes_validade, get_resumo_validade, sugestao_fefo
+from instrumentacao import medir_pagina
+
+st.set_page_config(page_title="Painel de Validade", layout="wide")
+
+FAIXAS = ["vencido", "7 dias", "15 dias", "30 dias"]
+
+@medir_pagina("Painel de Validade")
+def page_painel_validade():
+    st.title("Painel de Validade")
+    st.caption(
+        "O restante de cada lote é estimado: o estoque atual é atribuído primeiro aos lotes "
+        "que vencem por último, como se as saídas seguissem FEFO."
+    )
+
+    # 1) Panorama de todas as lojas: lotes com saldo por faixa de vencimento
+    st.subheader("Todas as lojas")
+    resumo = get_resumo_validade()
+    if resumo.empty:
+        st.info("Nenhum lote com saldo vence nos próximos 30 dias.")
+    else:
+        panorama = (resumo.pivot_table(index="loja", columns="faixa", values="quantidade",
+                                       aggfunc="sum", fill_value=0)
+                    .reindex(columns=FAIXAS, fill_value=0))
+        st.dataframe(panorama, use_container_width=True)
+
+    # 2) Seleção da loja
+    loja_info = select_store()
+    if loja_info is None:
+        st.warning("Por favor, selecione uma loja para ver os lotes.")
+        return
+    loja_id, loja_nome = loja_info
+
+    lotes = get_lotes_validade(loja_id)
+    mostrar_consumidos = st.checkbox("Mostrar lotes sem saldo estimado", value=False)
+    visiveis = lotes if mostrar_consumidos else lotes[lotes["restante"] > 0]
+
+    # 3) Lotes por faixa: vencidos, 7, 15 e 30 dias
+    st.subheader(f"{loja_nome} — lotes a vencer")
+    proximos = visiveis[visiveis["faixa"].isin(FAIXAS)]
+    colunas = st.columns(len(FAIXAS))
+    for coluna, faixa in zip(colunas, FAIXAS):
+        da_faixa = proximos[proximos["faixa"] == faixa]
+        coluna.metric(faixa.capitalize(), f"{len(da_faixa)} lotes", f"{da_faixa['restante'].sum():,.0f} un.",
+                      delta_color="off")
+    abas = st.tabs([faixa.capitalize() for faixa in FAIXAS])
+    for aba, faixa in zip(abas, FAIXAS):
+        with aba:
+            da_faixa = proximos[proximos["faixa"] == faixa]
+            if da_faixa.empty:
+                st.info("Nenhum lote nesta faixa.")
+            else:
+                st.dataframe(
+                    da_faixa[["produto_id", "nome", "lote", "vencimento", "dias", "quantidade", "restante"]],
+                    use_container_width=True, hide_index=True
+                )
+
+    # 4) Sugestão FEFO: ordem de retirada dos lotes por produto
+    st.subheader("Ordem de retirada (FEFO)")
+    fefo = sugestao_fefo(lotes)
+    if fefo.empty:
+        st.info("Nenhum lote com saldo estimado nesta loja.")
+        return
+    termo = st.text_input("Filtrar produto (nome ou código)")
+    if termo:
+        fefo = fefo[fefo["nome"].str.contains(termo, case=False, regex=False)
+                    | (fefo["produto_id"].astype(str) == termo.strip())]
+    st.dataframe(fefo, use_container_width=True, hide_index=True)
+    st.download_button(
+        "📥 Baixar sugestão FEFO (CSV)", fefo.to_csv(index=False).encode("utf-8"),
+        file_name=f"fefo_loja_{loja_id}.csv", mime="text/csv"
+    )
+
+if __name__ == "__main__":
+    page_painel_validade()
@@ -0,0 +1,104 @@
+"""
+Demanda, cobertura e sugestão de compra a partir do histórico de saídas.
+
+As saídas diárias chegam como uma linha por (loja, produto, dia com venda).
+Dias sem venda contam como demanda zero, então as médias e desvios são
+calculados com somas por série (np.bincount sobre o código de cada par
+loja/produto), sem montar a matriz série × dia: o custo é proporcional às
+linhas lidas, para o catálogo inteiro de todas as lojas de uma vez.
+
+Para cada série:
+- demanda_diaria: média móvel dos últimos JANELA_DEMANDA dias;
+- demanda_7d: média dos últimos 7 dias (tendência recente);
+- desvio: desvio padrão diário nos últimos JANELA_VARIABILIDADE dias;
+- estoque_seguranca = z(nível de serviço) × desvio × √prazo;
+- ponto_pedido = demanda_diaria × prazo + estoque_seguranca;
+- dias_cobertura = estoque / demanda_diaria;
+- sugestao: quando o estoque está no ponto de pedido ou abaixo, o que falta
+  para cobrir prazo + dias entre pedidos, mais o estoque de segurança.
+"""
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+JANELA_DEMANDA = 28
+JANELA_RECENTE = 7
+JANELA_VARIABILIDADE = 56
+
+PRAZO_PADRAO = 7
+CICLO_PADRAO = 7
+NIVEL_SERVICO_PADRAO = 0.95
+
+COLUNAS_DEMANDA = ["demanda_diaria", "demanda_7d", "desvio", "dias_com_venda", "ultima_venda"]
+COLUNAS_REPOSICAO = ["loja_id", "produto_id", "estoque", "demanda_diaria", "demanda_7d", "desvio",
+                     "dias_cobertura", "estoque_seguranca", "ponto_pedido", "sugestao", "ultima_venda"]
+
+
+def dias_consultados():
+    return max(JANELA_DEMANDA, JANELA_VARIABILIDADE)
+
+
+def estatisticas_demanda(saidas, hoje):
+    """
+    `saidas` tem colunas loja_id, produto_id, dia e quantidade, uma linha por
+    dia com venda. Devolve um DataFrame indexado por (loja_id, produto_id)
+    com COLUNAS_DEMANDA; `hoje` é o último dia das janelas.
+    """
+    chaves = ["loja_id", "produto_id"]
+    series = pd.MultiIndex.from_frame(saidas[chaves].drop_duplicates())
+    if saidas.empty:
+        return pd.DataFrame(columns=COLUNAS_DEMANDA, index=series)
+    # Código de cada linha = posição da série em `series` (ordem de aparição)
+    codigos = saidas.groupby(chaves, sort=False).ngroup().to_numpy()
+    n = len(series)
+    dias = pd.to_datetime(saidas["dia"])
+    idade = (pd.Timestamp(hoje) - dias).dt.days.to_numpy()
+    quantidade = saidas["quantidade"].to_numpy(dtype=np.float64)
+
+    def soma(valores, janela):
+        return np.bincount(codigos, weights=np.where(idade < janela, valores, 0.0), minlength=n)
+
+    # Variância com dias sem venda valendo zero: (Σx² − N·média²) / (N − 1)
+    media_var = soma(quantidade, JANELA_VARIABILIDADE) / JANELA_VARIABILIDADE
+    quadrados = soma(quantidade ** 2, JANELA_VARIABILIDADE)
+    variancia = (quadrados - JANELA_VARIABILIDADE * media_var ** 2) / (JANELA_VARIABILIDADE - 1)
+
+    return pd.DataFrame({
+        "demanda_diaria": soma(quantidade, JANELA_DEMANDA) / JANELA_DEMANDA,
+        "demanda_7d": soma(quantidade, JANELA_RECENTE) / JANELA_RECENTE,
+        "desvio": np.sqrt(np.clip(variancia, 0, None)),
+        "dias_com_venda": soma(np.ones_like(quantidade), JANELA_DEMANDA).astype(np.int32),
+        "ultima_venda": dias.groupby(codigos).max().to_numpy(),
+    }, index=series)
+
+
+def sugerir_reposicao(demanda, estoque, prazo=PRAZO_PADRAO, ciclo=CICLO_PADRAO,
+                      nivel_servico=NIVEL_SERVICO_PADRAO):
+    """
+    Cruza a demanda (de estatisticas_demanda) com `estoque`, uma Series
+    indexada por (loja_id, produto_id); produtos sem linha de estoque contam
+    como zero. Devolve COLUNAS_REPOSICAO, dos menores dias de cobertura para
+    os maiores.
+    """
+    if demanda.empty:
+        return pd.DataFrame(columns=COLUNAS_REPOSICAO)
+    atual = estoque.reindex(demanda.index, fill_value=0).to_numpy(dtype=np.float64)
+    media = demanda["demanda_diaria"].to_numpy(dtype=np.float64)
+    desvio = demanda["desvio"].to_numpy(dtype=np.float64)
+
+    z = NormalDist().inv_cdf(nivel_servico)
+    seguranca = z * desvio * np.sqrt(prazo)
+    ponto_pedido = media * prazo + seguranca
+    alvo = media * (prazo + ciclo) + seguranca
+    disponivel = np.clip(atual, 0, None)
+    cobertura = np.divide(disponivel, media, out=np.full_like(media, np.nan), where=media > 0)
+    sugestao = np.where((media > 0) & (disponivel <= ponto_pedido), np.ceil(alvo - disponivel), 0)
+
+    tabela = demanda.reset_index()
+    tabela["estoque"] = atual
+    tabela["dias_cobertura"] = cobertura
+    tabela["estoque_seguranca"] = seguranca
+    tabela["ponto_pedido"] = ponto_pedido
+    tabela["sugestao"] = np.clip(sugestao, 0, None).astype(np.int64)
+    return tabela[COLUNAS_REPOSICAO].sort_values("dias_cobertura", na_position="last", ignore_index=True)
@@ -0,0 +1,222 @@
+"""
+Armazém, por processo, das planilhas carregadas em cada sessão do navegador.
+
+As páginas de upload (saídas, contagem, validade, XML) guardam aqui o DataFrame que o
+usuário está revisando, em vez de deixá-lo inteiro em st.session_state:
+- ao guardar, colunas int64 viram int32 quando os valores cabem, e as
+  colunas de texto indicadas (nomes de produto, notas) viram `category`
+  quando se repetem; decimais ficam como estão (quantidades de NF-e podem
+  ser fracionárias);
+- um quadro acima de `limite_quadro` bytes vai direto para um arquivo
+  Parquet em `pasta`, e quando a memória somada de todas as sessões passa
+  de `limite_total`, os quadros usados há mais tempo também vão para o disco;
+- sessões sem acesso há `ttl` segundos, ou que já fecharam, perdem os
+  quadros (memória e arquivos).
+
+`obter` devolve as colunas `category` como texto, que é o que o
+st.data_editor espera; a forma compacta é a que fica guardada entre reruns.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+LIMITE_QUADRO = 16 * 1024 * 1024
+LIMITE_TOTAL = 256 * 1024 * 1024
+TTL_SESSAO = 30 * 60
+PASTA_PADRAO = os.path.join(tempfile.gettempdir(), "estoque_sessoes")
+INT32 = np.iinfo(np.int32)
+# Varredura de sessões ociosas no máximo uma vez a cada tantos segundos
+INTERVALO_VARREDURA = 60
+
+
+def compactar(df, categorias=()):
+    """Cópia do quadro com tipos compactos; `categorias` são colunas de texto repetitivo."""
+    df = df.copy()
+    for coluna in df.columns:
+        serie = df[coluna]
+        # int32 e não menor: o data_editor edita no tipo guardado, e um int8
+        # estouraria com a primeira quantidade acima de 127
+        if serie.dtype.kind == "i" and serie.dtype.itemsize > 4:
+            if serie.empty or (INT32.min <= serie.min() and serie.max() <= INT32.max):
+                df[coluna] = serie.astype(np.int32)
+        elif coluna in categorias and serie.dtype == object and serie.nunique() <= len(serie) // 2:
+            df[coluna] = serie.astype("category")
+    return df
+
+
+def expandir(df):
+    """Desfaz as categorias para exibição e edição."""
+    categoricas = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if not categoricas:
+        return df
+    return df.astype({c: object for c in categoricas})
+
+
+def tamanho(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# Assinatura do conteúdo, para reconhecer um rerun que devolveu o mesmo quadro
+# sem comparar com o guardado (que pode estar no disco)
+def assinatura(df):
+    try:
+        valores = int(pd.util.hash_pandas_object(df, index=True).sum())
+    except TypeError:
+        return None
+    return (tuple(df.columns), tuple(str(t) for t in df.dtypes), len(df), valores)
+
+
+class _Quadro:
+
+    def __init__(self, df=None, caminho=None, memoria=0, disco=0, assinatura=None):
+        self.df = df            # na memória, ou None quando está em `caminho`
+        self.caminho = caminho
+        self.assinatura = assinatura
+        self.memoria = memoria
+        self.disco = disco
+
+
+class ArmazemSessoes:
+
+    def __init__(self, pasta=PASTA_PADRAO, limite_quadro=LIMITE_QUADRO, limite_total=LIMITE_TOTAL,
+                 ttl=TTL_SESSAO, sessao_ativa=None):
+        """`sessao_ativa(id)` diz se a sessão ainda está aberta; sem ela, só o TTL vale."""
+        self._pasta = pasta
+        self._limite_quadro = limite_quadro
+        self._limite_total = limite_total
+        self._ttl = ttl
+        self._sessao_ativa = sessao_ativa
+        self._lock = threading.Lock()
+        self._quadros = OrderedDict()  # (sessao, nome) -> _Quadro, do menos para o mais recente
+        self._acessos = {}             # sessao -> último acesso (time.monotonic)
+        self._ultima_varredura = time.monotonic()
+        self._stats = {"guardados": 0, "em_disco": 0, "despejados": 0, "sessoes_expiradas": 0}
+
+    def _caminho(self, sessao, nome):
+        return os.path.join(self._pasta, sessao, f"{nome}.parquet")
+
+    def _tocar(self, sessao, nome=None):
+        self._acessos[sessao] = time.monotonic()
+        if nome is not None and (sessao, nome) in self._quadros:
+            self._quadros.move_to_end((sessao, nome))
+
+    def _para_disco(self, chave, quadro):
+        caminho = self._caminho(*chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        try:
+            quadro.df.to_parquet(caminho, index=True)
+        except Exception:
+            # Coluna que o Arrow não sabe gravar (ex.: tipos misturados após edição): fica na memória
+            if os.path.exists(caminho):
+                os.remove(caminho)
+            return False
+        quadro.df, quadro.caminho = None, caminho
+        quadro.memoria, quadro.disco = 0, os.path.getsize(caminho)
+        self._stats["em_disco"] += 1
+        return True
+
+    def _descartar(self, chave):
+        quadro = self._quadros.pop(chave, None)
+        if quadro is not None and quadro.caminho and os.path.exists(quadro.caminho):
+            os.remove(quadro.caminho)
+
+    def guardar(self, sessao, nome, df, categorias=()):
+        """Guarda (ou substitui) o quadro `nome` da sessão na forma compacta."""
+        compacto = compactar(df, categorias)
+        marca = assinatura(compacto)
+        with self._lock:
+            anterior = self._quadros.get((sessao, nome))
+            if anterior is not None and marca is not None and anterior.assinatura == marca:
+                # Rerun sem edição: o data_editor devolve um quadro igual ao guardado
+                self._tocar(sessao, nome)
+                return
+            self._descartar((sessao, nome))
+            quadro = _Quadro(df=compacto, memoria=tamanho(compacto), assinatura=marca)
+            self._quadros[(sessao, nome)] = quadro
+            self._tocar(sessao, nome)
+            self._stats["guardados"] += 1
+            if quadro.memoria > self._limite_quadro:
+                self._para_disco((sessao, nome), quadro)
+            self._conter_memoria()
+        self.varrer()
+
+    def obter(self, sessao, nome):
+        """O quadro guardado (com categorias como texto), ou None."""
+        with self._lock:
+            quadro = self._quadros.get((sessao, nome))
+            if quadro is None:
+                return None
+            self._tocar(sessao, nome)
+            df = quadro.df if quadro.df is not None else pd.read_parquet(quadro.caminho)
+        return expandir(df)
+
+    def contem(self, sessao, nome):
+        with self._lock:
+            return (sessao, nome) in self._quadros
+
+    def remover(self, sessao, nome):
+        with self._lock:
+            self._descartar((sessao, nome))
+
+    def _conter_memoria(self):
+        # Manda para o disco os quadros usados há mais tempo até caber no limite
+        total = sum(q.memoria for q in self._quadros.values())
+        for chave, quadro in list(self._quadros.items()):
+            if total <= self._limite_total:
+                break
+            memoria = quadro.memoria
+            if quadro.df is not None and self._para_disco(chave, quadro):
+                total -= memoria
+                self._stats["despejados"] += 1
+
+    def varrer(self, forcar=False):
+        """Apaga os quadros das sessões ociosas há mais de `ttl` segundos ou já fechadas."""
+        agora = time.monotonic()
+        with self._lock:
+            if not forcar and agora - self._ultima_varredura < INTERVALO_VARREDURA:
+                return
+            self._ultima_varredura = agora
+            sessoes = list(self._acessos.items())
+        # Sessões fechadas saem já; as abertas, depois de `ttl` segundos sem acesso
+        fechadas = {sessao for sessao, _ in sessoes
+                    if self._sessao_ativa is not None and not self._sessao_ativa(sessao)}
+        with self._lock:
+            for sessao in list(self._acessos):
+                if sessao not in fechadas and agora - self._acessos[sessao] <= self._ttl:
+                    continue
+                for chave in [c for c in self._quadros if c[0] == sessao]:
+                    self._descartar(chave)
+                self._acessos.pop(sessao, None)
+                shutil.rmtree(os.path.join(self._pasta, sessao), ignore_errors=True)
+                self._stats["sessoes_expiradas"] += 1
+
+    def relatorio(self):
+        """Uso por sessão: quadros, bytes na memória e no disco e segundos sem acesso."""
+        agora = time.monotonic()
+        with self._lock:
+            por_sessao = {}
+            for (sessao, _nome), quadro in self._quadros.items():
+                linha = por_sessao.setdefault(sessao, {
+                    "sessao": sessao, "quadros": 0, "memoria_bytes": 0, "disco_bytes": 0,
+                    "ocioso_s": agora - self._acessos.get(sessao, agora),
+                })
+                linha["quadros"] += 1
+                linha["memoria_bytes"] += quadro.memoria
+                linha["disco_bytes"] += quadro.disco
+            return sorted(por_sessao.values(), key=lambda l: l["memoria_bytes"], reverse=True)
+
+    def estatisticas(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                sessoes=len({sessao for sessao, _ in self._quadros}),
+                quadros=len(self._quadros),
+                memoria_bytes=sum(q.memoria for q in self._quadros.values()),
+                disco_bytes=sum(q.disco for q in self._quadros.values()),
+            )
@@ -0,0 +1,165 @@
+"""
+Execução em segundo plano das gravações grandes (saídas, notas, contagens).
+
+A página divide os itens em lotes e entrega a tarefa ao `ExecutorTarefas`,
+que roda em um pool de threads compartilhado pelo processo. Cada lote é
+gravado e confirmado (commit) separadamente, então o progresso fica visível
+enquanto a tarefa anda e um refresh do navegador não interrompe a gravação:
+a sessão só guarda o id da tarefa e volta a consultar o estado dela.
+
+Se um lote falhar, os anteriores já estão confirmados; a tarefa termina em
+erro informando quantas linhas foram gravadas.
+"""
+import itertools
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+NA_FILA = "na fila"
+EXECUTANDO = "executando"
+CONCLUIDA = "concluída"
+ERRO = "erro"
+
+
+def dividir_em_lotes(itens, tamanho, chave=None):
+    """
+    Divide uma lista em lotes de até `tamanho` itens. Com `chave`, itens
+    consecutivos com a mesma chave (ex.: a mesma nota) ficam no mesmo lote,
+    mesmo que o lote passe um pouco do tamanho.
+    """
+    lotes, lote = [], []
+    anterior = object()
+    for item in itens:
+        atual = chave(item) if chave else None
+        if len(lote) >= tamanho and (chave is None or atual != anterior):
+            lotes.append(lote)
+            lote = []
+        lote.append(item)
+        anterior = atual
+    if lote:
+        lotes.append(lote)
+    return lotes
+
+
+class Tarefa:
+
+    def __init__(self, id_tarefa, tipo, descricao, loja_id, total):
+        self.id = id_tarefa
+        self.tipo = tipo
+        self.descricao = descricao
+        self.loja_id = loja_id
+        self.total = total
+        self.processados = 0
+        self.lotes_concluidos = 0
+        self.estado = NA_FILA
+        self.erro = None
+        self.resultado = None
+        self.criada_em = time.time()
+        self.inicio = None
+        self.fim = None
+
+    @property
+    def ativa(self):
+        return self.estado in (NA_FILA, EXECUTANDO)
+
+    def situacao(self):
+        """Retrato da tarefa para exibição: progresso, duração e linhas por segundo."""
+        fim = self.fim or time.time()
+        duracao = fim - self.inicio if self.inicio else 0.0
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "descricao": self.descricao,
+            "loja_id": self.loja_id,
+            "estado": self.estado,
+            "total": self.total,
+            "processados": self.processados,
+            "lotes_concluidos": self.lotes_concluidos,
+            "progresso": self.processados / self.total if self.total else 1.0,
+            "duracao_s": duracao,
+            "linhas_por_segundo": self.processados / duracao if duracao > 0 else 0.0,
+            "erro": self.erro,
+            "resultado": self.resultado,
+        }
+
+
+class ExecutorTarefas:
+
+    def __init__(self, max_workers=2, manter=200):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tarefa")
+        self._manter = manter
+        self._lock = threading.Lock()
+        self._tarefas = OrderedDict()  # id -> Tarefa, da mais antiga para a mais nova
+        self._ids = itertools.count(1)
+        self._stats = {"enviadas": 0, "concluidas": 0, "com_erro": 0, "linhas": 0}
+
+    def enviar(self, tipo, descricao, lotes, processar, combinar=None, loja_id=None, ao_falhar=None):
+        """
+        Agenda uma tarefa e devolve o id dela.
+
+        `processar(lote)` grava e confirma um lote e devolve um resultado
+        parcial; `combinar(parciais)` junta os parciais no resultado final
+        (por padrão, a lista de parciais). `ao_falhar()` é chamada se algum
+        lote falhar, depois de a tarefa ser marcada com erro.
+        """
+        lotes = [lote for lote in lotes if len(lote)]
+        with self._lock:
+            tarefa = Tarefa(next(self._ids), tipo, descricao, loja_id, sum(len(l) for l in lotes))
+            self._tarefas[tarefa.id] = tarefa
+            self._stats["enviadas"] += 1
+            self._podar()
+        self._pool.submit(self._executar, tarefa, lotes, processar, combinar, ao_falhar)
+        return tarefa.id
+
+    def _executar(self, tarefa, lotes, processar, combinar, ao_falhar):
+        with self._lock:
+            tarefa.estado = EXECUTANDO
+            tarefa.inicio = time.time()
+        parciais = []
+        try:
+            for lote in lotes:
+                parciais.append(processar(lote))
+                with self._lock:
+                    tarefa.processados += len(lote)
+                    tarefa.lotes_concluidos += 1
+                    self._stats["linhas"] += len(lote)
+            resultado = combinar(parciais) if combinar else parciais
+            with self._lock:
+                tarefa.resultado = resultado
+                tarefa.estado = CONCLUIDA
+                tarefa.fim = time.time()
+                self._stats["concluidas"] += 1
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                tarefa.erro = f"{type(e).__name__}: {e}"
+                tarefa.estado = ERRO
+                tarefa.fim = time.time()
+                self._stats["com_erro"] += 1
+            if ao_falhar is not None:
+                try:
+                    ao_falhar()
+                except Exception:
+                    traceback.print_exc()
+
+    def _podar(self):
+        # Mantém no máximo `manter` tarefas terminadas, descartando as mais antigas
+        terminadas = [t.id for t in self._tarefas.values() if not t.ativa]
+        for id_tarefa in terminadas[:max(0, len(terminadas) - self._manter)]:
+            del self._tarefas[id_tarefa]
+
+    def situacao(self, id_tarefa):
+        """Situação de uma tarefa, ou None se ela não existe mais (processo reiniciado)."""
+        with self._lock:
+            tarefa = self._tarefas.get(id_tarefa)
+            return tarefa.situacao() if tarefa is not None else None
+
+    def listar(self, tipo=None):
+        with self._lock:
+            return [t.situacao() for t in self._tarefas.values() if tipo is None or t.tipo == tipo]
+
+    def estatisticas(self):
+        with self._lock:
+            return dict(self._stats, ativas=sum(1 for t in self._tarefas.values() if t.ativa))
@@ -1,30 +1,474 @@
 import streamlit as st
 import psycopg2
+import psycopg2.errors
+import psycopg2.pool
+from psycopg2.extras import execute_values
 import pandas as pd
 import datetime as dt
+import csv
+import functools
+import hashlib
+import io
+import random
+import threading
+import time
+from contextlib import contextmanager
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from cache import CacheVersionado
+from catalogo import Catalogo
+from ingestao import normalizar_planilha
+import reposicao
+from sessao import ArmazemSessoes
+from tarefas import ExecutorTarefas, dividir_em_lotes, NA_FILA, EXECUTANDO, CONCLUIDA, ERRO
+import instrumentacao
+from instrumentacao import instrumentar
 
-# Recupera os segredos do arquivo secrets.toml
-host = st.secrets["connections"]["postgresql"]["host"]
-port = st.secrets["connections"]["postgresql"].get("port", "6543")
-database = st.secrets["connections"]["postgresql"]["database"]
-username = st.secrets["connections"]["postgresql"]["username"]
-password = st.secrets["connections"]["postgresql"]["password"]
 
-# Conexão com o banco de dados (não cacheada) com definição de fuso horário
+# Lê a configuração do banco a partir do arquivo secrets.toml
+def _config_db():
+    cfg = st.secrets["connections"]["postgresql"]
+    return {
+        "parametros": {
+            "host": cfg["host"],
+            "port": cfg.get("port", "6543"),
+            "database": cfg["database"],
+            "user": cfg["username"],
+            "password": cfg["password"],
+            "connection_factory": instrumentacao.ConexaoInstrumentada,
+        },
+        "tamanho_min": int(cfg.get("pool_min", 1)),
+        "tamanho_max": int(cfg.get("pool_max", 10)),
+        "timeout": float(cfg.get("pool_timeout", 30)),
+        "verificar_apos": float(cfg.get("pool_verificar_apos", 30)),
+        "lock_timeout_ms": cfg.get("lock_timeout_ms"),
+    }
+
+
+# Lê a configuração opcional de instrumentação ([instrumentacao] no secrets.toml)
+def _config_instrumentacao():
+    cfg = st.secrets.get("instrumentacao", {})
+    return {
+        "arquivo_prometheus": cfg.get("arquivo_prometheus"),
+        "intervalo_prometheus": cfg.get("intervalo_prometheus"),
+        "consulta_lenta_ms": cfg.get("consulta_lenta_ms"),
+        "arquivo_consultas_lentas": cfg.get("arquivo_consultas_lentas"),
+    }
+
+
+# Lê os limites opcionais das planilhas em revisão ([sessoes] no secrets.toml)
+def _config_sessoes():
+    cfg = st.secrets.get("sessoes", {})
+    parametros = {}
+    if "limite_quadro_mb" in cfg:
+        parametros["limite_quadro"] = int(float(cfg["limite_quadro_mb"]) * 1024 * 1024)
+    if "limite_total_mb" in cfg:
+        parametros["limite_total"] = int(float(cfg["limite_total_mb"]) * 1024 * 1024)
+    if "ttl_min" in cfg:
+        parametros["ttl"] = float(cfg["ttl_min"]) * 60
+    if "pasta" in cfg:
+        parametros["pasta"] = cfg["pasta"]
+    return parametros
+
+
+# Números do pool e dos caches, exportados junto com as medições de desempenho
+def _coletar_estado():
+    valores = {f"estoque_pool_{k}": v for k, v in get_pool_stats().items()}
+    for nome, stats in get_cache_stats().items():
+        valores.update({f"estoque_cache_{nome}_{k}": v for k, v in stats.items()})
+    valores.update({f"estoque_tarefas_{k}": v for k, v in get_executor_tarefas().estatisticas().items()})
+    valores.update({f"estoque_sessoes_{k}": v for k, v in get_armazem_sessoes().estatisticas().items()})
+    return valores
+
+
+class PoolConexoes:
+    """
+    Pool de conexões PostgreSQL compartilhado por todas as sessões do processo.
+
+    - o fuso horário (e o lock_timeout, se configurado) é definido uma única
+      vez, quando a conexão física é aberta;
+    - conexões ociosas há mais de `verificar_apos` segundos passam por um
+      `SELECT 1` antes de serem entregues, e são descartadas se falharem;
+    - no máximo `tamanho_max` conexões ficam emprestadas ao mesmo tempo; quem
+      chega depois espera até `timeout` segundos por uma vaga.
+    """
+
+    def __init__(self, parametros, tamanho_min=1, tamanho_max=10, timeout=30.0, verificar_apos=30.0,
+                 lock_timeout_ms=None):
+        self._parametros = parametros
+        self._lock_timeout_ms = lock_timeout_ms
+        self._tamanho_max = tamanho_max
+        self._timeout = timeout
+        self._verificar_apos = verificar_apos
+        self._vagas = threading.BoundedSemaphore(tamanho_max)
+        self._lock = threading.Lock()
+        self._em_uso = 0
+        self._livres = []  # pilha de (conexão, instante em que foi devolvida)
+        self._stats = {
+            "checkouts": 0,
+            "esperas": 0,
+            "espera_total_s": 0.0,
+            "espera_max_s": 0.0,
+            "timeouts": 0,
+            "conexoes_criadas": 0,
+            "conexoes_descartadas": 0,
+            "verificacoes": 0,
+        }
+        for _ in range(min(tamanho_min, tamanho_max)):
+            self._livres.append((self._nova_conexao(), time.monotonic()))
+
+    def _incrementar(self, chave, valor=1):
+        with self._lock:
+            self._stats[chave] += valor
+
+    def _nova_conexao(self):
+        conn = psycopg2.connect(**self._parametros)
+        # Define o fuso horário para America/Sao_Paulo (UTC-3)
+        with conn.cursor() as cursor:
+            cursor.execute("SET TIME ZONE 'America/Sao_Paulo';")
+            # Espera máxima por um lock de linha antes de desistir (e a
+            # gravação ser repetida por repetir_em_conflito)
+            if self._lock_timeout_ms is not None:
+                cursor.execute("SELECT set_config('lock_timeout', %s, false)", (f"{int(self._lock_timeout_ms)}ms",))
+        conn.commit()
+        self._incrementar("conexoes_criadas")
+        return conn
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._incrementar("conexoes_descartadas")
+
+    def _saudavel(self, conn, devolvida_em):
+        if conn.closed:
+            return False
+        if time.monotonic() - devolvida_em < self._verificar_apos:
+            return True
+        self._incrementar("verificacoes")
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self):
+        inicio = time.monotonic()
+        if not self._vagas.acquire(blocking=False):
+            self._incrementar("esperas")
+            if not self._vagas.acquire(timeout=self._timeout):
+                self._incrementar("timeouts")
+                raise psycopg2.pool.PoolError(
+                    f"Nenhuma conexão livre após {self._timeout:.0f}s (pool com {self._tamanho_max} conexões)"
+                )
+        espera = time.monotonic() - inicio
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    item = self._livres.pop() if self._livres else None
+                if item is None:
+                    conn = self._nova_conexao()
+                elif self._saudavel(*item):
+                    conn = item[0]
+                else:
+                    self._descartar(item[0])
+        except Exception:
+            self._vagas.release()
+            raise
+        with self._lock:
+            self._em_uso += 1
+            self._stats["checkouts"] += 1
+            self._stats["espera_total_s"] += espera
+            self._stats["espera_max_s"] = max(self._stats["espera_max_s"], espera)
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        try:
+            if descartar or conn.closed:
+                self._descartar(conn)
+                return
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                self._descartar(conn)
+                return
+            with self._lock:
+                self._livres.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self._em_uso -= 1
+            self._vagas.release()
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["livres"] = len(self._livres)
+            stats["em_uso"] = self._em_uso
+        stats["tamanho_max"] = self._tamanho_max
+        stats["espera_media_s"] = stats["espera_total_s"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def fechar(self):
+        with self._lock:
+            livres, self._livres = self._livres, []
+        for conn, _ in livres:
+            self._descartar(conn)
+
+
+# Pool único por processo, compartilhado entre todas as sessões
+@st.cache_resource
+def get_pool():
+    cfg = _config_db()
+    instrumentacao.configurar(**_config_instrumentacao())
+    instrumentacao.registrar_coletor(_coletar_estado)
+    return PoolConexoes(
+        cfg["parametros"],
+        tamanho_min=cfg["tamanho_min"],
+        tamanho_max=cfg["tamanho_max"],
+        timeout=cfg["timeout"],
+        verificar_apos=cfg["verificar_apos"],
+        lock_timeout_ms=cfg["lock_timeout_ms"],
+    )
+
+
+# Estatísticas de uso do pool (checkouts, esperas, conexões criadas/descartadas)
+def get_pool_stats():
+    return get_pool().estatisticas()
+
+
+# Erros em que só a transação foi abortada (deadlock, falha de serialização,
+# lock_timeout): a conexão continua boa e a gravação pode ser repetida
+ERROS_REPETIVEIS = (psycopg2.extensions.TransactionRollbackError, psycopg2.errors.LockNotAvailable)
+
+
+# Empresta uma conexão do pool: commit ao final do bloco, rollback em caso de erro
+@contextmanager
 def get_db_connection():
-    conn = psycopg2.connect(
-        host=host,
-        port=port,
-        database=database,
-        user=username,
-        password=password
+    pool = get_pool()
+    inicio = time.perf_counter()
+    conn = pool.obter()
+    instrumentacao.registrar_espera_conexao(time.perf_counter() - inicio)
+    descartar = False
+    try:
+        yield conn
+        conn.commit()
+    except ERROS_REPETIVEIS:
+        conn.rollback()
+        raise
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        descartar = True
+        raise
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.devolver(conn, descartar)
+
+# Tentativas extras de uma gravação abortada por deadlock/serialização/lock_timeout
+# e espera máxima antes de cada uma (backoff exponencial com jitter)
+RETENTATIVAS_MAX = 4
+RETENTATIVA_ESPERA_BASE = 0.05
+RETENTATIVA_ESPERA_MAX = 2.0
+
+
+def repetir_em_conflito(func):
+    """
+    Repete a função inteira (uma transação nova a cada vez) quando o banco
+    aborta a transação com um erro em ERROS_REPETIVEIS. Entre as tentativas
+    espera um tempo aleatório de até base * 2^tentativa segundos.
+    """
+    @functools.wraps(func)
+    def envolvida(*args, **kwargs):
+        tentativa = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except ERROS_REPETIVEIS as e:
+                motivo = type(e).__name__
+                if tentativa >= RETENTATIVAS_MAX:
+                    instrumentacao.observar("estoque_transacao_desistencias", 1, funcao=func.__name__, motivo=motivo)
+                    raise
+                instrumentacao.observar("estoque_transacao_retentativas", 1, funcao=func.__name__, motivo=motivo)
+                time.sleep(random.uniform(0, min(RETENTATIVA_ESPERA_MAX, RETENTATIVA_ESPERA_BASE * 2 ** tentativa)))
+                tentativa += 1
+    return envolvida
+
+
+# Sinal de cada tipo de movimentação sobre o saldo do estoque
+SINAL_MOVIMENTACAO = {'entrada': 1, 'saida': -1}
+
+# Motivo das saídas de venda (planilha de saídas diárias), a base da demanda
+MOTIVO_SAIDA_DIARIA = 'Saída diária'
+
+# Data usada quando a movimentação não traz uma data explícita
+AGORA_SP = "CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo'"
+
+
+# Executa um comando "... VALUES %s" enviando todas as linhas de uma só vez
+def _execute_values(cursor, sql, linhas, template=None, fetch=False):
+    return execute_values(cursor, sql, linhas, template=template,
+                          page_size=max(len(linhas), 1), fetch=fetch)
+
+
+# Soma no resumo mensal (movimentacoes_mensais) as movimentações recém-inseridas,
+# lidas do CTE `origem` (um INSERT ... RETURNING tipo, produto_id, loja_id, quantidade, data).
+# Usado por toda gravação em movimentacoes_estoque, na mesma transação.
+# Ordem de travas de toda gravação: primeiro as linhas de `estoque`, depois as
+# de `movimentacoes_mensais`, cada tabela na ordem da chave primária; assim
+# gravações concorrentes esperam umas pelas outras sem deadlock.
+def _sql_somar_mensal(origem):
+    return f"""
+        INSERT INTO movimentacoes_mensais (loja_id, produto_id, mes, total_entradas, total_saidas)
+        SELECT loja_id, produto_id, date_trunc('month', data)::date,
+               SUM(CASE WHEN tipo = 'entrada' THEN quantidade ELSE 0 END),
+               SUM(CASE WHEN tipo = 'saida'   THEN quantidade ELSE 0 END)
+        FROM {origem}
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 3, 2
+        ON CONFLICT (loja_id, mes, produto_id)
+        DO UPDATE SET total_entradas = movimentacoes_mensais.total_entradas + EXCLUDED.total_entradas,
+                      total_saidas   = movimentacoes_mensais.total_saidas   + EXCLUDED.total_saidas
+    """
+
+# A partir deste número de linhas as gravações trocam o INSERT multi-linha
+# pelo COPY FROM STDIN em uma tabela temporária
+LIMITE_COPY = 5000
+
+
+class _FonteCopy:
+    """
+    Arquivo somente-leitura que gera CSV sob demanda a partir de um iterável de
+    tuplas, para alimentar o COPY sem montar o arquivo inteiro em memória.
+    None vira campo vazio, que o COPY em formato CSV lê como NULL.
+    """
+
+    def __init__(self, linhas, linhas_por_bloco=1000):
+        self._linhas = iter(linhas)
+        self._linhas_por_bloco = linhas_por_bloco
+        self._buffer = ""
+
+    def _proximo_bloco(self):
+        saida = io.StringIO()
+        escritor = csv.writer(saida, lineterminator="\n")
+        for _ in range(self._linhas_por_bloco):
+            linha = next(self._linhas, None)
+            if linha is None:
+                break
+            escritor.writerow(linha)
+        return saida.getvalue()
+
+    def read(self, tamanho=-1):
+        while tamanho < 0 or len(self._buffer) < tamanho:
+            bloco = self._proximo_bloco()
+            if not bloco:
+                break
+            self._buffer += bloco
+        if tamanho < 0:
+            dados, self._buffer = self._buffer, ""
+        else:
+            dados, self._buffer = self._buffer[:tamanho], self._buffer[tamanho:]
+        return dados
+
+
+# Envia as linhas para a tabela via COPY FROM STDIN (formato CSV)
+def _copiar_linhas(cursor, tabela, colunas, linhas):
+    cursor.copy_expert(
+        f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)",
+        _FonteCopy(linhas),
     )
-    # Define o fuso horário para America/Sao_Paulo (UTC-3)
-    conn.cursor().execute("SET TIME ZONE 'America/Sao_Paulo';")
-    return conn
+
+
+# Versão de _gravar_movimentacoes para cargas grandes: as linhas vão por COPY
+# para uma tabela temporária e são aplicadas com dois comandos set-based
+def _gravar_movimentacoes_copy(cursor, movimentos, data_atualizacao=None):
+    cursor.execute("""
+        CREATE TEMP TABLE stg_movimentacoes (
+            tipo text, produto_id bigint, loja_id bigint,
+            quantidade numeric, motivo text, data timestamp
+        ) ON COMMIT DROP
+    """)
+    _copiar_linhas(cursor, "stg_movimentacoes",
+                   ("tipo", "produto_id", "loja_id", "quantidade", "motivo", "data"),
+                   movimentos)
+    cursor.execute(f"""
+        INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao)
+        SELECT loja_id, produto_id,
+               SUM(CASE WHEN tipo = 'saida' THEN -quantidade ELSE quantidade END),
+               COALESCE(%s, {AGORA_SP})
+        FROM stg_movimentacoes
+        GROUP BY loja_id, produto_id
+        ORDER BY loja_id, produto_id
+        ON CONFLICT (loja_id, produto_id)
+        DO UPDATE SET quantidade = estoque.quantidade + EXCLUDED.quantidade,
+                      data_atualizacao = EXCLUDED.data_atualizacao
+    """, (data_atualizacao,))
+    cursor.execute(f"""
+        WITH novas AS (
+            INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
+            SELECT tipo, produto_id, loja_id, quantidade, motivo, COALESCE(data, {AGORA_SP})
+            FROM stg_movimentacoes
+            RETURNING tipo, produto_id, loja_id, quantidade, data
+        )
+    """ + _sql_somar_mensal("novas"))
+
+
+# Grava movimentações em lote com um número fixo de comandos:
+# 1) um único upsert em estoque com a variação já somada por (loja_id, produto_id),
+#    em ordem de (loja_id, produto_id) para travar as linhas sempre na mesma ordem
+# 2) um INSERT multi-linha em movimentacoes_estoque, com o resumo mensal
+# O estoque vem antes do resumo mensal em toda gravação (ver _sql_somar_mensal).
+# Cada movimento é uma tupla (tipo, produto_id, loja_id, quantidade, motivo, data);
+# data=None usa o horário atual de São Paulo, assim como data_atualizacao=None.
+# Cargas a partir de LIMITE_COPY linhas seguem pelo COPY.
+def _gravar_movimentacoes(cursor, movimentos, data_atualizacao=None):
+    if not movimentos:
+        return
+    if len(movimentos) >= LIMITE_COPY:
+        _gravar_movimentacoes_copy(cursor, movimentos, data_atualizacao)
+    else:
+        _gravar_movimentacoes_values(cursor, movimentos, data_atualizacao)
+
+
+# Ordem (loja_id, produto_id) numérica, a mesma do índice de estoque
+def _ordem_estoque(item):
+    (loja_id, produto_id), _ = item
+    return int(loja_id), int(produto_id)
+
+
+# Caminho do INSERT multi-linha, usado em cargas menores que LIMITE_COPY
+def _gravar_movimentacoes_values(cursor, movimentos, data_atualizacao=None):
+    variacoes = {}
+    for tipo, produto_id, loja_id, quantidade, _motivo, _data in movimentos:
+        chave = (loja_id, produto_id)
+        variacoes[chave] = variacoes.get(chave, 0) + SINAL_MOVIMENTACAO[tipo] * quantidade
+    _execute_values(cursor, """
+        INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao)
+        VALUES %s
+        ON CONFLICT (loja_id, produto_id)
+        DO UPDATE SET quantidade = estoque.quantidade + EXCLUDED.quantidade,
+                      data_atualizacao = EXCLUDED.data_atualizacao
+    """, [(loja_id, produto_id, variacao, data_atualizacao)
+          for (loja_id, produto_id), variacao in sorted(variacoes.items(), key=_ordem_estoque)],
+        template=f"(%s, %s, %s, COALESCE(%s, {AGORA_SP}))")
+
+    _execute_values(cursor, """
+        WITH novas AS (
+            INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
+            VALUES %s
+            RETURNING tipo, produto_id, loja_id, quantidade, data
+        )
+    """ + _sql_somar_mensal("novas"),
+        movimentos, template=f"(%s, %s, %s, %s, %s, COALESCE(%s, {AGORA_SP}))")
 
 # Função para buscar a lista de lojas (cacheada)
 @st.cache_data
+@instrumentar
 def get_lojas():
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
@@ -32,9 +476,16 @@ def get_lojas():
             lojas = cursor.fetchall()
     return lojas
 
-# Função para buscar a lista de produtos (cacheada)
-@st.cache_data
-def get_produtos():
+# Catálogo de produtos em memória (ver catalogo.py), recarregado após
+# cadastro de produtos ou a cada CACHE_CATALOGO_TTL segundos
+CACHE_CATALOGO_TTL = 3600
+
+@st.cache_resource
+def _cache_catalogo():
+    return CacheVersionado(ttl=CACHE_CATALOGO_TTL, max_entradas=1)
+
+@instrumentar
+def _consultar_catalogo():
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -42,11 +493,78 @@ def get_produtos():
                 FROM produtos 
                 ORDER BY nome
             """)
-            produtos = cursor.fetchall()
-    return produtos
+            return Catalogo(cursor.fetchall())
+
+# Catálogo indexado de produtos (busca por nome, consulta por id)
+def get_catalogo():
+    return _cache_catalogo().obter("produtos", _consultar_catalogo)
+
+# Descarta o catálogo em memória (chamada após gravações em produtos)
+def invalidar_catalogo():
+    _cache_catalogo().invalidar("produtos")
+
+# Função para buscar a lista de produtos (id, nome, categoria), servida do catálogo
+def get_produtos():
+    return get_catalogo().linhas()
+
+# Cache do estoque por loja: expira em CACHE_ESTOQUE_TTL segundos e é
+# invalidado por toda gravação que altera o estoque da loja
+CACHE_ESTOQUE_TTL = 300
+CACHE_ESTOQUE_MAX_LOJAS = 256
+
+@st.cache_resource
+def _cache_estoque():
+    return CacheVersionado(ttl=CACHE_ESTOQUE_TTL, max_entradas=CACHE_ESTOQUE_MAX_LOJAS)
 
-# Função para buscar o estoque atual de uma loja
+# Cache dos lotes de validade por loja (e do resumo de todas as lojas, na
+# chave "todas"); o restante estimado de cada lote depende do estoque, então
+# toda gravação de estoque também o invalida
+CACHE_VALIDADE_TTL = 300
+
+@st.cache_resource
+def _cache_validade():
+    return CacheVersionado(ttl=CACHE_VALIDADE_TTL, max_entradas=CACHE_ESTOQUE_MAX_LOJAS + 1)
+
+def invalidar_validade(loja_id):
+    _cache_validade().invalidar(loja_id)
+    _cache_validade().invalidar("todas")
+
+# Cache das estatísticas de demanda por loja (e de todas as lojas, na chave
+# "todas"), invalidado a cada gravação de saídas diárias; o TTL faz as
+# janelas acompanharem a virada do dia
+CACHE_DEMANDA_TTL = 3600
+
+@st.cache_resource
+def _cache_demanda():
+    return CacheVersionado(ttl=CACHE_DEMANDA_TTL, max_entradas=CACHE_ESTOQUE_MAX_LOJAS + 1)
+
+def invalidar_demanda(loja_id):
+    _cache_demanda().invalidar(loja_id)
+    _cache_demanda().invalidar("todas")
+
+# Marca o estoque da loja como alterado (chamada após o commit de cada gravação);
+# a matriz de todas as lojas (chave "todas") cai junto
+def invalidar_estoque(loja_id):
+    _cache_estoque().invalidar(loja_id)
+    _cache_estoque().invalidar("todas")
+    invalidar_validade(loja_id)
+
+# Contadores de acerto/erro dos caches do app
+def get_cache_stats():
+    return {
+        "estoque": _cache_estoque().estatisticas(),
+        "catalogo": _cache_catalogo().estatisticas(),
+        "validade": _cache_validade().estatisticas(),
+        "demanda": _cache_demanda().estatisticas(),
+    }
+
+# Função para buscar o estoque atual de uma loja (servida do cache por loja)
+@instrumentar
 def get_estoque_loja(loja_id):
+    return _cache_estoque().obter(loja_id, lambda: _consultar_estoque_loja(loja_id))
+
+@instrumentar
+def _consultar_estoque_loja(loja_id):
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             query = """
@@ -59,66 +577,597 @@ def get_estoque_loja(loja_id):
             estoque = cursor.fetchall()
     return estoque
 
-# Função para cadastrar um novo produto
+# Estoque de todas as lojas em uma consulta, como matriz produto × loja
+# (índice produto_id, uma coluna por loja_id, 0 onde a loja não tem o produto).
+# Fica no cache de estoque na chave "todas", invalidada por qualquer gravação.
+@instrumentar
+def get_matriz_estoque():
+    return _cache_estoque().obter("todas", _consultar_matriz_estoque)
+
+@instrumentar
+def _consultar_matriz_estoque():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT produto_id, loja_id, quantidade FROM estoque")
+            df = pd.DataFrame(cursor.fetchall(), columns=["produto_id", "loja_id", "quantidade"])
+    df["quantidade"] = pd.to_numeric(df["quantidade"])
+    return df.pivot(index="produto_id", columns="loja_id", values="quantidade").fillna(0)
+
+# Matriz produto × loja pronta para exibição: nome e categoria vindos do
+# catálogo, colunas com o nome das lojas e filtro opcional por categorias
+def matriz_estoque_lojas(categorias=None):
+    matriz = get_matriz_estoque()
+    produtos = pd.DataFrame(get_catalogo().linhas(), columns=["produto_id", "nome", "categoria"])
+    if categorias:
+        produtos = produtos[produtos["categoria"].isin(categorias)]
+    lojas = get_lojas()
+    matriz = matriz.reindex(columns=[loja_id for loja_id, _ in lojas], fill_value=0)
+    matriz.columns = [nome for _, nome in lojas]
+    tabela = produtos.join(matriz, on="produto_id", how="inner")
+    return tabela.set_index("produto_id")
+
+# Estoque de uma loja ao final de um dia, por produto.
+# Parte da foto mais recente em estoque_snapshot até esse dia e soma só as
+# movimentações posteriores a ela, mais as gravadas depois da foto com data
+# retroativa (id acima do ultimo_id da foto); sem foto anterior, parte do
+# estoque atual e desconta as movimentações feitas depois do dia.
+@instrumentar
+def get_estoque_em(loja_id, dia):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT data, MAX(ultimo_id) FROM estoque_snapshot
+                WHERE loja_id = %s AND data <= %s
+                GROUP BY data ORDER BY data DESC LIMIT 1
+            """, (loja_id, dia))
+            foto, ultimo_id = cursor.fetchone() or (None, None)
+        if foto is not None:
+            sql = """
+            WITH foto AS (
+              SELECT produto_id, quantidade
+              FROM estoque_snapshot
+              WHERE loja_id = %(loja)s AND data = %(foto)s
+            ), delta AS (
+              SELECT produto_id,
+                     SUM(CASE WHEN tipo='entrada' THEN quantidade ELSE -quantidade END) AS variacao
+              FROM movimentacoes_estoque
+              WHERE loja_id = %(loja)s AND data < %(dia)s::date + 1
+                AND (data >= %(foto)s::date + 1 OR id > %(ultimo_id)s)
+              GROUP BY produto_id
+            )
+            SELECT produto_id, COALESCE(f.quantidade,0) + COALESCE(d.variacao,0) AS quantidade
+            FROM foto f FULL JOIN delta d USING (produto_id)
+            """
+        else:
+            sql = """
+            WITH delta AS (
+              SELECT produto_id,
+                     SUM(CASE WHEN tipo='entrada' THEN quantidade ELSE -quantidade END) AS variacao
+              FROM movimentacoes_estoque
+              WHERE loja_id = %(loja)s AND data >= %(dia)s::date + 1
+              GROUP BY produto_id
+            )
+            SELECT e.produto_id, e.quantidade - COALESCE(d.variacao,0) AS quantidade
+            FROM estoque e LEFT JOIN delta d USING (produto_id)
+            WHERE e.loja_id = %(loja)s
+            """
+        # Fotos sem ultimo_id (anteriores à marca) não recebem as retroativas
+        params = {"loja": loja_id, "foto": foto, "dia": dia,
+                  "ultimo_id": ultimo_id if ultimo_id is not None else 2 ** 63 - 1}
+        return pd.read_sql(sql, conn, params=params)
+
+# Histórico mensal por produto de uma loja, lido do resumo movimentacoes_mensais.
+# Lista os produtos com movimentação no mês ou com linha de estoque na loja.
+# estoque_inicial é a posição ao final do mês anterior (ver get_estoque_em).
+@instrumentar
+def get_historico_mensal(loja_id, mes):
+    primeiro_dia = mes.replace(day=1)
+    sql = """
+    WITH mov AS (
+      SELECT produto_id, total_entradas, total_saidas
+      FROM movimentacoes_mensais
+      WHERE loja_id = %s AND mes = %s
+    ), stock AS (
+      SELECT produto_id,
+             quantidade      AS estoque_atual,
+             data_contagem   AS ultima_contagem
+      FROM estoque
+      WHERE loja_id = %s
+    )
+    SELECT
+      p.id         AS produto_id,
+      p.nome       AS produto,
+      COALESCE(m.total_entradas,0) AS total_entradas,
+      COALESCE(m.total_saidas,0)   AS total_saidas,
+      COALESCE(s.estoque_atual,0)   AS estoque_atual,
+      s.ultima_contagem
+    FROM mov AS m
+    FULL JOIN stock AS s ON s.produto_id = m.produto_id
+    JOIN produtos p ON p.id = COALESCE(m.produto_id, s.produto_id)
+    ORDER BY p.nome
+    """
+    with get_db_connection() as conn:
+        df = pd.read_sql(sql, conn, params=(loja_id, primeiro_dia, loja_id))
+    inicial = get_estoque_em(loja_id, primeiro_dia - dt.timedelta(days=1))
+    df = df.merge(inicial.rename(columns={"quantidade": "estoque_inicial"}), on="produto_id", how="left")
+    df["estoque_inicial"] = df["estoque_inicial"].fillna(0)
+    df["estoque_final"] = df["estoque_inicial"] + df["total_entradas"] - df["total_saidas"]
+    return df
+
+# --- Validade (view lotes_a_vencer, criada por manutencao.py) ---
+
+COLUNAS_LOTES = ["id", "produto_id", "lote", "vencimento", "quantidade", "restante", "dias", "faixa"]
+
+# Lotes da loja vencidos há até 30 dias ou a vencer, com o restante estimado
+# de cada um (o estoque atual distribuído dos lotes que vencem por último para
+# os primeiros, como se a saída seguisse FEFO)
+@instrumentar
+def get_lotes_validade(loja_id):
+    return _cache_validade().obter(loja_id, lambda: _consultar_lotes_validade(loja_id))
+
+@instrumentar
+def _consultar_lotes_validade(loja_id):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {', '.join(COLUNAS_LOTES)}
+                FROM lotes_a_vencer
+                WHERE loja_id = %s
+                ORDER BY vencimento, produto_id, id
+            """, (loja_id,))
+            df = pd.DataFrame(cursor.fetchall(), columns=COLUNAS_LOTES)
+    catalogo = get_catalogo()
+    df["nome"] = [catalogo.nome(p, "") for p in df["produto_id"]]
+    return df
+
+# Sugestão FEFO por produto: lotes com saldo, do que vence primeiro ao
+# último, numerados na ordem em que devem sair
+def sugestao_fefo(lotes):
+    fefo = lotes[lotes["restante"] > 0].sort_values(["produto_id", "vencimento", "id"]).copy()
+    fefo["ordem"] = fefo.groupby("produto_id").cumcount() + 1
+    return fefo[["produto_id", "nome", "ordem", "lote", "vencimento", "dias", "restante"]]
+
+# Lotes com saldo que vencem em até 30 dias (ou já vencidos), por loja e
+# faixa, para o panorama de todas as lojas
+@instrumentar
+def get_resumo_validade():
+    return _cache_validade().obter("todas", _consultar_resumo_validade)
+
+@instrumentar
+def _consultar_resumo_validade():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT v.loja_id, l.nome, v.faixa, COUNT(*) AS lotes, SUM(v.restante) AS quantidade
+                FROM lotes_a_vencer v
+                JOIN lojas l ON l.id = v.loja_id
+                WHERE v.restante > 0 AND v.dias <= 30
+                GROUP BY v.loja_id, l.nome, v.faixa
+            """)
+            return pd.DataFrame(cursor.fetchall(), columns=["loja_id", "loja", "faixa", "lotes", "quantidade"])
+
+# Estatísticas de demanda (ver reposicao.py) de uma loja ou, com loja_id=None,
+# de todas, a partir das saídas diárias somadas por dia em uma consulta
+@instrumentar
+def get_demanda(loja_id=None):
+    chave = loja_id if loja_id is not None else "todas"
+    return _cache_demanda().obter(chave, lambda: _consultar_demanda(loja_id))
+
+@instrumentar
+def _consultar_demanda(loja_id=None):
+    hoje = dt.date.today()
+    filtro = "AND loja_id = %(loja)s" if loja_id is not None else ""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT loja_id, produto_id, data::date AS dia, SUM(quantidade)
+                FROM movimentacoes_estoque
+                WHERE tipo = 'saida' AND motivo = %(motivo)s AND data >= %(inicio)s {filtro}
+                GROUP BY loja_id, produto_id, data::date
+            """, {"motivo": MOTIVO_SAIDA_DIARIA, "loja": loja_id,
+                  "inicio": hoje - dt.timedelta(days=reposicao.dias_consultados() - 1)})
+            saidas = pd.DataFrame(cursor.fetchall(), columns=["loja_id", "produto_id", "dia", "quantidade"])
+    return reposicao.estatisticas_demanda(saidas, hoje)
+
+# Sugestão de reposição de uma loja (ou de todas), com nome e categoria do
+# catálogo e o nome da loja. O estoque vem da matriz em cache, então só os
+# parâmetros mudam a cada rerun e o cálculo é refeito vetorizado.
+def get_reposicao(loja_id=None, prazo=reposicao.PRAZO_PADRAO, ciclo=reposicao.CICLO_PADRAO,
+                  nivel_servico=reposicao.NIVEL_SERVICO_PADRAO):
+    estoque = get_matriz_estoque().stack(future_stack=True).swaplevel().rename("quantidade")
+    tabela = reposicao.sugerir_reposicao(get_demanda(loja_id), estoque, prazo, ciclo, nivel_servico)
+    colunas = ["loja", "produto_id", "nome", "categoria"] + reposicao.COLUNAS_REPOSICAO[2:] + ["loja_id"]
+    if tabela.empty:
+        return pd.DataFrame(columns=colunas)
+    produtos = pd.DataFrame(get_catalogo().linhas(), columns=["produto_id", "nome", "categoria"])
+    lojas = pd.DataFrame(get_lojas(), columns=["loja_id", "loja"])
+    tabela = tabela.merge(produtos, on="produto_id", how="left").merge(lojas, on="loja_id", how="left")
+    return tabela[colunas]
+
+
+# --- Registro de importações (tabela importacoes) ---
+#
+# Toda planilha ou NF-e gravada deixa uma linha com o hash SHA-256 do
+# conteúdo (único por loja e tipo) e, para NF-e, a chave de acesso (única).
+# As páginas consultam o registro antes de ler o arquivo, e a própria
+# gravação insere/atualiza o registro na mesma transação dos dados, então um
+# clique duplo ou um reenvio após timeout nunca grava o mesmo arquivo duas vezes.
+# Uma importação em lotes que terminou em erro, ou cuja reserva ficou em
+# andamento sem avançar por RESERVA_EXPIRA_MIN minutos (processo reiniciado no
+# meio), pode ser enviada de novo: a reserva é retomada e a gravação continua
+# a partir das linhas já gravadas. Só se retoma o mesmo envio (mesmas linhas,
+# na mesma ordem, e mesma data, pelo hash_envio), e cada retomada troca a
+# `tentativa` da reserva: lotes de um envio anterior que ainda esteja na fila
+# ou gravando são desfeitos em vez de gravar em dobro.
+
+class ImportacaoDuplicada(ValueError):
+    """O arquivo (ou a nota) já consta no registro de importações."""
+
+    def __init__(self, registro):
+        self.registro = registro
+        super().__init__(
+            f"{registro['arquivo'] or 'Arquivo'} já importado em "
+            f"{registro['importado_em']:%d/%m/%Y %H:%M} ({registro['estado']}, "
+            f"{registro['linhas_gravadas']} de {registro['linhas']} linhas gravadas)."
+        )
+
+
+class ReservaSubstituida(RuntimeError):
+    """A reserva da importação foi retomada por outro envio; o lote não é gravado."""
+
+
+COLUNAS_IMPORTACAO = ["id", "tipo", "loja_id", "hash", "chave_nfe", "arquivo", "linhas",
+                      "linhas_gravadas", "estado", "importado_em", "atualizado_em", "concluido_em"]
+
+# Bem acima do tempo de um lote e da espera na fila do executor de tarefas
+RESERVA_EXPIRA_MIN = 30
+
+# Reserva que pode ser retomada por um novo envio do mesmo arquivo
+SQL_RETOMAVEL = f"""(importacoes.estado = 'erro'
+    OR (importacoes.estado = 'em andamento'
+        AND COALESCE(importacoes.atualizado_em, importacoes.importado_em)
+            < {AGORA_SP} - make_interval(mins => {RESERVA_EXPIRA_MIN})))"""
+
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+# Importações já registradas com algum dos hashes (do tipo e loja) ou das
+# chaves de NF-e informadas; usa os índices únicos do registro
+@instrumentar
+def buscar_importacoes(tipo, loja_id, hashes=(), chaves_nfe=()):
+    hashes, chaves_nfe = list(hashes), [c for c in chaves_nfe if c]
+    if not hashes and not chaves_nfe:
+        return []
+    colunas = COLUNAS_IMPORTACAO + ["retomavel"]
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {', '.join(COLUNAS_IMPORTACAO)}, {SQL_RETOMAVEL}
+                FROM importacoes
+                WHERE (loja_id = %s AND tipo = %s AND hash = ANY(%s))
+                   OR chave_nfe = ANY(%s)
+            """, (loja_id, tipo, hashes, chaves_nfe))
+            return [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
+
+
+# Levanta ImportacaoDuplicada se o arquivo (pelo hash) já foi importado nesta
+# loja; uma reserva que pode ser retomada não conta
+def verificar_importacao(tipo, loja_id, hash_arquivo):
+    registros = [r for r in buscar_importacoes(tipo, loja_id, [hash_arquivo]) if not r["retomavel"]]
+    if registros:
+        raise ImportacaoDuplicada(registros[0])
+
+
+# Importações de uma loja para auditoria, das mais recentes para as mais antigas
+@instrumentar
+def listar_importacoes(loja_id, desde=None, ate=None, tipo=None, limite=500):
+    filtros, params = ["loja_id = %s"], [loja_id]
+    if desde is not None:
+        filtros.append("importado_em >= %s")
+        params.append(desde)
+    if ate is not None:
+        filtros.append("importado_em < %s")
+        params.append(ate)
+    if tipo is not None:
+        filtros.append("tipo = %s")
+        params.append(tipo)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {', '.join(COLUNAS_IMPORTACAO)}
+                FROM importacoes
+                WHERE {' AND '.join(filtros)}
+                ORDER BY importado_em DESC
+                LIMIT %s
+            """, params + [limite])
+            return pd.DataFrame(cursor.fetchall(), columns=COLUNAS_IMPORTACAO)
+
+
+# Hash do que um envio em lotes grava (linhas na ordem de gravação e dia),
+# e não do arquivo: a tabela pode ter sido editada antes do envio
+def assinatura_envio(linhas, data):
+    dia = data.date() if isinstance(data, dt.datetime) else data
+    texto = "\n".join(";".join(str(v) for v in linha) for linha in linhas)
+    return hash_conteudo(f"{dia}\n{texto}".encode())
+
+
+# Reserva o registro de uma importação que será gravada em vários lotes e
+# devolve ((id, tentativa), linhas já gravadas). Uma reserva com erro ou
+# parada há mais de RESERVA_EXPIRA_MIN minutos é retomada com uma nova
+# tentativa, desde que nada tenha sido gravado ou o envio seja o mesmo
+# (`hash_envio`, de assinatura_envio); as demais levantam ImportacaoDuplicada,
+# inclusive a reserva em andamento do clique duplo.
+@instrumentar
+def iniciar_importacao(tipo, loja_id, hash_arquivo, arquivo, linhas, hash_envio):
+    for _ in range(3):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO importacoes (tipo, loja_id, hash, arquivo, linhas, hash_envio, atualizado_em)
+                    VALUES (%s, %s, %s, %s, %s, %s, {AGORA_SP})
+                    ON CONFLICT (loja_id, tipo, hash) DO UPDATE
+                    SET estado = 'em andamento', arquivo = EXCLUDED.arquivo, linhas = EXCLUDED.linhas,
+                        hash_envio = EXCLUDED.hash_envio, tentativa = importacoes.tentativa + 1,
+                        atualizado_em = {AGORA_SP}
+                    WHERE {SQL_RETOMAVEL}
+                      AND (importacoes.linhas_gravadas = 0 OR importacoes.hash_envio = EXCLUDED.hash_envio)
+                    RETURNING id, tentativa, linhas_gravadas
+                """, (tipo, loja_id, hash_arquivo, arquivo, linhas, hash_envio))
+                linha = cursor.fetchone()
+            conn.commit()
+        if linha is not None:
+            importacao_id, tentativa, gravadas = linha
+            return (importacao_id, tentativa), gravadas
+        registros = buscar_importacoes(tipo, loja_id, [hash_arquivo])
+        if registros:
+            raise ImportacaoDuplicada(registros[0])
+        # A reserva que bloqueou o INSERT foi apagada (falha sem linhas gravadas)
+        # antes da consulta: tenta de novo
+    raise RuntimeError(f"Não foi possível reservar a importação de {arquivo or hash_arquivo}.")
+
+
+# Soma as linhas de um lote ao registro, dentro da transação do lote; a
+# importação fica concluída junto com o último lote. Se a reserva foi retomada
+# por outro envio (outra tentativa), levanta ReservaSubstituida e a transação
+# do lote é desfeita.
+def _avancar_importacao(cursor, importacao, linhas):
+    importacao_id, tentativa = importacao
+    cursor.execute(f"""
+        UPDATE importacoes
+        SET linhas_gravadas = linhas_gravadas + %(n)s,
+            atualizado_em = {AGORA_SP},
+            estado = CASE WHEN linhas_gravadas + %(n)s >= linhas THEN 'concluida' ELSE estado END,
+            concluido_em = CASE WHEN linhas_gravadas + %(n)s >= linhas THEN {AGORA_SP} END
+        WHERE id = %(id)s AND tentativa = %(tentativa)s
+    """, {"n": linhas, "id": importacao_id, "tentativa": tentativa})
+    if cursor.rowcount == 0:
+        raise ReservaSubstituida(f"A importação {importacao_id} foi retomada por outro envio.")
+
+
+# Chamado quando uma importação em lotes falha: sem nenhuma linha gravada a
+# reserva é apagada (o arquivo pode ser enviado de novo); com gravação
+# parcial, fica marcada como erro, com o número de linhas que entraram.
+# Uma tentativa já substituída não mexe na reserva.
+def falhar_importacao(importacao):
+    importacao_id, tentativa = importacao
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM importacoes WHERE id = %s AND tentativa = %s AND linhas_gravadas = 0",
+                           (importacao_id, tentativa))
+            cursor.execute("UPDATE importacoes SET estado = 'erro' WHERE id = %s AND tentativa = %s",
+                           (importacao_id, tentativa))
+        conn.commit()
+
+
+# Função para cadastrar um novo produto (id vindo da sequência produtos_id_seq)
+@instrumentar
 def cadastrar_novo_produto(nome, categoria, unidade_medida, valor):
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT MAX(id) FROM produtos")
-            max_id = cursor.fetchone()[0]
-            new_id = max_id + 1 if max_id is not None else 1
             cursor.execute("""
                 INSERT INTO produtos (id, nome, categoria, unidade_medida, valor)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (new_id, nome, categoria, unidade_medida, valor))
+                VALUES (nextval('produtos_id_seq'), %s, %s, %s, %s)
+                RETURNING id
+            """, (nome, categoria, unidade_medida, valor))
+            new_id = cursor.fetchone()[0]
         conn.commit()
+    invalidar_catalogo()
     return new_id
 
+COLUNAS_PRODUTO = ["nome", "categoria", "unidade_medida", "valor"]
+
+# Cadastra uma planilha de produtos novos em um único INSERT, com ids da
+# sequência produtos_id_seq. Nomes já cadastrados (sem diferenciar caixa) ou
+# repetidos na própria planilha não são inseridos e voltam como conflito.
+# Retorna {"inseridos": DataFrame(id, nome), "conflitos": DataFrame(nome, motivo)}.
+@instrumentar
+@repetir_em_conflito
+def cadastrar_produtos_lote(df):
+    faltantes = set(COLUNAS_PRODUTO) - set(df.columns)
+    if faltantes:
+        raise ValueError(f"Colunas obrigatórias não encontradas: {faltantes}")
+
+    df = df[COLUNAS_PRODUTO].copy()
+    df["nome"] = df["nome"].astype("string").str.strip()
+    df = df[df["nome"].notna() & (df["nome"] != "")]
+    df["valor"] = pd.to_numeric(df["valor"], errors="coerce")
+    chave = df["nome"].str.lower()
+    repetidos = chave.duplicated(keep="first")
+    conflitos = [pd.DataFrame({"nome": df.loc[repetidos, "nome"], "motivo": "repetido na planilha"})]
+    df = df[~repetidos]
+
+    linhas = [
+        tuple(None if pd.isna(v) else v for v in linha)
+        for linha in zip(df["nome"].tolist(), df["categoria"].tolist(),
+                         df["unidade_medida"].tolist(), df["valor"].tolist())
+    ]
+    resultado = []
+    if linhas:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                # serializa cadastros concorrentes para a checagem de nome valer
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext('produtos'))")
+                resultado = _execute_values(cursor, """
+                    WITH novos (nome, categoria, unidade_medida, valor) AS (
+                        VALUES %s
+                    ), existentes AS (
+                        SELECT DISTINCT n.nome
+                        FROM novos n
+                        JOIN produtos p ON lower(p.nome) = lower(n.nome)
+                    ), inseridos AS (
+                        INSERT INTO produtos (id, nome, categoria, unidade_medida, valor)
+                        SELECT nextval('produtos_id_seq'), nome, categoria, unidade_medida, valor
+                        FROM novos
+                        WHERE nome NOT IN (SELECT nome FROM existentes)
+                        RETURNING id, nome
+                    )
+                    SELECT id, nome FROM inseridos
+                    UNION ALL
+                    SELECT NULL, nome FROM existentes
+                """, linhas, fetch=True)
+            conn.commit()
+        invalidar_catalogo()
+
+    inseridos = pd.DataFrame([(i, n) for i, n in resultado if i is not None], columns=["id", "nome"])
+    conflitos.append(pd.DataFrame({"nome": [n for i, n in resultado if i is None], "motivo": "já cadastrado"}))
+    return {
+        "inseridos": inseridos.sort_values("id").reset_index(drop=True),
+        "conflitos": pd.concat(conflitos, ignore_index=True),
+    }
+
 # Função para registrar entradas de estoque
+@instrumentar
+@repetir_em_conflito
 def registrar_entrada(loja_id, itens):
+    movimentos = [
+        ('entrada', item['id'], loja_id, item['quantidade'],
+         item['motivo'] if item['motivo'] else 'Entrada de estoque', None)
+        for item in itens
+    ]
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            for item in itens:
-                produto_id = item['id']
-                quantidade = item['quantidade']
-                motivo = item['motivo'] if item['motivo'] else 'Entrada de estoque'
-                cursor.execute("""
-                    INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
-                    VALUES ('entrada', %s, %s, %s, %s, CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo')
-                """, (produto_id, loja_id, quantidade, motivo))
-                cursor.execute("""
-                    INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao)
-                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo')
-                    ON CONFLICT (loja_id, produto_id)
-                    DO UPDATE SET quantidade = estoque.quantidade + %s, data_atualizacao = CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo'
-                """, (loja_id, produto_id, quantidade, quantidade))
+            _gravar_movimentacoes(cursor, movimentos)
         conn.commit()
+    invalidar_estoque(loja_id)
+
+# Concilia uma contagem física inteira em um único comando: as diferenças são
+# calculadas no servidor contra o estoque atual, os ajustes de entrada/saída são
+# gravados no histórico e quantidade + data_contagem são sobrescritas.
+# Retorna uma linha (produto_id, anterior, novo_valor) por produto contado.
+# `origem` é "VALUES %s" (execute_values) ou um SELECT sobre a tabela de COPY.
+# As linhas de estoque já estão travadas por _sql_travar_contagem, então a
+# ordem em que o servidor executa os CTEs abaixo não cria travas novas em estoque.
+def _sql_conciliar_contagem(origem):
+    return f"""
+    WITH contagem (loja_id, produto_id, quantidade, data_contagem) AS (
+        {origem}
+    ), diferencas AS (
+        SELECT c.loja_id, c.produto_id, c.data_contagem,
+               c.quantidade                  AS novo_valor,
+               COALESCE(e.quantidade, 0)     AS anterior,
+               COALESCE(e.quantidade, 0) - c.quantidade AS diferenca
+        FROM contagem c
+        LEFT JOIN estoque e ON e.loja_id = c.loja_id AND e.produto_id = c.produto_id
+    ), ajustes AS (
+        INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
+        SELECT CASE WHEN diferenca > 0 THEN 'saida' ELSE 'entrada' END,
+               produto_id, loja_id, ABS(diferenca),
+               CASE WHEN diferenca > 0 THEN 'Ajuste de estoque - saída'
+                    ELSE 'Ajuste de estoque - entrada' END,
+               {AGORA_SP}
+        FROM diferencas
+        WHERE diferenca <> 0
+        RETURNING tipo, produto_id, loja_id, quantidade, data
+    ), mensal AS (
+        {_sql_somar_mensal("ajustes")}
+    ), contados AS (
+        INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao, data_contagem)
+        SELECT loja_id, produto_id, novo_valor, {AGORA_SP}, data_contagem
+        FROM diferencas
+        ORDER BY loja_id, produto_id
+        ON CONFLICT (loja_id, produto_id)
+        DO UPDATE SET quantidade = EXCLUDED.quantidade,
+                      data_atualizacao = EXCLUDED.data_atualizacao,
+                      data_contagem = EXCLUDED.data_contagem
+    )
+    SELECT produto_id, anterior, novo_valor FROM diferencas ORDER BY produto_id
+    """
+
+
+# Trava, em ordem de chave e em um só comando, as linhas de estoque contadas,
+# criando com saldo zero as que ainda não existem. Vem antes da conciliação,
+# que depois trava movimentacoes_mensais: a mesma ordem das outras gravações.
+def _sql_travar_contagem(origem):
+    return f"""
+    WITH contagem (loja_id, produto_id, quantidade, data_contagem) AS (
+        {origem}
+    )
+    INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao)
+    SELECT DISTINCT loja_id, produto_id, 0, {AGORA_SP}
+    FROM contagem
+    ORDER BY loja_id, produto_id
+    ON CONFLICT (loja_id, produto_id)
+    DO UPDATE SET quantidade = estoque.quantidade
+    """
+
+
+# Resume o resultado da conciliação: contagem de ajustes e itens alterados
+def _resumo_conciliacao(linhas):
+    itens = [
+        {'produto_id': produto_id, 'anterior': anterior, 'novo_valor': novo_valor,
+         'diferenca': novo_valor - anterior}
+        for produto_id, anterior, novo_valor in linhas
+    ]
+    return {
+        'produtos': len(itens),
+        'ajustes_entrada': sum(1 for i in itens if i['diferenca'] > 0),
+        'ajustes_saida': sum(1 for i in itens if i['diferenca'] < 0),
+        'sem_alteracao': sum(1 for i in itens if i['diferenca'] == 0),
+        'itens': [i for i in itens if i['diferenca'] != 0],
+    }
+
 
 # Função para atualizar o estoque físico
-def atualizar_estoque(loja_id, estoque_atual_input, data_contagem):
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            for produto_id, novo_valor in estoque_atual_input.items():
-                cursor.execute("SELECT quantidade FROM estoque WHERE loja_id = %s AND produto_id = %s", (loja_id, produto_id))
-                result = cursor.fetchone()
-                current_qtd = result[0] if result else 0
-                diferenca = current_qtd - novo_valor
-                if diferenca > 0:
-                    cursor.execute("""
-                        INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
-                        VALUES ('saida', %s, %s, %s, %s, CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo')
-                    """, (produto_id, loja_id, diferenca, 'Ajuste de estoque - saída'))
-                elif diferenca < 0:
-                    cursor.execute("""
-                        INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
-                        VALUES ('entrada', %s, %s, %s, %s, CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo')
-                    """, (produto_id, loja_id, abs(diferenca), 'Ajuste de estoque - entrada'))
+@instrumentar
+@repetir_em_conflito
+def atualizar_estoque(loja_id, estoque_atual_input, data_contagem, importacao=None):
+    contagem = [
+        (loja_id, int(produto_id), int(novo_valor), data_contagem)
+        for produto_id, novo_valor in estoque_atual_input.items()
+        if not (pd.isna(produto_id) or pd.isna(novo_valor))
+    ]
+    if not contagem and importacao is None:
+        return _resumo_conciliacao([])
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Trava, em ordem, as linhas contadas (criando as que faltam) antes
+            # de ler o saldo anterior: uma saída concorrente espera a contagem
+            # (ou vice-versa) e a diferença é calculada sobre o saldo mais recente
+            if not contagem:
+                linhas = []
+            elif len(contagem) >= LIMITE_COPY:
                 cursor.execute("""
-                    INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao, data_contagem)
-                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo', %s)
-                    ON CONFLICT (loja_id, produto_id)
-                    DO UPDATE SET quantidade = %s, data_atualizacao = CURRENT_TIMESTAMP AT TIME ZONE 'America/Sao_Paulo', data_contagem = %s
-                """, (loja_id, produto_id, novo_valor, data_contagem, novo_valor, data_contagem))
+                    CREATE TEMP TABLE stg_contagem (
+                        loja_id bigint, produto_id bigint, quantidade numeric, data_contagem date
+                    ) ON COMMIT DROP
+                """)
+                _copiar_linhas(cursor, "stg_contagem",
+                               ("loja_id", "produto_id", "quantidade", "data_contagem"), contagem)
+                origem = "SELECT loja_id, produto_id, quantidade, data_contagem FROM stg_contagem"
+                cursor.execute(_sql_travar_contagem(origem))
+                cursor.execute(_sql_conciliar_contagem(origem))
+                linhas = cursor.fetchall()
+            else:
+                _execute_values(cursor, _sql_travar_contagem("VALUES %s"), contagem)
+                linhas = _execute_values(cursor, _sql_conciliar_contagem("VALUES %s"),
+                                         contagem, fetch=True)
+            if importacao is not None:
+                _avancar_importacao(cursor, importacao, len(estoque_atual_input))
         conn.commit()
+    invalidar_estoque(loja_id)
+    return _resumo_conciliacao(linhas)
 
 
 # Função para selecionar loja (AJUSTADA para permitir troca de loja)
@@ -146,6 +1195,26 @@ def select_store():
         return st.session_state.loja_confirmada
 
 
+# Seleção de produto com busca: o texto digitado filtra o catálogo por nome
+# (prefixo e depois trecho, sem acentos) ou id antes de montar a lista
+def select_produto(rotulo="Selecione o produto", key="produto"):
+    catalogo = get_catalogo()
+    termo = st.text_input("Buscar produto (nome ou código)", key=f"{key}_busca")
+    opcoes = catalogo.buscar(termo, limite=200) if termo else catalogo.linhas()
+    if not opcoes:
+        st.info("Nenhum produto encontrado para a busca.")
+        return None
+    return st.selectbox(rotulo, opcoes, format_func=lambda p: f"{p[0]} - {p[1]}", key=key)
+
+
+# Mostra o relatório de erros de uma planilha validada por ingestao.normalizar_planilha
+def exibir_erros_planilha(erros):
+    if not erros.empty:
+        st.error(f"{len(erros)} problema(s) encontrados na planilha; as linhas abaixo foram ignoradas.")
+        st.dataframe(erros, use_container_width=True)
+
+
+@instrumentar
 def registrar_alerta_validade(loja_id, produto_id, quantidade, data_vencimento, lote, data=None):
     
     data_record = data if data else dt.datetime.now()
@@ -160,78 +1229,330 @@ def registrar_alerta_validade(loja_id, produto_id, quantidade, data_vencimento,
                 (produto_id, loja_id, data_record, data_vencimento, quantidade, lote)
             )
         conn.commit()
+    invalidar_validade(loja_id)
 
-# Função para registrar entrada via XML
-def registrar_entrada_xml(loja_id, itens):
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            for item in itens:
-                try:
-                    produto_id = int(item['id'])
-                except Exception:
-                    produto_id = item['id']
-                try:
-                    quantidade = int(float(item['quantidade']))
-                except Exception:
-                    quantidade = 0
-                motivo = item['motivo'] if item['motivo'] else "Entrada via XML"
-                data_entry = item.get("data")
-                if isinstance(data_entry, dt.datetime):
-                    pass
-                elif isinstance(data_entry, str) and data_entry.strip():
-                    try:
-                        data_entry = dt.datetime.fromisoformat(data_entry)
-                    except Exception:
-                        data_entry = dt.datetime.now()
-                else:
-                    data_entry = dt.datetime.now()
-                cursor.execute("""
-                    INSERT INTO movimentacoes_estoque (tipo, produto_id, loja_id, quantidade, motivo, data)
-                    VALUES ('entrada', %s, %s, %s, %s, %s)
-                """, (produto_id, loja_id, quantidade, motivo, data_entry))
-                cursor.execute("""
-                    INSERT INTO estoque (loja_id, produto_id, quantidade, data_atualizacao)
-                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT (loja_id, produto_id)
-                    DO UPDATE SET quantidade = estoque.quantidade + %s, data_atualizacao = CURRENT_TIMESTAMP
-                """, (loja_id, produto_id, quantidade, quantidade))
+COLUNAS_VALIDADE = ["produto_id", "lote", "data_vencimento", "quantidade"]
+
+
+# Valida e converte a planilha de lotes de validade (ver ingestao.normalizar_planilha).
+# Retorna as linhas prontas (produto_id, loja_id, data, vencimento, quantidade, lote)
+# ou levanta ValueError indicando as linhas inválidas.
+def _preparar_lotes_validade(loja_id, df, data_record):
+    df, erros = normalizar_planilha(
+        df, COLUNAS_VALIDADE, coluna_data="data_vencimento", colunas_texto=("lote",)
+    )
+    if not erros.empty:
+        if erros["linha"].isna().all():
+            raise ValueError(f"Colunas obrigatórias não encontradas: {set(erros['coluna'])}")
+        linhas = ", ".join(str(int(i)) for i in erros["linha"].drop_duplicates()[:20])
+        raise ValueError(f"{erros['linha'].nunique()} linha(s) inválida(s) na planilha de validade: {linhas}")
+
+    n = len(df)
+    return list(zip(
+        df["produto_id"].tolist(),
+        [loja_id] * n,
+        [data_record] * n,
+        df["data_vencimento"].dt.date.tolist(),
+        df["quantidade"].tolist(),
+        df["lote"].tolist(),
+    ))
+
+
+# Registra todos os lotes de validade de uma planilha em uma única transação:
+# um INSERT multi-linha, ou COPY a partir de LIMITE_COPY linhas.
+# Com `hash_arquivo`, a planilha entra no registro de importações na mesma
+# transação (ImportacaoDuplicada se já foi gravada).
+# Retorna a quantidade de lotes gravados.
+@instrumentar
+def registrar_alertas_validade_lote(loja_id, df, data=None, hash_arquivo=None, arquivo=None):
+    data_record = data if data else dt.datetime.now()
+    linhas = _preparar_lotes_validade(loja_id, df, data_record)
+    if not linhas:
+        return 0
+    colunas = ("produto_id", "loja_id", "data", "vencimento", "quantidade", "lote")
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if hash_arquivo is not None:
+                cursor.execute(f"""
+                    INSERT INTO importacoes (tipo, loja_id, hash, arquivo, linhas, linhas_gravadas,
+                                             estado, concluido_em)
+                    VALUES ('validade', %s, %s, %s, %s, %s, 'concluida', {AGORA_SP})
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                """, (loja_id, hash_arquivo, arquivo, len(linhas), len(linhas)))
+                if cursor.fetchone() is None:
+                    raise ImportacaoDuplicada(buscar_importacoes("validade", loja_id, [hash_arquivo])[0])
+            if len(linhas) >= LIMITE_COPY:
+                _copiar_linhas(cursor, "lote_validade", colunas, linhas)
+            else:
+                _execute_values(cursor, f"""
+                    INSERT INTO lote_validade ({', '.join(colunas)})
+                    VALUES %s
+                """, linhas)
         conn.commit()
+    invalidar_validade(loja_id)
+    return len(linhas)
+
+# Registra as notas de um lote no registro de importações (ON CONFLICT DO
+# NOTHING cobre hash e chave de acesso) e devolve os hashes aceitos; notas
+# já importadas ficam de fora
+def _registrar_notas(cursor, loja_id, itens, notas):
+    linhas_por_nota = {}
+    for item in itens:
+        if item.get('hash') in notas:
+            linhas_por_nota[item['hash']] = linhas_por_nota.get(item['hash'], 0) + 1
+    if not linhas_por_nota:
+        return set()
+    registros = [
+        ('nfe', loja_id, h, notas[h]['chave'], notas[h]['arquivo'], n, n)
+        for h, n in sorted(linhas_por_nota.items())  # ordem fixa dos locks no índice único
+    ]
+    aceitas = _execute_values(cursor, """
+        INSERT INTO importacoes (tipo, loja_id, hash, chave_nfe, arquivo, linhas, linhas_gravadas,
+                                 estado, concluido_em)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING hash
+    """, registros, template=f"(%s, %s, %s, %s, %s, %s, %s, 'concluida', {AGORA_SP})", fetch=True)
+    return {h for (h,) in aceitas}
+
+
+# Função para registrar entrada via XML. Com `notas` ({hash: {"chave", "arquivo"}}),
+# cada nota entra no registro de importações na mesma transação dos itens e as
+# já lançadas são ignoradas; devolve a lista dos hashes ignorados.
+@instrumentar
+@repetir_em_conflito
+def registrar_entrada_xml(loja_id, itens, notas=None):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            ignoradas = []
+            if notas:
+                aceitas = _registrar_notas(cursor, loja_id, itens, notas)
+                ignoradas = sorted({i['hash'] for i in itens if i.get('hash') in notas} - aceitas)
+                itens = [i for i in itens if i.get('hash') not in notas or i['hash'] in aceitas]
+            movimentos = _movimentos_xml(loja_id, itens)
+            if movimentos:
+                _gravar_movimentacoes(cursor, movimentos)
+        conn.commit()
+    invalidar_estoque(loja_id)
+    return ignoradas
+
 
-def registrar_saida_planilha(loja_id: int, itens: list[dict], data_saida):
+def _movimentos_xml(loja_id, itens):
+    movimentos = []
+    for item in itens:
+        try:
+            produto_id = int(item['id'])
+        except Exception:
+            produto_id = item['id']
+        try:
+            quantidade = int(float(item['quantidade']))
+        except Exception:
+            quantidade = 0
+        motivo = item['motivo'] if item['motivo'] else "Entrada via XML"
+        data_entry = item.get("data")
+        if isinstance(data_entry, dt.datetime):
+            pass
+        elif isinstance(data_entry, str) and data_entry.strip():
+            try:
+                data_entry = dt.datetime.fromisoformat(data_entry)
+            except Exception:
+                data_entry = dt.datetime.now()
+        else:
+            data_entry = dt.datetime.now()
+        movimentos.append(('entrada', produto_id, loja_id, quantidade, motivo, data_entry))
+    return movimentos
+
+@instrumentar
+@repetir_em_conflito
+def registrar_saida_planilha(loja_id: int, itens: list[dict], data_saida, importacao=None):
     """
     Recebe:
     - loja_id: int
     - itens: lista de dicts com chaves 'produto_id' e 'quantidade'
     - data_saida: datetime.datetime ou date
+    - importacao: (id, tentativa) da reserva da planilha em importacoes, quando gravada em lotes
 
-    Para cada item, registra:
-    1) uma movimentação de tipo 'saida' em movimentacoes_estoque
-    2) decrementa o estoque na tabela estoque
+    Registra, em lote e na mesma transação:
+    1) uma movimentação de tipo 'saida' por item em movimentacoes_estoque
+    2) o decremento do estoque, somado por produto, na tabela estoque
+    3) o avanço do registro da importação, se houver
     """
+    movimentos = [
+        ('saida', int(item['produto_id']), loja_id, int(item['quantidade']), MOTIVO_SAIDA_DIARIA, data_saida)
+        for item in itens
+    ]
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            for item in itens:
-                produto_id = int(item['produto_id'])
-                quantidade  = int(item['quantidade'])
+            _gravar_movimentacoes(cursor, movimentos, data_atualizacao=data_saida)
+            if importacao is not None:
+                _avancar_importacao(cursor, importacao, len(itens))
+        conn.commit()
+    invalidar_estoque(loja_id)
+    invalidar_demanda(loja_id)
 
-                # 1) Movimentação de saída
-                cursor.execute("""
-                    INSERT INTO movimentacoes_estoque
-                      (tipo, produto_id, loja_id, quantidade, motivo, data)
-                    VALUES
-                      ('saida', %s, %s, %s, 'Saída diária', %s)
-                """, (produto_id, loja_id, quantidade, data_saida))
 
-                # 2) Atualização do estoque (subtraindo)
-                cursor.execute("""
-                    INSERT INTO estoque
-                      (loja_id, produto_id, quantidade, data_atualizacao)
-                    VALUES
-                      (%s, %s, -%s, %s)
-                    ON CONFLICT (loja_id, produto_id)
-                    DO UPDATE
-                      SET quantidade = estoque.quantidade - %s,
-                          data_atualizacao = %s
-                """, (loja_id, produto_id, quantidade, data_saida, quantidade, data_saida))
+# --- Gravações em segundo plano ---
 
-        conn.commit()
+# Linhas por lote (uma transação por lote); no limite do COPY, cada lote
+# grande usa o caminho de COPY das funções de gravação
+TAMANHO_LOTE_TAREFA = LIMITE_COPY
+TAREFAS_MAX_WORKERS = 2
+
+
+# Pool de threads único por processo: as tarefas continuam rodando mesmo que
+# a sessão que as enviou mude de página ou recarregue o navegador
+@st.cache_resource
+def get_executor_tarefas():
+    return ExecutorTarefas(max_workers=TAREFAS_MAX_WORKERS)
+
+
+def _combinar_resumos_conciliacao(parciais):
+    resumo = _resumo_conciliacao([])
+    for parcial in parciais:
+        for chave in ('produtos', 'ajustes_entrada', 'ajustes_saida', 'sem_alteracao'):
+            resumo[chave] += parcial[chave]
+        resumo['itens'].extend(parcial['itens'])
+    return resumo
+
+
+# As planilhas enviadas com `hash_arquivo` reservam o registro de importações
+# antes de agendar (ImportacaoDuplicada se já foram gravadas) e cada lote
+# avança o registro na própria transação. Os lotes são gravados em ordem, então
+# uma importação retomada pula as `linhas_gravadas` primeiras linhas do arquivo.
+def enviar_saida_planilha(loja_id, itens, data_saida, hash_arquivo=None, arquivo=None):
+    importacao = None
+    if hash_arquivo is not None:
+        envio = assinatura_envio(((i['produto_id'], i['quantidade']) for i in itens), data_saida)
+        importacao, gravadas = iniciar_importacao("saida", loja_id, hash_arquivo, arquivo, len(itens), envio)
+        itens = itens[gravadas:]
+    return get_executor_tarefas().enviar(
+        "saida", f"Saídas de {data_saida:%d/%m/%Y} ({len(itens)} itens)",
+        dividir_em_lotes(itens, TAMANHO_LOTE_TAREFA),
+        lambda lote: registrar_saida_planilha(loja_id, lote, data_saida, importacao),
+        combinar=lambda parciais: None, loja_id=loja_id,
+        ao_falhar=(lambda: falhar_importacao(importacao)) if importacao else None,
+    )
+
+
+# As notas ficam inteiras em um lote e são registradas (hash e chave de
+# acesso) na transação que grava os itens delas
+def enviar_entrada_xml(loja_id, itens, notas=None):
+    return get_executor_tarefas().enviar(
+        "entrada_xml", f"Lançamento de notas ({len(itens)} itens)",
+        dividir_em_lotes(itens, TAMANHO_LOTE_TAREFA, chave=lambda item: item.get('hash', item.get('nota'))),
+        lambda lote: registrar_entrada_xml(loja_id, lote, notas),
+        combinar=lambda parciais: [h for ignoradas in parciais for h in ignoradas], loja_id=loja_id,
+    )
+
+
+def enviar_atualizacao_estoque(loja_id, estoque_atual_input, data_contagem, hash_arquivo=None, arquivo=None):
+    importacao = None
+    if hash_arquivo is not None:
+        envio = assinatura_envio(estoque_atual_input.items(), data_contagem)
+        importacao, gravadas = iniciar_importacao("contagem", loja_id, hash_arquivo, arquivo,
+                                                  len(estoque_atual_input), envio)
+        estoque_atual_input = dict(list(estoque_atual_input.items())[gravadas:])
+    return get_executor_tarefas().enviar(
+        "contagem", f"Contagem de {data_contagem:%d/%m/%Y} ({len(estoque_atual_input)} produtos)",
+        dividir_em_lotes(estoque_atual_input.items(), TAMANHO_LOTE_TAREFA),
+        lambda lote: atualizar_estoque(loja_id, dict(lote), data_contagem, importacao),
+        combinar=_combinar_resumos_conciliacao, loja_id=loja_id,
+        ao_falhar=(lambda: falhar_importacao(importacao)) if importacao else None,
+    )
+
+
+# Guarda o id da tarefa na sessão para a página acompanhar o progresso
+def acompanhar_tarefa(id_tarefa):
+    st.session_state.setdefault("tarefas", []).append(id_tarefa)
+
+
+def _situacoes_da_sessao(tipo):
+    executor = get_executor_tarefas()
+    situacoes = []
+    for id_tarefa in list(st.session_state.get("tarefas", [])):
+        situacao = executor.situacao(id_tarefa)
+        if situacao is None:
+            st.session_state.tarefas.remove(id_tarefa)
+        elif situacao["tipo"] == tipo:
+            situacoes.append(situacao)
+    return situacoes
+
+
+def _painel_tarefas(tipo, exibir_resultado, havia_ativas):
+    situacoes = _situacoes_da_sessao(tipo)
+    ativas = any(s["estado"] in (NA_FILA, EXECUTANDO) for s in situacoes)
+    if havia_ativas and not ativas:
+        # Terminou: rerun completo para parar a consulta periódica e atualizar a página
+        st.rerun()
+    for s in reversed(situacoes):
+        with st.container(border=True):
+            st.markdown(f"**{s['descricao']}** — {s['estado']}")
+            st.progress(
+                s["progresso"],
+                text=f"{s['processados']}/{s['total']} linhas · "
+                     f"{s['linhas_por_segundo']:,.0f} linhas/s · {s['duracao_s']:.1f} s",
+            )
+            if s["estado"] == ERRO:
+                st.error(f"A gravação parou com erro; {s['processados']} de {s['total']} linhas "
+                         f"já estavam gravadas. {s['erro']}")
+            elif s["estado"] == CONCLUIDA:
+                st.success("Gravação concluída.")
+                if exibir_resultado is not None and s["resultado"] is not None:
+                    exibir_resultado(s["resultado"])
+            if s["estado"] in (CONCLUIDA, ERRO) and st.button("Dispensar", key=f"dispensar_tarefa_{s['id']}"):
+                st.session_state.tarefas.remove(s["id"])
+                st.rerun()
+
+
+# Progresso das gravações em segundo plano desta sessão; enquanto houver
+# tarefa ativa, o painel se atualiza sozinho a cada segundo
+def acompanhar_tarefas(tipo, exibir_resultado=None):
+    situacoes = _situacoes_da_sessao(tipo)
+    if not situacoes:
+        return
+    ativas = any(s["estado"] in (NA_FILA, EXECUTANDO) for s in situacoes)
+    st.subheader("Gravações em segundo plano")
+    painel = st.fragment(_painel_tarefas, run_every=1 if ativas else None)
+    painel(tipo, exibir_resultado, ativas)
+
+
+# --- Planilhas em revisão por sessão (ver sessao.py) ---
+
+def _sessao_ativa(sessao_id):
+    return not Runtime.exists() or Runtime.instance().is_active_session(sessao_id)
+
+
+# Um armazém por processo, compartilhado pelas sessões e separado por id de sessão
+@st.cache_resource
+def get_armazem_sessoes():
+    return ArmazemSessoes(sessao_ativa=_sessao_ativa, **_config_sessoes())
+
+
+def _id_sessao():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+
+# Guarda a planilha em revisão desta sessão; `categorias` são colunas de texto
+# repetitivo (nome do produto, nota) guardadas como category
+def guardar_quadro(nome, df, categorias=()):
+    get_armazem_sessoes().guardar(_id_sessao(), nome, df, categorias)
+
+
+def obter_quadro(nome):
+    return get_armazem_sessoes().obter(_id_sessao(), nome)
+
+
+def tem_quadro(nome):
+    return get_armazem_sessoes().contem(_id_sessao(), nome)
+
+
+def remover_quadro(nome):
+    get_armazem_sessoes().remover(_id_sessao(), nome)
+
+
+# Uso de memória das planilhas em revisão, por sessão; marca a sessão atual
+def memoria_sessoes():
+    atual = _id_sessao()
+    return [dict(linha, atual=linha["sessao"] == atual) for linha in get_armazem_sessoes().relatorio()]